@@ -0,0 +1,102 @@
+from main import db
+from flask import current_app
+from sqlalchemy import event, text, select, update
+from models.age_groups import Age_group
+from models.registrations import Registration
+from models.participants import Participant
+from models.races import Race
+from bisect import bisect_right
+from threading import Lock
+import time
+
+# the age groups sorted by min age, and the min ages as the boundaries to bisect
+_cache = {'min_ages': None, 'groups': None, 'loaded_at': 0}
+_lock = Lock()
+
+
+# load the age groups into memory, the table only has a dozen rows which almost never change
+def load():
+    groups = [(group.min_age, group.max_age, group.id) for group in Age_group.query.order_by(Age_group.min_age)]
+    with _lock:
+        _cache['groups'] = groups
+        _cache['min_ages'] = [group[0] for group in groups]
+        _cache['loaded_at'] = time.monotonic()
+
+
+# drop the cached age groups, they will be loaded again on next use
+def invalidate(*args):
+    with _lock:
+        _cache['groups'] = None
+        _cache['min_ages'] = None
+
+
+# invalidate the cache whenever an age group is added, updated or deleted in this process
+for event_name in ['after_insert', 'after_update', 'after_delete']:
+    event.listen(Age_group, event_name, invalidate)
+
+
+# age of the participant on the race date
+# dateutil is imported on first use, the cli commands which don't register anyone don't need it
+def age_on(date_of_birth, race_date):
+    from dateutil.relativedelta import relativedelta
+    return relativedelta(race_date, date_of_birth).years
+
+
+# find the id of the age group for the given age, returns None if no group matches
+def resolve(age):
+    # reload the groups after the ttl, in case they have been changed by another process
+    if _cache['groups'] is None or time.monotonic() - _cache['loaded_at'] > current_app.config['AGE_GROUP_CACHE_TTL']:
+        load()
+    min_ages, groups = _cache['min_ages'], _cache['groups']
+    # the last group starting at or before the age
+    index = bisect_right(min_ages, age) - 1
+    if index < 0:
+        return None
+    min_age, max_age, id = groups[index]
+    if max_age is not None and age > max_age:
+        return None
+    return id
+
+
+# recompute the age group of all registrations of a race and/or a participant in one statement
+# used when the race date, the date of birth or the age groups change, returns the ids of updated registrations
+def reassign(race_id=None, participant_id=None):
+    # UPDATE ... FROM and AGE() are specific to PostgreSQL
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return reassign_in_python(race_id, participant_id)
+    sql = 'UPDATE registrations AS reg SET age_group_id = ag.id \
+           FROM participants AS par, races AS r, age_groups AS ag \
+           WHERE reg.participant_id = par.id AND reg.race_id = r.id \
+           AND ag.min_age <= EXTRACT(YEAR FROM AGE(r.date, par.date_of_birth)) \
+           AND (ag.max_age IS NULL OR ag.max_age >= EXTRACT(YEAR FROM AGE(r.date, par.date_of_birth))) \
+           AND reg.age_group_id <> ag.id'
+    params = {}
+    if race_id is not None:
+        sql += ' AND reg.race_id = :race_id'
+        params['race_id'] = race_id
+    if participant_id is not None:
+        sql += ' AND reg.participant_id = :participant_id'
+        params['participant_id'] = participant_id
+    sql += ' RETURNING reg.id'
+    return [id for (id,) in db.session.execute(text(sql), params)]
+
+
+# the same as reassign on the other databases, e.g. SQLite in development
+# the ages are computed with age_on and the groups resolved from the cache, and only the changed registrations are updated
+def reassign_in_python(race_id=None, participant_id=None):
+    query = select(Registration.id, Registration.age_group_id, Participant.date_of_birth, Race.date) \
+        .join(Participant, Participant.id == Registration.participant_id) \
+        .join(Race, Race.id == Registration.race_id)
+    if race_id is not None:
+        query = query.where(Registration.race_id == race_id)
+    if participant_id is not None:
+        query = query.where(Registration.participant_id == participant_id)
+    changes = []
+    for id, age_group_id, date_of_birth, race_date in db.session.execute(query):
+        new_age_group_id = resolve(age_on(date_of_birth, race_date))
+        # like the sql above, a registration without a matching group keeps its group
+        if new_age_group_id is not None and new_age_group_id != age_group_id:
+            changes.append({'id': id, 'age_group_id': new_age_group_id})
+    if changes:
+        db.session.execute(update(Registration), changes)
+    return [change['id'] for change in changes]
@@ -0,0 +1,500 @@
+from main import db
+from flask import Blueprint, current_app
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import text, func, event
+from flask_jwt_extended import create_access_token
+from models.results import Result
+from models.registrations import Registration
+from models.races import Race
+from controllers.results_controller import build_results_query
+from timing import seconds_to_time
+from models.race_capacities import RaceCapacity
+from schemas.participant_schema import participant_schema
+from schemas.result_schema import result_schema
+from validator import validate_input
+from models.participants import Participant
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+from datetime import date
+from statistics import median
+import click
+import json
+import time
+import tracemalloc
+import subprocess
+import sys
+import warmup
+
+bench_commands = Blueprint('bench', __name__)
+
+# the leaderboard query before it was built dynamically, kept to compare plans and latency
+LEGACY_RESULTS_SQL = 'SELECT first_name, last_name, res.*, \
+                      ROW_NUMBER () OVER (ORDER BY res.pace ASC) AS row_num \
+                      FROM results AS res \
+                      INNER JOIN registrations AS reg ON res.registration_id = reg.id \
+                      INNER JOIN participants AS par ON par.id = reg.participant_id \
+                      WHERE reg.race_id = COALESCE(:race_id, reg.race_id) \
+                      AND reg.age_group_id = COALESCE(:age_group_id, reg.age_group_id) \
+                      AND par.gender = COALESCE(:gender, par.gender)'
+
+
+# print the query plan, EXPLAIN ANALYZE on PostgreSQL and EXPLAIN QUERY PLAN on SQLite
+def print_plan(sql, params):
+    if db.engine.dialect.name == 'postgresql':
+        explain = 'EXPLAIN (ANALYZE, BUFFERS) '
+    else:
+        explain = 'EXPLAIN QUERY PLAN '
+    for row in db.session.execute(text(explain + sql), params):
+        print('    ' + ' '.join(str(column) for column in row))
+
+
+# run the query a number of times and return the latencies in milliseconds
+def time_query(sql, params, repeat):
+    latencies = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        db.session.execute(text(sql), params).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+# the authorization header of an admin of the database, the admin claim of a token is checked against the database
+def admin_headers():
+    participant_id = db.session.query(Participant.id).filter_by(admin=True).order_by(Participant.id).limit(1).scalar()
+    if not participant_id:
+        raise click.ClickException('No admin in the database, run "flask db seed" or "flask db generate" first')
+    return {'Authorization': 'Bearer ' + create_access_token(identity=str(participant_id), additional_claims={'admin': True})}
+
+
+# compare plan and latency of the legacy and the dynamic leaderboard query, run it as "flask bench results-query"
+@bench_commands.cli.command('results-query')
+@click.option('--repeat', default=20, help='Number of runs of each query')
+@click.option('--limit', default=100, help='Page size used by the dynamic query')
+def bench_results_query(repeat, limit):
+    count = db.session.query(func.count(Result.id)).scalar()
+    print(f'{count} results in the database')
+    if count < 100000:
+        print('Warning: less than 100k results, the numbers will not be representative')
+
+    # use the race and age group with most registrations as filters
+    race_id, age_group_id = db.session.query(Registration.race_id, Registration.age_group_id) \
+        .group_by(Registration.race_id, Registration.age_group_id) \
+        .order_by(func.count(Registration.id).desc()).first() or (None, None)
+    scenarios = {
+        'race': {'race_id': race_id},
+        'race + age group + gender': {'race_id': race_id, 'age_group_id': age_group_id, 'gender': 'male'},
+        'gender': {'gender': 'female'},
+    }
+    for name, filters in scenarios.items():
+        legacy_params = {'race_id': None, 'age_group_id': None, 'gender': None, **filters}
+        sql, params = build_results_query(limit=limit, **filters)
+        print(f'\n== {name}: {filters}')
+        for label, query, query_params in [('legacy', LEGACY_RESULTS_SQL, legacy_params), ('dynamic', sql, params)]:
+            print(f'  {label} plan:')
+            print_plan(query, query_params)
+            latencies = sorted(time_query(query, query_params, repeat))
+            print(f'  {label} latency: median {median(latencies):.2f}ms, min {latencies[0]:.2f}ms, max {latencies[-1]:.2f}ms')
+
+
+# measure the cost of validating the input of a request, run it as "flask bench validation"
+@bench_commands.cli.command('validation')
+@click.option('--repeat', default=1000, help='Number of validated requests')
+def bench_validation(repeat):
+    cases = {
+        '/participants/register': (participant_schema, ['first_name', 'last_name', 'email', 'mobile', 'password', 'date_of_birth', 'gender'], {
+            'first_name': 'Eliud',
+            'last_name': 'Kipchoge',
+            'email': 'eliud@example.com',
+            'mobile': '0412345678',
+            'password': 'Password12345678',
+            'date_of_birth': '1984-11-05',
+            'gender': 'male'
+        }),
+        '/results/': (result_schema, ['registration_id', 'finished', 'start_at', 'finish_at'], {
+            'registration_id': 1,
+            'finished': True,
+            'start_at': '07:00:00',
+            'finish_at': '09:00:00'
+        })
+    }
+    for path, (schema, required_fields, payload) in cases.items():
+        # validate a view which does nothing, so only the validation is measured
+        view = validate_input(schema, required_fields)(lambda: None)
+        latencies = []
+        for i in range(repeat):
+            with current_app.test_request_context(path, method='POST', json=payload):
+                start = time.perf_counter()
+                try:
+                    view()
+                except HTTPException as e:
+                    print(f'{path}: payload rejected ({e.description}), skipped')
+                    break
+                latencies.append((time.perf_counter() - start) * 1000000)
+        if latencies:
+            latencies.sort()
+            print(f'{path}: median {median(latencies):.1f}us, p99 {latencies[int(len(latencies) * 0.99) - 1]:.1f}us per request')
+
+
+# endpoints measured by "flask bench endpoints": (path, admin token required)
+# {race_id}, {age_group_id} and {participant_id} are filled with the biggest race and category in the database
+ENDPOINTS = {
+    'races': ('/races/', False),
+    'race': ('/races/{race_id}', False),
+    'age_groups': ('/age_groups/', False),
+    'results_page': ('/results/?race_id={race_id}&limit=100', False),
+    'results_category_page': ('/results/?race_id={race_id}&age_group_id={age_group_id}&gender=male&limit=100', False),
+    'results_race': ('/results/?race_id={race_id}', False),
+    'participant': ('/participants/{participant_id}', True),
+    'participant_registrations': ('/participants/{participant_id}/registrations', True),
+    'registrations': ('/registrations/', True),
+}
+
+
+# get the value of a percentile from sorted values
+def percentile(values, ratio):
+    return values[min(len(values) - 1, int(len(values) * ratio))]
+
+
+# measure latency, throughput and query count of the main endpoints against the configured database
+# run it as "flask bench endpoints", with DATABASE_URL pointing to SQLite or PostgreSQL
+@bench_commands.cli.command('endpoints')
+@click.option('--requests', 'repeat', default=50, help='Number of requests per endpoint')
+@click.option('--endpoint', 'names', multiple=True, type=click.Choice(list(ENDPOINTS)), help='Only measure these endpoints')
+@click.option('--cache/--no-cache', default=False, help='Serve the read routes from the response cache')
+@click.option('--output', type=click.Path(), help='Save the numbers as json, to be used as a baseline later')
+@click.option('--baseline', type=click.Path(exists=True), help='Fail if p50 latency is worse than this saved run')
+@click.option('--tolerance', default=0.2, help='Allowed p50 regression compared with the baseline')
+def bench_endpoints(repeat, names, cache, output, baseline, tolerance):
+    if not cache:
+        current_app.config['RESPONSE_CACHE_SIZE'] = 0
+    race_id, age_group_id = db.session.query(Registration.race_id, Registration.age_group_id) \
+        .group_by(Registration.race_id, Registration.age_group_id) \
+        .order_by(func.count(Registration.id).desc()).first() or (1, 1)
+    participant_id = db.session.query(Registration.participant_id).filter_by(race_id=race_id).limit(1).scalar() or 1
+    # an admin token, so admin routes can be measured as well
+    headers = admin_headers()
+    db.session.remove()
+
+    # count the queries sent to the database
+    queries = [0]
+    def count_query(*args):
+        queries[0] += 1
+    event.listen(db.engine, 'before_cursor_execute', count_query)
+
+    client = current_app.test_client()
+    stats = {}
+    try:
+        for name in names or ENDPOINTS:
+            path, admin = ENDPOINTS[name]
+            path = path.format(race_id=race_id, age_group_id=age_group_id, participant_id=participant_id)
+            latencies = []
+            queries[0] = 0
+            started = time.perf_counter()
+            for i in range(repeat):
+                start = time.perf_counter()
+                response = client.get(path, headers=headers if admin else {})
+                # read the whole body, the responses may be streamed
+                response.get_data()
+                latencies.append((time.perf_counter() - start) * 1000)
+                if response.status_code != 200:
+                    raise click.ClickException(f'{path} returned {response.status_code}')
+            elapsed = time.perf_counter() - started
+            latencies.sort()
+            stats[name] = {
+                'p50_ms': round(percentile(latencies, 0.5), 3),
+                'p99_ms': round(percentile(latencies, 0.99), 3),
+                'throughput_rps': round(repeat / elapsed, 1),
+                'queries_per_request': round(queries[0] / repeat, 2)
+            }
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', count_query)
+
+    print(f'{"endpoint":<28}{"p50 ms":>10}{"p99 ms":>10}{"req/s":>10}{"queries":>10}')
+    for name, stat in stats.items():
+        print(f'{name:<28}{stat["p50_ms"]:>10}{stat["p99_ms"]:>10}{stat["throughput_rps"]:>10}{stat["queries_per_request"]:>10}')
+
+    if output:
+        with open(output, 'w') as file:
+            json.dump({'database': db.engine.dialect.name, 'endpoints': stats}, file, indent=4)
+    if baseline:
+        with open(baseline) as file:
+            previous = json.load(file)['endpoints']
+        regressions = [name for name, stat in stats.items()
+                       if name in previous and stat['p50_ms'] > previous[name]['p50_ms'] * (1 + tolerance)]
+        for name in regressions:
+            print(f'Regression: {name} p50 {stats[name]["p50_ms"]}ms, baseline {previous[name]["p50_ms"]}ms')
+        if regressions:
+            raise click.ClickException(f'{len(regressions)} endpoints are slower than the baseline')
+
+
+# measure login throughput with concurrent clients, run it as "flask bench login"
+# BCRYPT_POOL_SIZE=0 hashes in the request worker, to compare with the process pool
+@bench_commands.cli.command('login')
+@click.option('--requests', 'repeat', default=200, help='Number of logins')
+@click.option('--concurrency', default=16, help='Number of concurrent clients')
+@click.option('--mobile', help='Mobile of the participant logging in, the first participant by default')
+@click.option('--password', default='Password12345678', help='Password of the participant')
+def bench_login(repeat, concurrency, mobile, password):
+    mobile = mobile or db.session.query(Participant.mobile).order_by(Participant.id).limit(1).scalar()
+    if not mobile:
+        raise click.ClickException('No participant in the database, run "flask db generate" first')
+    db.session.remove()
+    app = current_app._get_current_object()
+    print(f'bcrypt work factor {app.config["BCRYPT_LOG_ROUNDS"]}, pool size {app.config["BCRYPT_POOL_SIZE"]}, '
+          f'queue {app.config["BCRYPT_MAX_QUEUE"]}')
+
+    def login(i):
+        start = time.perf_counter()
+        response = app.test_client().post('/participants/login', json={'mobile': mobile, 'password': password})
+        return response.status_code, (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(login, range(repeat)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for status, latency in responses if status == 200)
+    rejected = sum(1 for status, latency in responses if status == 503)
+    failed = len(responses) - len(latencies) - rejected
+    if latencies:
+        print(f'{len(latencies)} logins: p50 {percentile(latencies, 0.5):.1f}ms, p99 {percentile(latencies, 0.99):.1f}ms, '
+              f'{len(latencies) / elapsed:.1f} logins/s')
+    print(f'{rejected} rejected with 503, {failed} failed')
+    if failed:
+        raise click.ClickException('Some logins failed, check the mobile and password')
+
+
+# measure the write throughput of the split ingestion, run it as "flask bench splits"
+# the splits of the biggest race are sent in batches as a timing mat would, the second run updates the same splits
+@bench_commands.cli.command('splits')
+@click.option('--batch-size', default=2000, help='Number of splits per request')
+@click.option('--batches', default=10, help='Number of requests')
+@click.option('--min-rate', default=2000, help='Fail if fewer splits than this are recorded per second')
+def bench_splits(batch_size, batches, min_rate):
+    race_id = db.session.query(Registration.race_id).group_by(Registration.race_id) \
+        .order_by(func.count(Registration.id).desc()).limit(1).scalar()
+    if not race_id:
+        raise click.ClickException('No registration in the database, run "flask db generate" first')
+    distance = float(db.session.get(Race, race_id).distance)
+    bib_numbers = [bib for (bib,) in db.session.query(Registration.bib_number).filter_by(race_id=race_id)]
+    checkpoints = [km for km in (5, 10, 15, 20, 21.0975, 25, 30, 35, 40) if km < distance] or [distance / 2]
+    headers = {**admin_headers(), 'Content-Type': 'text/csv'}
+    db.session.remove()
+
+    # every participant at every checkpoint, at a pace of 4 to 6 minutes per km
+    lines = [f'{bib},{km},{int(km * (240 + i % 120)) // 3600}:{int(km * (240 + i % 120)) // 60 % 60}:{int(km * (240 + i % 120)) % 60}'
+             for km in checkpoints for i, bib in enumerate(bib_numbers)]
+    client = current_app.test_client()
+    recorded = 0
+    latencies = []
+    started = time.perf_counter()
+    for i in range(batches):
+        batch = [lines[(i * batch_size + j) % len(lines)] for j in range(batch_size)]
+        start = time.perf_counter()
+        response = client.post(f'/splits/bulk?race_id={race_id}', data='bib_number,distance,elapsed\n' + '\n'.join(batch), headers=headers)
+        latencies.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            raise click.ClickException(f'/splits/bulk returned {response.status_code}')
+        recorded += response.json['recorded']
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    rate = recorded / elapsed
+    print(f'{recorded} splits in {batches} requests: {rate:.0f} splits/s, p50 {percentile(latencies, 0.5):.1f}ms per request')
+    if rate < min_rate:
+        raise click.ClickException(f'Less than {min_rate} splits/s')
+
+
+# register many participants to a new race at the same moment, run it as "flask bench registrations"
+# checks that the race is never overbooked, and measures the throughput of the registrations
+@bench_commands.cli.command('registrations')
+@click.option('--concurrency', default=500, help='Number of simultaneous registrations')
+@click.option('--field-limit', default=300, help='Field limit of the race, lower than concurrency to test overbooking')
+@click.option('--keep', is_flag=True, help='Keep the race and its registrations')
+def bench_registrations(concurrency, field_limit, keep):
+    participant_ids = [id for (id,) in db.session.query(Participant.id).order_by(Participant.id).limit(concurrency)]
+    if len(participant_ids) < concurrency:
+        raise click.ClickException(f'At least {concurrency} participants are needed, run "flask db generate" first')
+    race = Race(name=f'Load test {int(time.time())}', distance=42.195, date=date(2030, 1, 1), start_time=seconds_to_time(7 * 3600),
+                cut_off_time=seconds_to_time(14 * 3600), field_limit=field_limit, start_line='Start line', finish_line='Finish line', fee=100)
+    db.session.add(race)
+    db.session.flush()
+    db.session.add(RaceCapacity(race_id=race.id, taken=0))
+    db.session.commit()
+    race_id = race.id
+    headers = admin_headers()
+    db.session.remove()
+    app = current_app._get_current_object()
+    # all threads send their registration at the same time
+    barrier = Barrier(concurrency)
+
+    def register(i):
+        barrier.wait()
+        start = time.perf_counter()
+        response = app.test_client().post('/registrations/', headers=headers, json={
+            'participant_id': participant_ids[i],
+            'race_id': race_id,
+            'registration_date': '2029-12-01',
+            'bib_number': f'L{i}'
+        })
+        return response.status_code, response.get_json(silent=True), (time.perf_counter() - start) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        responses = list(executor.map(register, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    registered = sum(1 for status, body, latency in responses if status == 200)
+    full = sum(1 for status, body, latency in responses if status == 400)
+    failed = len(responses) - registered - full
+    latencies = sorted(latency for status, body, latency in responses)
+    stored = db.session.query(func.count(Registration.id)).filter(Registration.race_id == race_id).scalar()
+    taken = db.session.get(RaceCapacity, race_id).taken
+    print(f'{concurrency} simultaneous registrations, field limit {field_limit}: {registered} registered, {full} rejected as full, '
+          f'{failed} failed')
+    print(f'{stored} registrations stored, counter {taken}, {registered / elapsed:.0f} registrations/s, '
+          f'p50 {percentile(latencies, 0.5):.0f}ms, p99 {percentile(latencies, 0.99):.0f}ms')
+
+    if not keep:
+        db.session.query(Registration).filter(Registration.race_id == race_id).delete()
+        db.session.query(RaceCapacity).filter(RaceCapacity.race_id == race_id).delete()
+        db.session.query(Race).filter(Race.id == race_id).delete()
+        db.session.commit()
+    if stored > field_limit or stored != taken or stored != registered:
+        raise click.ClickException('The race has been overbooked or the counter is wrong')
+
+
+# download the results of the race with the most results in each format, run it as "flask bench export"
+# the peak memory is traced in a second run, as tracing slows the export down
+@bench_commands.cli.command('export')
+@click.option('--format', 'formats', multiple=True, default=['csv', 'parquet', 'arrow'], help='Formats to export')
+@click.option('--max-seconds', default=1.0, help='Fail if an export takes longer than this')
+def bench_export(formats, max_seconds):
+    race_id = db.session.query(Registration.race_id).join(Result, Result.registration_id == Registration.id) \
+        .group_by(Registration.race_id).order_by(func.count(Result.id).desc()).limit(1).scalar()
+    if not race_id:
+        raise click.ClickException('No result in the database, run "flask db generate" first')
+    count = db.session.query(Result).join(Registration).filter(Registration.race_id == race_id).count()
+    db.session.remove()
+    client = current_app.test_client()
+    slow = []
+    for format in formats:
+        start = time.perf_counter()
+        response = client.get(f'/results/export?race_id={race_id}&format={format}')
+        size = len(response.data)
+        elapsed = time.perf_counter() - start
+        if response.status_code != 200:
+            raise click.ClickException(f'/results/export?format={format} returned {response.status_code}')
+        tracemalloc.start()
+        response = client.get(f'/results/export?race_id={race_id}&format={format}', buffered=False)
+        for chunk in response.response:
+            pass
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f'{format}: {count} rows, {size / 1024:.0f}kB in {elapsed * 1000:.0f}ms, peak memory {peak / 1024 / 1024:.1f}MB')
+        if elapsed > max_seconds:
+            slow.append(format)
+    if slow:
+        raise click.ClickException(f'{", ".join(slow)} export took longer than {max_seconds}s')
+
+
+# latency of the participant and bib number searches, run it as "flask bench search"
+# the first search loads the in-process index when the database isn't PostgreSQL, it's timed separately
+@bench_commands.cli.command('search')
+@click.option('--requests', 'repeat', default=200, help='Number of searches of each kind')
+@click.option('--max-ms', default=10.0, help='Fail if the p50 latency of a search is above this')
+def bench_search(repeat, max_ms):
+    names = [name for (name,) in db.session.query(Participant.last_name).group_by(Participant.last_name).limit(50)]
+    bib_numbers = [bib for (bib,) in db.session.query(Registration.bib_number).limit(50)]
+    if not names or not bib_numbers:
+        raise click.ClickException('No registration in the database, run "flask db generate" first')
+    headers = admin_headers()
+    db.session.remove()
+
+    # the start of a name, a full name, and the start of a bib number
+    searches = {
+        'name prefix': [f'/participants/search?q={name[:3]}' for name in names],
+        'full name': [f'/participants/search?q={name}' for name in names],
+        'bib number': [f'/registrations/search?bib={bib[:-1]}' for bib in bib_numbers],
+    }
+    client = current_app.test_client()
+    start = time.perf_counter()
+    client.get(searches['name prefix'][0], headers=headers)
+    print(f'first search: {(time.perf_counter() - start) * 1000:.0f}ms')
+    slow = []
+    for name, urls in searches.items():
+        latencies = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            response = client.get(urls[i % len(urls)], headers=headers)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                raise click.ClickException(f'{urls[i % len(urls)]} returned {response.status_code}')
+        latencies.sort()
+        print(f'{name}: p50 {percentile(latencies, 0.5):.1f}ms, p99 {percentile(latencies, 0.99):.1f}ms')
+        if percentile(latencies, 0.5) > max_ms:
+            slow.append(name)
+    if slow:
+        raise click.ClickException(f'{", ".join(slow)} slower than {max_ms}ms')
+
+
+# the budget of the import of the app and create_app, checked by "flask bench startup" and the tests
+STARTUP_BUDGET_MS = 1000.0
+
+
+# time the import of the app and create_app in new processes, like a cli command or a new worker
+# returns the times sorted and the libraries meant to be loaded on first use which have been imported
+def time_startup(root_path, repeat, env=None):
+    script = ('import sys, time, json; start = time.perf_counter(); from main import create_app; create_app(); '
+              'print(json.dumps([(time.perf_counter() - start) * 1000, [m for m in LAZY_MODULES if m in sys.modules]]))')
+    script = f'LAZY_MODULES = {warmup.LAZY_MODULES!r}; {script}'
+    times = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], cwd=root_path, env=env, capture_output=True, text=True, check=True)
+        elapsed, loaded = json.loads(output.stdout.strip().splitlines()[-1])
+        times.append(elapsed)
+    return sorted(times), loaded
+
+
+# run it as "flask bench startup", it also fails if a library meant to be loaded on first use is imported at startup
+@bench_commands.cli.command('startup')
+@click.option('--repeat', default=5, help='Number of processes started')
+@click.option('--budget-ms', default=STARTUP_BUDGET_MS, help='Fail if the median startup time is above this')
+def bench_startup(repeat, budget_ms):
+    times, loaded = time_startup(current_app.root_path, repeat)
+    print(f'startup: median {median(times):.0f}ms, min {times[0]:.0f}ms, max {times[-1]:.0f}ms')
+    if current_app.config['WARM_UP']:
+        print('WARM_UP is set, the time includes the warm up')
+    elif loaded:
+        raise click.ClickException(f'{", ".join(loaded)} imported at startup')
+    if median(times) > budget_ms:
+        raise click.ClickException(f'Startup took more than {budget_ms:.0f}ms')
+
+
+# the same operations sent one request at a time and as one POST /batch, run it as "flask bench batch"
+# each operation records the split of one participant, like a back-office tool correcting splits one by one
+@bench_commands.cli.command('batch')
+@click.option('--operations', default=50, help='Number of operations')
+def bench_batch(operations):
+    race_id = db.session.query(Registration.race_id).limit(1).scalar()
+    if not race_id:
+        raise click.ClickException('No registration in the database, run "flask db generate" first')
+    bib_numbers = [bib for (bib,) in db.session.query(Registration.bib_number).filter_by(race_id=race_id).limit(operations)]
+    headers = admin_headers()
+    db.session.remove()
+    requests = [{'method': 'POST', 'path': f'/splits/bulk?race_id={race_id}', 'content_type': 'text/csv',
+                 'body': f'bib_number,distance,elapsed\n{bib},1,00:04:{i % 60:02d}'} for i, bib in enumerate(bib_numbers)]
+    client = current_app.test_client()
+
+    start = time.perf_counter()
+    for operation in requests:
+        response = client.post(operation['path'], data=operation['body'], headers={**headers, 'Content-Type': 'text/csv'})
+        if response.status_code != 200:
+            raise click.ClickException(f'{operation["path"]} returned {response.status_code}')
+    sequential = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    response = client.post('/batch/', json={'operations': requests}, headers=headers)
+    batched = (time.perf_counter() - start) * 1000
+    if response.status_code != 200:
+        raise click.ClickException(f'/batch returned {response.status_code}')
+    print(f'{len(requests)} operations: {sequential:.0f}ms one by one, {batched:.0f}ms in one batch')
@@ -0,0 +1,70 @@
+from main import db
+from sqlalchemy import select, update, delete, insert, func, case
+from sqlalchemy.dialects import postgresql, sqlite
+from models.race_capacities import RaceCapacity
+from models.races import Race
+from models.registrations import Registration
+
+# attempts to grant part of a bulk reservation before giving up, each attempt only fails if another request took places meanwhile
+MAX_ATTEMPTS = 5
+
+
+# the conditional update reserving places, it only matches if the race has enough places left
+# the check and the increment are one statement, so concurrent registrations can't overbook the race
+def _reserve_statement(race_id, count):
+    field_limit = select(Race.field_limit).where(Race.id == race_id).scalar_subquery()
+    return update(RaceCapacity) \
+        .where(RaceCapacity.race_id == race_id, RaceCapacity.taken + count <= field_limit) \
+        .values(taken=RaceCapacity.taken + count)
+
+
+# create the counter of a race which doesn't have one yet, e.g. created before the counters existed
+# nothing is created if the race doesn't exist, so reserving a place in it fails
+def _ensure(race_id):
+    taken = select(func.count(Registration.id)).where(Registration.race_id == race_id).scalar_subquery()
+    dialect_insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    db.session.execute(dialect_insert(RaceCapacity).from_select(['race_id', 'taken'], select(Race.id, taken).where(Race.id == race_id))
+                       .on_conflict_do_nothing())
+
+
+# reserve places in a race, returns False if there are not enough places left or the race doesn't exist
+# the counter row stays locked until the transaction ends, so commit soon after
+def reserve(race_id, count=1):
+    if db.session.execute(_reserve_statement(race_id, count)).rowcount:
+        return True
+    if db.session.get(RaceCapacity, race_id) is None:
+        _ensure(race_id)
+        return bool(db.session.execute(_reserve_statement(race_id, count)).rowcount)
+    return False
+
+
+# reserve as many places as possible up to count, returns the number of places granted
+def reserve_up_to(race_id, count):
+    for attempt in range(MAX_ATTEMPTS):
+        if reserve(race_id, count):
+            return count
+        # find how many places are left, and try to take them all
+        available = db.session.execute(
+            select(Race.field_limit - RaceCapacity.taken).join(RaceCapacity, RaceCapacity.race_id == Race.id)
+            .where(Race.id == race_id)).scalar() or 0
+        count = min(count, available)
+        if count <= 0:
+            return 0
+    return 0
+
+
+# give places back, e.g. when a registration is deleted or moved to another race
+def release(race_id, count=1):
+    db.session.execute(update(RaceCapacity).where(RaceCapacity.race_id == race_id)
+                       .values(taken=case((RaceCapacity.taken > count, RaceCapacity.taken - count), else_=0)))
+
+
+# count the registrations of the races again and reset their counters, all races if race_ids is not passed
+def recount(race_ids=None):
+    counts = select(Race.id, func.count(Registration.id)).outerjoin(Registration, Registration.race_id == Race.id).group_by(Race.id)
+    clear = delete(RaceCapacity)
+    if race_ids is not None:
+        counts = counts.where(Race.id.in_(race_ids))
+        clear = clear.where(RaceCapacity.race_id.in_(race_ids))
+    db.session.execute(clear)
+    db.session.execute(insert(RaceCapacity).from_select(['race_id', 'taken'], counts))
@@ -6,15 +6,43 @@ from models.age_groups import Age_group
 from models.races import Race
 from models.registrations import Registration
 from models.results import Result
-from datetime import datetime, timedelta
+from models.leaderboard import Leaderboard
+from models.race_capacities import RaceCapacity
+from controllers.results_controller import calculate_timing
+from timing import seconds_to_time
+from sqlalchemy import insert, update, inspect, text
+from datetime import datetime, timedelta, date
+import leaderboard
+import age_group_cache
+import capacity
+import search
+import click
+import random
+import time
 
 db_commands = Blueprint('db', __name__)
 
+# the age groups: [min_age, max_age]
+AGE_GROUPS = [
+    [0, 17],
+    [18, 19],
+    [20, 39],
+    [40, 44],
+    [45, 49],
+    [50, 54],
+    [55, 59],
+    [60, 64],
+    [65, 69],
+    [70, 74],
+    [75, None]
+]
+
 # create app's cli command named create, then run it in the terminal as "flask db create"
 @db_commands.cli.command('init')
 def init_db():
     db.drop_all()
     db.create_all()
+    search.create_indexes()
     print('Tables are dropped and recreated')
 
 @db_commands.cli.command('seed')
@@ -35,20 +63,7 @@ def seed_db():
     db.session.add(participant1)
 
     # seed all age groups into db
-    age_groups =[
-        [0, 17],
-        [18, 19],
-        [20, 39],
-        [40, 44],
-        [45, 49],
-        [50, 54],
-        [55, 59],
-        [60, 64],
-        [65, 69],
-        [70, 74],
-        [75, None]
-    ]
-    for i in age_groups:
+    for i in AGE_GROUPS:
         group = Age_group()
         group.min_age = i[0]
         group.max_age = i[1]
@@ -92,9 +107,218 @@ def seed_db():
         # if finished, finish_at should be smaller than race cut_off time
         finish_at = datetime.strptime('09:00:00', '%H:%M:%S'),
     )
-    result1.finish_time = result1.finish_at - result1.start_at
-    result1.pace = datetime.strptime('00:03:00', '%H:%M:%S')
+    for key, value in calculate_timing(result1.start_at.time(), result1.finish_at.time(), race1.distance).items():
+        setattr(result1, key, value)
     db.session.add(result1)
     db.session.commit()
 
-    print('Table seeded')
\ No newline at end of file
+    # add the result into the leaderboard, and count the places taken in the race
+    leaderboard.rebuild()
+    capacity.recount()
+    db.session.commit()
+
+    print('Table seeded')
+
+# recreate the leaderboard from the results, to recover from a missing or inconsistent leaderboard
+@db_commands.cli.command('rebuild-leaderboard')
+@click.option('--race-id', type=int, help='Only rebuild the leaderboard of this race')
+def rebuild_leaderboard(race_id):
+    leaderboard.rebuild(race_id)
+    db.session.commit()
+    print('Leaderboard rebuilt')
+
+# compare the leaderboard with the live results, run "flask db rebuild-leaderboard" to fix the differences
+@db_commands.cli.command('check-leaderboard')
+@click.option('--race-id', type=int, help='Only check the leaderboard of this race')
+def check_leaderboard(race_id):
+    differences = leaderboard.check(race_id)
+    for entry in differences['missing']:
+        print(f'Missing: {entry}')
+    for entry in differences['stale']:
+        print(f'Stale: {entry}')
+    if differences['missing'] or differences['stale']:
+        raise click.ClickException('Leaderboard is not consistent with the results')
+    print('Leaderboard is consistent with the results')
+
+
+# recompute the age group of the registrations, run it after the age groups have been changed
+@db_commands.cli.command('reassign-age-groups')
+@click.option('--race-id', type=int, help='Only reassign the registrations of this race')
+def reassign_age_groups(race_id):
+    age_group_cache.invalidate()
+    registration_ids = age_group_cache.reassign(race_id=race_id)
+    leaderboard.sync_registrations(registration_ids)
+    db.session.commit()
+    print(f'{len(registration_ids)} registrations reassigned')
+
+
+# add the finish_ms and pace_ms columns to a database created before they existed, and fill them in batches
+# each batch is committed on its own, so the results table is never locked for long
+@db_commands.cli.command('migrate-timing')
+@click.option('--batch-size', default=10000, help='Number of results updated per transaction')
+def migrate_timing(batch_size):
+    columns = {column['name'] for column in inspect(db.engine).get_columns('results')}
+    with db.engine.begin() as connection:
+        if 'finish_ms' not in columns:
+            connection.execute(text('ALTER TABLE results ADD COLUMN finish_ms BIGINT'))
+        if 'pace_ms' not in columns:
+            connection.execute(text('ALTER TABLE results ADD COLUMN pace_ms INTEGER'))
+        # results are ranked by pace_ms now
+        connection.execute(text('DROP INDEX IF EXISTS ix_results_pace_id'))
+    Result.index.create(db.engine, checkfirst=True)
+
+    migrated = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(Result.id, Result.start_at, Result.finish_at, Race.distance) \
+            .join(Registration, Result.registration_id == Registration.id) \
+            .join(Race, Registration.race_id == Race.id) \
+            .filter(Result.id > last_id, Result.pace_ms.is_(None)) \
+            .order_by(Result.id).limit(batch_size).all()
+        if not rows:
+            break
+        db.session.execute(update(Result), [{'id': row.id, **calculate_timing(row.start_at, row.finish_at, row.distance)} for row in rows])
+        db.session.commit()
+        last_id = rows[-1].id
+        migrated += len(rows)
+        print(f'{migrated} results migrated')
+
+    # every row has a value now
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('ALTER TABLE results ALTER COLUMN finish_ms SET NOT NULL, ALTER COLUMN pace_ms SET NOT NULL'))
+    # the leaderboard only holds copies of the results, recreate it with the new column
+    db.session.commit()
+    Leaderboard.__table__.drop(db.engine, checkfirst=True)
+    Leaderboard.__table__.create(db.engine)
+    leaderboard.rebuild()
+    db.session.commit()
+    print(f'Timing migrated, {migrated} results updated')
+
+
+# count the places taken in each race again, run it if the counters are missing or wrong
+# it also creates the table of the counters in a database created before it existed
+@db_commands.cli.command('recount-capacities')
+@click.option('--race-id', type=int, help='Only recount the places of this race')
+def recount_capacities(race_id):
+    RaceCapacity.__table__.create(db.engine, checkfirst=True)
+    capacity.recount([race_id] if race_id else None)
+    db.session.commit()
+    print('Places recounted')
+
+
+# create the trigram and prefix indexes of the search routes on PostgreSQL, e.g. in a database created before they existed
+# the pg_trgm extension is created as well, which needs a role allowed to create extensions
+@db_commands.cli.command('create-search-indexes')
+def create_search_indexes():
+    if search.create_indexes():
+        print('Search indexes created')
+    else:
+        print('Search indexes are only needed on PostgreSQL, other databases use an index in memory')
+
+
+# names used to generate participants
+FIRST_NAMES = ['Eliud', 'Brigid', 'Kenenisa', 'Paula', 'Haile', 'Tigst', 'Sifan', 'Mo', 'Joan', 'Galen', 'Emily', 'Jack', 'Olivia', 'Noah', 'Grace', 'Lucas']
+LAST_NAMES = ['Kipchoge', 'Kosgei', 'Bekele', 'Radcliffe', 'Gebrselassie', 'Assefa', 'Hassan', 'Farah', 'Benoit', 'Rupp', 'Smith', 'Jones', 'Brown', 'Wilson', 'Taylor', 'Nguyen']
+RACE_DISTANCES = [42.195, 21.0975, 10, 5]
+
+# insert rows in chunks with one multi-row statement per chunk
+def insert_chunks(model, rows, chunk_size=5000):
+    for i in range(0, len(rows), chunk_size):
+        db.session.execute(insert(model).values(rows[i:i + chunk_size]))
+
+# generate a realistic data set to measure the api, run it as "flask db generate --participants 100000 --races 10"
+@db_commands.cli.command('generate')
+@click.option('--participants', default=10000, help='Number of participants to create')
+@click.option('--races', default=5, help='Number of races to create')
+@click.option('--races-per-participant', default=2, help='Max number of races each participant registers')
+@click.option('--finish-ratio', default=0.9, help='Ratio of registrations which have a result')
+@click.option('--seed', type=int, help='Random seed, to generate the same data set again in a new database')
+def generate_db(participants, races, races_per_participant, finish_ratio, seed):
+    rng = random.Random(seed)
+    # a tag of this run, so emails and race names are unique across runs
+    # it's the seed when one is given, so the same seed generates the same emails and race names
+    run = seed if seed is not None else int(time.time())
+    start = time.perf_counter()
+
+    if not Age_group.query.first():
+        insert_chunks(Age_group, [{'min_age': group[0], 'max_age': group[1]} for group in AGE_GROUPS])
+        age_group_cache.invalidate()
+
+    # hashing is slow on purpose, so all generated participants share the same password
+    password = bcrypt.generate_password_hash('Password12345678').decode('utf-8')
+    used_mobiles = {mobile for (mobile,) in db.session.query(Participant.mobile)}
+    mobiles = (f'04{number:08d}' for number in rng.sample(range(10 ** 8), participants + len(used_mobiles)))
+    mobiles = [mobile for mobile in mobiles if mobile not in used_mobiles][:participants]
+    # the first participant is made admin if there is none yet, so the benchmarks can call the admin routes
+    has_admin = db.session.query(Participant.id).filter_by(admin=True).first() is not None
+    participant_rows = []
+    for i in range(participants):
+        participant_rows.append({
+            'first_name': rng.choice(FIRST_NAMES),
+            'last_name': rng.choice(LAST_NAMES),
+            'email': f'runner{run}.{i}@example.com',
+            'mobile': mobiles[i],
+            'password': password,
+            'date_of_birth': date(rng.randint(1945, 2008), rng.randint(1, 12), rng.randint(1, 28)),
+            'gender': rng.choice(['male', 'female']),
+            'admin': i == 0 and not has_admin
+        })
+    insert_chunks(Participant, participant_rows)
+
+    race_rows = []
+    for i in range(races):
+        race_rows.append({
+            'name': f'Generated Marathon {run}-{i + 1}',
+            'distance': rng.choice(RACE_DISTANCES),
+            'date': date(2022, 1, 1) + timedelta(days=rng.randint(0, 365)),
+            'start_time': seconds_to_time(7 * 3600),
+            'cut_off_time': seconds_to_time(14 * 3600),
+            'field_limit': participants,
+            'start_line': 'Start line',
+            'finish_line': 'Finish line',
+            'fee': 100
+        })
+    insert_chunks(Race, race_rows)
+    db.session.flush()
+
+    new_participants = db.session.query(Participant.id, Participant.date_of_birth).filter(Participant.email.like(f'runner{run}.%')).all()
+    new_races = db.session.query(Race.id, Race.date, Race.distance).filter(Race.name.like(f'Generated Marathon {run}-%')).all()
+    registration_rows = []
+    bib_numbers = {race.id: 0 for race in new_races}
+    for participant in new_participants:
+        for race in rng.sample(new_races, rng.randint(1, min(races_per_participant, len(new_races)))):
+            bib_numbers[race.id] += 1
+            registration_rows.append({
+                'participant_id': participant.id,
+                'race_id': race.id,
+                'age_group_id': age_group_cache.resolve(age_group_cache.age_on(participant.date_of_birth, race.date)),
+                'registration_date': race.date - timedelta(days=rng.randint(1, 180)),
+                'bib_number': f'G{bib_numbers[race.id]}'
+            })
+    insert_chunks(Registration, registration_rows)
+
+    distances = {race.id: race.distance for race in new_races}
+    result_rows = []
+    race_ids = list(distances)
+    for registration_id, race_id in db.session.query(Registration.id, Registration.race_id).filter(Registration.race_id.in_(race_ids)):
+        if rng.random() > finish_ratio:
+            continue
+        # start within 30 minutes of the gun, and run at a pace between 3 and 8 minutes per km
+        started = 7 * 3600 + rng.randint(0, 1800)
+        start_at = seconds_to_time(started)
+        finish_at = seconds_to_time(started + float(distances[race_id]) * rng.uniform(180, 480))
+        result_rows.append({
+            'registration_id': registration_id,
+            'finished': True,
+            'start_at': start_at,
+            'finish_at': finish_at,
+            **calculate_timing(start_at, finish_at, distances[race_id])
+        })
+    insert_chunks(Result, result_rows)
+
+    for race_id in race_ids:
+        leaderboard.rebuild(race_id)
+    capacity.recount(race_ids)
+    db.session.commit()
+    print(f'Generated {len(participant_rows)} participants, {len(race_rows)} races, {len(registration_rows)} registrations '
+          f'and {len(result_rows)} results in {time.perf_counter() - start:.1f}s')
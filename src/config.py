@@ -1,11 +1,87 @@
 import os
+from datetime import timedelta
 
 class Config(object):
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     # access to .env and get the value of SECRET_KEY
     JWT_SECRET_KEY = os.environ.get("SECRET_KEY")
+    # how long the access token is valid
+    JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=6)
+    # how long the admin flag of a participant is cached, i.e. how long a demoted or deleted admin keeps access,
+    # and the max number of participants cached
+    IDENTITY_CACHE_TTL = int(os.environ.get("IDENTITY_CACHE_TTL", 60))
+    IDENTITY_CACHE_SIZE = int(os.environ.get("IDENTITY_CACHE_SIZE", 10000))
+    # cache of the read routes: seconds before a cached response expires, max number of responses and max body size in bytes
+    RESPONSE_CACHE_TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 60))
+    RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 512))
+    RESPONSE_CACHE_MAX_BODY = int(os.environ.get("RESPONSE_CACHE_MAX_BODY", 1024 * 1024))
+    # list routes with more rows than this are streamed, and the number of rows serialized per chunk
+    STREAMING_THRESHOLD = int(os.environ.get("STREAMING_THRESHOLD", 1000))
+    STREAMING_CHUNK_SIZE = int(os.environ.get("STREAMING_CHUNK_SIZE", 1000))
+    # bcrypt work factor, used for new hashes and to rehash passwords on login
+    BCRYPT_LOG_ROUNDS = int(os.environ.get("BCRYPT_LOG_ROUNDS", 12))
+    # processes computing bcrypt hashes (0 to hash in the request worker), the number of hashes allowed to wait for them,
+    # and seconds the client is asked to wait when the queue is full
+    # each worker process has its own pool, so workers x BCRYPT_POOL_SIZE should stay at or below the number of cpus
+    BCRYPT_POOL_SIZE = int(os.environ.get("BCRYPT_POOL_SIZE", 2))
+    BCRYPT_MAX_QUEUE = int(os.environ.get("BCRYPT_MAX_QUEUE", 32))
+    BCRYPT_RETRY_AFTER = int(os.environ.get("BCRYPT_RETRY_AFTER", 2))
+    # seconds between heartbeats of the live leaderboard, and the max number of events waiting to be sent to a client
+    LIVE_HEARTBEAT_SECONDS = int(os.environ.get("LIVE_HEARTBEAT_SECONDS", 15))
+    LIVE_QUEUE_SIZE = int(os.environ.get("LIVE_QUEUE_SIZE", 1000))
+    # "queue" makes POST /results validate and queue the result, and return 202 with a ticket
+    # a worker thread writes the queued results in batches, and a journal keeps them across crashes
+    RESULT_INGESTION = os.environ.get("RESULT_INGESTION", "sync")
+    # directory of the journals, max results written per transaction, max milliseconds a result waits for the batch to fill,
+    # max number of queued results and seconds the client is asked to wait when it's full, seconds the ticket statuses are kept,
+    # and size in bytes above which the journal is compacted
+    INGESTION_JOURNAL_DIR = os.environ.get("INGESTION_JOURNAL_DIR", "journal")
+    INGESTION_BATCH_SIZE = int(os.environ.get("INGESTION_BATCH_SIZE", 500))
+    INGESTION_FLUSH_MS = int(os.environ.get("INGESTION_FLUSH_MS", 200))
+    INGESTION_MAX_QUEUE = int(os.environ.get("INGESTION_MAX_QUEUE", 100000))
+    INGESTION_RETRY_AFTER = int(os.environ.get("INGESTION_RETRY_AFTER", 1))
+    INGESTION_TICKET_TTL = int(os.environ.get("INGESTION_TICKET_TTL", 3600))
+    INGESTION_JOURNAL_MAX_BYTES = int(os.environ.get("INGESTION_JOURNAL_MAX_BYTES", 1024 * 1024))
+    # number of races whose full results sheet is kept in memory
+    RESULTS_SHEET_CACHE_SIZE = int(os.environ.get("RESULTS_SHEET_CACHE_SIZE", 16))
+    # number of rows read from the database and written out at once by the results export
+    EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 10000))
+    # number of matches returned by the search routes when no limit is passed, and the highest limit allowed
+    SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 20))
+    SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 100))
+    # seconds before the in-process name index (used when the database isn't PostgreSQL) is loaded again
+    SEARCH_INDEX_TTL = int(os.environ.get("SEARCH_INDEX_TTL", 300))
+    # import the libraries loaded on first use and fill the caches when the app is created, before it gets traffic
+    WARM_UP = os.environ.get("WARM_UP", "false").lower() == "true"
+    # max number of operations in one POST /batch
+    BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", 100))
+    # requests slower than this (in milliseconds) are logged
+    SLOW_REQUEST_MS = int(os.environ.get("SLOW_REQUEST_MS", 500))
+    # seconds a client is asked to wait before retrying a write which couldn't get the lock of the SQLite database
+    WRITE_RETRY_AFTER = int(os.environ.get("WRITE_RETRY_AFTER", 1))
+    # expose GET /metrics without a token, only when it can't be reached from outside, otherwise it's admin only
+    METRICS_PUBLIC = os.environ.get("METRICS_PUBLIC", "false").lower() == "true"
     # to make sure json output is ordered correctly
     JSON_SORT_KEYS = False
+    # seconds before the cached age groups are reloaded from the database
+    AGE_GROUP_CACHE_TTL = int(os.environ.get("AGE_GROUP_CACHE_TTL", 300))
+    # connection pool of each database: connections kept open, extra connections allowed under load,
+    # seconds before a connection is replaced, and whether connections are checked before being used
+    @property
+    def SQLALCHEMY_ENGINE_OPTIONS(self):
+        return {
+            "pool_size": int(os.environ.get("DATABASE_POOL_SIZE", 5)),
+            "max_overflow": int(os.environ.get("DATABASE_MAX_OVERFLOW", 10)),
+            "pool_recycle": int(os.environ.get("DATABASE_POOL_RECYCLE", 1800)),
+            "pool_pre_ping": os.environ.get("DATABASE_POOL_PRE_PING", "true").lower() == "true",
+        }
+
+    # optional read replica, used by the read only routes
+    @property
+    def SQLALCHEMY_BINDS(self):
+        value = os.environ.get("DATABASE_READ_URL")
+        return {"read": value} if value else {}
+
     @property
     def SQLALCHEMY_DATABASE_URI(self):
         # access to .env and get the value of DATABASE_URL
@@ -3,11 +3,15 @@ from controllers.races_controller import races
 from controllers.registrations_controller import registrations
 from controllers.age_groups_controller import age_groups
 from controllers.results_controller import results
+from controllers.splits_controller import splits
+from controllers.batch_controller import batch
 
 registrable_controllers = [
     participants,
     races,
     registrations,
     age_groups,
-    results
+    results,
+    splits,
+    batch
 ]
\ No newline at end of file
@@ -1,12 +1,16 @@
 from flask import Blueprint, jsonify
 from models.age_groups import Age_group
 from schemas.age_group_schema import age_groups_schema
+import response_cache
+from routing import read_only
 
 
 age_groups = Blueprint('age_groups', __name__, url_prefix='/age_groups')
 
 # a route to view all age_groups
 @age_groups.route('/', methods = ['GET'])
+@read_only
+@response_cache.cached('age_groups')
 def get_races():
     # query all registrations from the database
     age_groups_list = Age_group.query.all()
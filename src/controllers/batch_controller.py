@@ -0,0 +1,139 @@
+from flask import Blueprint, jsonify, request, abort, current_app, g
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+from marshmallow.exceptions import ValidationError
+from sqlalchemy import exc
+from urllib.parse import urlsplit
+from main import db
+from validator import is_admin
+import response_cache
+
+batch = Blueprint('batch', __name__, url_prefix='/batch')
+
+# atomic: everything is committed or nothing, the batch stops at the first failed operation
+# best_effort: the failed operations are rolled back and the others committed
+MODES = ['atomic', 'best_effort']
+
+# routes which can't run inside a batch: the live leaderboard closes the session and never ends,
+# and the export streams a file, both have to be requested on their own
+NOT_BATCHABLE = ['results.stream_race_results', 'results.export_results']
+
+
+# call the view of the current request, the same way flask would but without the request hooks
+# the hooks have already run for the batch request
+def dispatch():
+    if request.routing_exception is not None:
+        raise request.routing_exception
+    if request.url_rule.endpoint in NOT_BATCHABLE:
+        return abort(400, description='This route cannot be part of a batch, please request it on its own')
+    return current_app.view_functions[request.url_rule.endpoint](**request.view_args)
+
+
+# the description of an error as json, validate_input aborts with the marshmallow error itself
+def error_description(e):
+    if isinstance(e.description, ValidationError):
+        return e.description.messages
+    return str(e.description)
+
+
+# run an operation in the request context it would have as a request of its own, and in a savepoint
+# returns its status, and its json (or text) response or error message
+def run_operation(operation):
+    method = str(operation.get('method', 'GET')).upper()
+    path = operation.get('path')
+    if not isinstance(path, str) or not path.startswith('/'):
+        return {'status': 400, 'error': 'Please provide the path of the operation'}
+    if urlsplit(path).path.rstrip('/') == batch.url_prefix:
+        return {'status': 400, 'error': 'A batch cannot contain another batch'}
+    options = {'method': method, 'headers': {'Authorization': request.headers.get('Authorization', '')}}
+    body = operation.get('body')
+    # csv and newline delimited json are passed as text, with their content type
+    if isinstance(body, str):
+        options.update(data=body, content_type=operation.get('content_type', 'text/plain'))
+    elif body is not None:
+        options['json'] = body
+
+    db.session.info['batch_savepoint'] = db.session.begin_nested()
+    result = None
+    # follow the redirect of a path missing its trailing slash, e.g. /races to /races/
+    for attempt in range(2):
+        with current_app.test_request_context(path, **options):
+            try:
+                response = current_app.make_response(dispatch())
+                # e.g. a long list, its rows are read from a server side cursor while the response is sent
+                if response.is_streamed:
+                    response.close()
+                    result = {'status': 400, 'error': 'Streamed responses cannot be part of a batch, please request it on its own'}
+                else:
+                    data = response.get_json(silent=True)
+                    result = {'status': response.status_code, 'body': data if data is not None else response.get_data(as_text=True)}
+            except RequestRedirect as e:
+                url = urlsplit(e.new_url)
+                path = url.path + ('?' + url.query if url.query else '')
+                continue
+            except HTTPException as e:
+                result = {'status': e.code, 'error': error_description(e)}
+            except Exception:
+                current_app.logger.exception('Operation %s %s of a batch failed', method, path)
+                result = {'status': 500, 'error': 'Internal Server Error'}
+            finally:
+                g.read_only = False
+        break
+    if result is None:
+        result = {'status': 404, 'error': 'Not Found'}
+
+    # keep the changes of the operation if it has succeeded, otherwise undo them
+    savepoint = db.session.info['batch_savepoint']
+    if result['status'] < 400:
+        try:
+            savepoint.commit()
+        except exc.SQLAlchemyError:
+            savepoint.rollback()
+            result = {'status': 400, 'error': 'The operation could not be saved'}
+    else:
+        savepoint.rollback()
+    return result
+
+
+# a route to run several operations in one request, e.g. to create a race and add its registrations
+# the operations target the other routes, and run in order in one transaction with a single admin check
+@batch.route('/', methods=['POST'])
+@is_admin
+def run_batch():
+    input = request.get_json(silent=True)
+    if not isinstance(input, dict) or not isinstance(input.get('operations'), list) or not input['operations']:
+        return abort(400, description='Please provide a list of operations')
+    mode = input.get('mode', 'atomic')
+    if mode not in MODES:
+        return abort(400, description='Mode must be one of ' + ', '.join(MODES))
+    operations = input['operations']
+    if len(operations) > current_app.config['BATCH_MAX_OPERATIONS']:
+        return abort(400, description=f'A batch can have up to {current_app.config["BATCH_MAX_OPERATIONS"]} operations')
+    if not all(isinstance(operation, dict) for operation in operations):
+        return abort(400, description='Every operation must be an object with a method and a path')
+
+    # the tables changed by the operations, bumped in the response cache once they are committed
+    g.batch = {'tables': set()}
+    results = []
+    try:
+        for operation in operations:
+            results.append(run_operation(operation))
+            if mode == 'atomic' and results[-1]['status'] >= 400:
+                break
+    finally:
+        db.session.info.pop('batch_savepoint', None)
+        tables = g.pop('batch')['tables']
+
+    failed = sum(1 for result in results if result['status'] >= 400)
+    if mode == 'atomic' and failed:
+        db.session.rollback()
+        # the operations after the failed one haven't run
+        results += [{'status': None, 'error': 'Not run'}] * (len(operations) - len(results))
+        return jsonify(mode=mode, committed=False, failed=failed, results=results), 400
+    try:
+        db.session.commit()
+    except exc.SQLAlchemyError:
+        db.session.rollback()
+        return abort(400, description='The batch could not be committed')
+    response_cache.bump(*tables)
+    return jsonify(mode=mode, committed=True, failed=failed, results=results)
@@ -1,13 +1,21 @@
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, jsonify, request, abort, current_app
 from sqlalchemy import exc
-from main import db, bcrypt
+from main import db
 from models.participants import Participant
 from models.registrations import Registration
 from schemas.participant_schema import participant_schema, participants_schema
 from schemas.registration_schema import registrations_schema
-from datetime import  timedelta
+from schemas.eager_loading import eager_load_options
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
-from validator import validate_input, is_admin
+from validator import validate_input, is_admin, current_user_is_admin, validated_input
+import leaderboard
+import age_group_cache
+import identity_cache
+import response_cache
+from routing import read_only
+import streaming
+import hashing
+import search
 
 participants = Blueprint('participants', __name__, url_prefix='/participants')
 
@@ -18,11 +26,11 @@ participants = Blueprint('participants', __name__, url_prefix='/participants')
 @validate_input(participant_schema, ['first_name', 'last_name', 'email', 'mobile', 'password', 'date_of_birth', 'gender'])
 def register_participant():
     # import request
-    participant_fields = participant_schema.load(request.json)
+    participant_fields = validated_input()
     # sanitise the email address
     participant_fields['email'] = participant_fields['email'].lower()
     # hash password
-    participant_fields['password'] = bcrypt.generate_password_hash(participant_fields['password']).decode('utf-8')
+    participant_fields['password'] = hashing.generate_password_hash(participant_fields['password'])
     # convert gender to lower case
     participant_fields['gender'] = participant_fields['gender'].lower()
     participant = Participant(**participant_fields)
@@ -35,10 +43,10 @@ def register_participant():
         return abort(400, description='Participant already registered')
 
     # create a variable to store token expiration time
-    expiry = timedelta(hours=6)
-    # create access token
+    expiry = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    # create access token, the admin flag is added as a claim so admin routes don't need to load the user
     access_token = create_access_token(
-        identity=str(participant.id), expires_delta=expiry)
+        identity=str(participant.id), expires_delta=expiry, additional_claims={'admin': participant.admin})
     # add result and return the result
     result = {
         'msg': 'Registered successfully',
@@ -56,7 +64,7 @@ def register_participant():
 @validate_input(participant_schema, ['password'])
 def login():
     # get data from the request
-    participant_fields = participant_schema.load(request.json)
+    participant_fields = validated_input()
 
     # find the user in the database based on email or mobile
     if 'email' in participant_fields:
@@ -72,14 +80,18 @@ def login():
     if not participant:
         return abort(404, description="User not found")
     # if password is incorrect
-    if not bcrypt.check_password_hash(participant.password, participant_fields['password']):
+    if not hashing.check_password_hash(participant.password, participant_fields['password']):
         return abort(401, description="Incorrect password")
+    # the work factor has changed since the password was hashed, hash it again with the current one
+    if hashing.needs_rehash(participant.password):
+        participant.password = hashing.generate_password_hash(participant_fields['password'])
+        db.session.commit()
 
     # create a variable to store token expiration time
-    expiry = timedelta(hours=6)
-    # create access token
+    expiry = current_app.config['JWT_ACCESS_TOKEN_EXPIRES']
+    # create access token, the admin flag is added as a claim so admin routes don't need to load the user
     access_token = create_access_token(
-        identity=str(participant.id), expires_delta=expiry)
+        identity=str(participant.id), expires_delta=expiry, additional_claims={'admin': participant.admin})
 
     # return the user details
     result = {
@@ -98,11 +110,24 @@ def login():
 @is_admin
 def get_participants():
     # query all participants from the database
-    participants_list = Participant.query.all()
-    # convert the data into a JSON format
-    result = participants_schema.dump(participants_list)
-    # return the data in JSON format
-    return jsonify(result)
+    participants_list = Participant.query.order_by(Participant.id)
+    # convert the data into a JSON format and return it, it's streamed if the list is large
+    return streaming.list_response(participants_list, participants_schema)
+
+
+# find participants by a part of their name, e.g. at the race day helpdesk
+# the best matches come first, and only a page of them is returned
+@participants.route('/search', methods=['GET'])
+@read_only
+@is_admin
+def search_participants():
+    q = request.args.get('q', '').strip()
+    if not q:
+        return abort(400, description='Please provide a name to search')
+    limit = request.args.get('limit', current_app.config['SEARCH_LIMIT'], type=int)
+    if not 0 < limit <= current_app.config['SEARCH_MAX_LIMIT']:
+        return abort(400, description=f'Limit must be between 1 and {current_app.config["SEARCH_MAX_LIMIT"]}')
+    return jsonify(participants_schema.dump(search.search_participants(q, limit)))
 
 
 # check personal details
@@ -111,13 +136,12 @@ def get_participants():
 def check_personal_details(participant_id):
     # access identity of current participant
     id = get_jwt_identity()
-    current_participant = Participant.query.get(id)
     # get the queried participant
     participant = Participant.query.get(participant_id)
     if not participant:
         return abort(404, description='Participant not found')
     # if user is trying to access their own details, or the user is admin, allow access
-    if int(id) == participant_id or current_participant.admin:
+    if int(id) == participant_id or current_user_is_admin():
         result = participant_schema.dump(participant)
         return jsonify(result)
     # otherwise, the participant is not allowed to check other people's details
@@ -130,10 +154,9 @@ def check_personal_details(participant_id):
 @validate_input(participant_schema)
 def update_personal_details(participant_id):
     # get user input
-    input_fields = participant_schema.load(request.json)
+    input_fields = validated_input()
     # access identity of current user 
     id = get_jwt_identity()
-    user = Participant.query.get(id)
     # access details of the user to be updated
     participant = Participant.query.get(participant_id)
 
@@ -141,7 +164,7 @@ def update_personal_details(participant_id):
     if not participant:
         return abort(404, description='Participant not found')
     # if user is admin, or user is trying to update their own details, continue to update
-    elif user.admin or user.id == participant.id:
+    elif current_user_is_admin() or int(id) == participant.id:
         # else, can continue to update fields
         for key, value in input_fields.items():
             # if user is admin, allow to update the 'admin' field
@@ -149,15 +172,22 @@ def update_personal_details(participant_id):
                 if participant.admin:
                     participant.admin = value
             elif key == 'password':
-                participant.password = bcrypt.generate_password_hash(
-                    value).decode('utf-8')
+                participant.password = hashing.generate_password_hash(value)
             # update other attributes
             elif getattr(participant, key) is not None and getattr(participant, key) != value:
                 setattr(participant, key, value)
         try:
+            db.session.flush()
+            # the age groups of the registrations depend on the date of birth
+            if 'date_of_birth' in input_fields:
+                age_group_cache.reassign(participant_id=participant.id)
+            # gender and age group are categories of the leaderboard
+            if 'gender' in input_fields or 'date_of_birth' in input_fields:
+                leaderboard.sync_registrations([registration.id for registration in participant.registrations])
             db.session.commit()
         except exc.IntegrityError:
             return abort(400, description='Email or mobile already registered')
+        response_cache.bump('participants', 'registrations')
         # convert to json format
         result = participant_schema.dump(participant)
         return jsonify(msg='Updated successfully', Updated=result)
@@ -174,7 +204,10 @@ def delete_registration(id):
     if participant:
         try:
             db.session.delete(participant)
-            db.session.commit()    
+            db.session.commit()
+            response_cache.bump('participants')
+            # the tokens of the deleted participant are no longer valid for admin routes
+            identity_cache.forget(id)
             return jsonify(msg = 'Participant deleted successfully', result = participant_serialized)
         except exc.IntegrityError:
             return abort(400, description='Please delete the registrations linked with this participant before deleting this participant')
@@ -183,17 +216,19 @@ def delete_registration(id):
 
 # a route to view races under one participant
 @participants.route('/<int:participant_id>/registrations', methods=['GET'])
+@read_only
 @jwt_required()
 def get_races_participant(participant_id):
     id = get_jwt_identity()
-    participant = Participant.query.get(id)
-    # check if it's a valid participant, if not, return error
-    if not participant:
-        return abort(404, description='Participant not found')
     # only allow to check the registration if the participant is trying to check their own registration or the user is admin
-    if int(id) == participant_id or participant.admin:
+    if int(id) == participant_id or current_user_is_admin():
+        participant = Participant.query.get(participant_id)
+        # check if it's a valid participant, if not, return error
+        if not participant:
+            return abort(404, description='Participant not found')
         # query all registrations under the participant from the database
-        registrations_list = Registration.query.filter_by(participant_id = participant_id).all()
+        registrations_list = Registration.query.options(*eager_load_options(registrations_schema, Registration)) \
+            .filter_by(participant_id = participant_id).all()
         # convert to json format
         # result = registrations_schema.dump(registrations_list)
         result = {
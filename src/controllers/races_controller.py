@@ -1,17 +1,24 @@
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, jsonify, abort
 from main import db
 from models.races import Race
+from models.race_capacities import RaceCapacity
 from controllers.participants_controller import is_admin
 from schemas.race_schema import race_schema, races_schema
 from sqlalchemy import exc
-from validator import validate_input, is_admin
+from validator import validate_input, is_admin, validated_input
 from datetime import datetime
+import leaderboard
+import age_group_cache
+import response_cache
+from routing import read_only
 
 races = Blueprint('races', __name__, url_prefix='/races')
 
 
 # a route to view all races
 @races.route('/', methods=['GET'])
+@read_only
+@response_cache.cached('races')
 def get_races():
     # query all races from the database
     races_list = Race.query.all()
@@ -21,6 +28,8 @@ def get_races():
 
 # a route to view one single race
 @races.route('/<int:id>', methods=['GET'])
+@read_only
+@response_cache.cached('races')
 def get_race(id):
     # query race from the database
     race = Race.query.get(id)
@@ -34,7 +43,7 @@ def get_race(id):
 @validate_input(race_schema, ['name', 'distance', 'date', 'start_time', 'cut_off_time', 'field_limit', 'start_line', 'finish_line', 'fee'])
 def add_race():
     # get data from the request
-    race_fields = race_schema.load(request.json)
+    race_fields = validated_input()
     # cut off time must be larger than start time
     if datetime.strptime(race_fields['start_time'], '%H:%M:%S') >= datetime.strptime(race_fields['cut_off_time'], '%H:%M:%S'):
         return abort(400, 'Cut off time cannot be earlier than start time')
@@ -42,10 +51,14 @@ def add_race():
     # add race to the database
     db.session.add(race)
     try:
+        # flush to get the id of the race, and create the counter of its places
+        db.session.flush()
+        db.session.add(RaceCapacity(race_id=race.id, taken=0))
         db.session.commit()
     # if IntegrityError, means the name and date combination is not unique
     except exc.IntegrityError:
         return abort(400, description='Race already exists!')
+    response_cache.bump('races')
     return jsonify(msg='Race added successfully', race=race_schema.dump(race))
 
 
@@ -55,7 +68,7 @@ def add_race():
 @is_admin
 def update_race(race_id):
     # get user input
-    input_fields = race_schema.load(request.json)
+    input_fields = validated_input()
     race = Race.query.get(race_id)
 
     # update attributes
@@ -68,10 +81,15 @@ def update_race(race_id):
         return abort(400, 'Cut off time cannot be earlier than start time')
 
     try:
+        db.session.flush()
+        # the ages of the participants are counted on the race date, so their age groups may have changed
+        if 'date' in input_fields:
+            leaderboard.sync_registrations(age_group_cache.reassign(race_id=race.id))
         db.session.commit()
     #if IntegrityError, means the name and date combination is not unique
     except exc.IntegrityError:
         return abort(400, description='Race already exists!')
+    response_cache.bump('races', 'registrations')
     # convert to json format and
     return jsonify(msg='Updated successfully', race=race_schema.dump(race))
 
@@ -85,7 +103,8 @@ def delete_registration(id):
     if race:
         try:
             db.session.delete(race)
-            db.session.commit()    
+            db.session.commit()
+            response_cache.bump('races')
             return jsonify(msg = 'Race deleted successfully', race = result)
         except exc.IntegrityError:
             return abort(400, description='Please delete the registrations linked with this race before deleting this race')
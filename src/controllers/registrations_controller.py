@@ -1,30 +1,51 @@
-from flask import Blueprint, jsonify, request, abort
-from sqlalchemy import and_, exc
-from sqlalchemy.sql.functions import coalesce
+from flask import Blueprint, jsonify, request, abort, current_app
+from sqlalchemy import exc, insert, delete
 from main import db
 from models.registrations import Registration
 from models.participants import Participant
 from models.races import Race
-from models.age_groups import Age_group
+from models.splits import Split
 from controllers.participants_controller import is_admin
 from schemas.registration_schema import registration_schema, registrations_schema
-from dateutil.relativedelta import relativedelta
-from validator import validate_input, is_admin
-from parse import parse
+from schemas.eager_loading import eager_load_options
+from validator import validate_input, is_admin, validated_input, read_bulk_rows, validate_row
+from datetime import datetime
+import leaderboard
+import age_group_cache
+import capacity
+import response_cache
+from routing import read_only, begin_write
+import streaming
+import search
 
 registrations = Blueprint('registrations', __name__, url_prefix='/registrations')
 
 
 # a route to view all registrations, should be admin only
 @registrations.route('/', methods=['GET'])
+@read_only
 @is_admin
 def get_registrations():
-    # query all registrations from the database
-    registrations_list = Registration.query.all()
-    # convert to json format
-    result = registrations_schema.dump(registrations_list)
-    # return the result
-    return jsonify(result)
+    # query all registrations from the database, with the participant, race and age group they will dump
+    registrations_list = Registration.query.options(*eager_load_options(registrations_schema, Registration))
+    # convert to json format and return the result, it's streamed if the list is large
+    return streaming.list_response(registrations_list, registrations_schema)
+
+
+# find registrations by the start of their bib number, in one race or in all races
+@registrations.route('/search', methods=['GET'])
+@read_only
+@is_admin
+def search_registrations():
+    bib = request.args.get('bib', '').strip()
+    if not bib:
+        return abort(400, description='Please provide a bib number to search')
+    race_id = request.args.get('race_id', type=int)
+    limit = request.args.get('limit', current_app.config['SEARCH_LIMIT'], type=int)
+    if not 0 < limit <= current_app.config['SEARCH_MAX_LIMIT']:
+        return abort(400, description=f'Limit must be between 1 and {current_app.config["SEARCH_MAX_LIMIT"]}')
+    matches = search.search_bib_numbers(bib, race_id, limit).options(*eager_load_options(registrations_schema, Registration))
+    return jsonify(registrations_schema.dump(matches))
 
 
 # add registration
@@ -32,7 +53,7 @@ def get_registrations():
 @is_admin
 @validate_input(registration_schema, ['participant_id','race_id','registration_date','bib_number'])
 def add_registration():
-    input = registration_schema.load(request.json)
+    input = validated_input()
     # check if participant exists
     participant = Participant.query.get(input['participant_id'])
     if not participant:
@@ -44,9 +65,17 @@ def add_registration():
         return abort(404, description='Race not found')
 
     # automatically assign age group based on participant's age on the race date
-    age = relativedelta(race.date, participant.date_of_birth).years
-    input['age_group_id'] = Age_group.query.filter(and_(age<=coalesce(Age_group.max_age, age), age>=Age_group.min_age)).first().id
-    
+    input['age_group_id'] = age_group_cache.resolve(age_group_cache.age_on(participant.date_of_birth, race.date))
+    if input['age_group_id'] is None:
+        return abort(400, description='No age group found for the participant')
+    input['registration_date'] = datetime.strptime(input['registration_date'], '%Y-%m-%d').date()
+
+    # end the reads and take the write lock, so concurrent registrations wait for each other instead of failing
+    begin_write(db.session)
+    # take a place in the race, it's given back if the registration fails
+    if not capacity.reserve(input['race_id']):
+        return abort(400, description='The race is full')
+
     # add to the database
     registration = Registration(**input)
     db.session.add(registration)
@@ -55,23 +84,146 @@ def add_registration():
     # if IntegrityError, means duplicate registration or bib_number
     except exc.IntegrityError as e:
         # parse the error field, there are two scenarios: duplicated bib_number or participant
+        from parse import parse
         err_field = parse('duplicate key value violates unique constraint "{constraint}"\nDETAIL:  Key ({field})=({input}) already exists.\n', str(e.orig))["field"]
         if err_field == 'bib_number, race_id':
             err_msg = 'Bib number already exists under this race'
         else:
             err_msg = 'Participant already registered this race'
         return abort(400, description = err_msg)
+    response_cache.bump('registrations')
     
     return jsonify(msg = 'Registration added successfully', registration = registration_schema.dump(registration))
 
 
+# find the next free bib numbers of each race, bibs are the prefix followed by a sequential number
+def next_bib_numbers(race_ids, prefix, taken):
+    numbers = {race_id: 0 for race_id in race_ids}
+    for bib_number, race_id in taken:
+        if race_id in numbers and bib_number.startswith(prefix) and bib_number[len(prefix):].isdigit():
+            numbers[race_id] = max(numbers[race_id], int(bib_number[len(prefix):]))
+    return numbers
+
+
+# a route to add registrations in bulk, e.g. the entries of a partner system
+# accepts csv or newline delimited json, and reports errors per row instead of aborting the whole batch
+# pass assign_bibs=true to allocate sequential bib numbers (after bib_prefix) to the rows without one
+@registrations.route('/bulk', methods=['POST'])
+@is_admin
+def add_registrations_bulk():
+    assign_bibs = request.args.get('assign_bibs', 'false').lower() == 'true'
+    prefix = request.args.get('bib_prefix', '')
+    required_fields = ['participant_id', 'race_id', 'registration_date']
+    if not assign_bibs:
+        required_fields.append('bib_number')
+
+    errors = []
+    rows = []
+    for index, (row, error) in enumerate(read_bulk_rows(), start=1):
+        if not error:
+            input, error = validate_row(registration_schema, row, required_fields)
+        if not error:
+            try:
+                input['participant_id'] = int(input['participant_id'])
+                input['race_id'] = int(input['race_id'])
+            except ValueError:
+                error = 'Please enter a valid number for participant_id and race_id'
+        if error:
+            errors.append({'row': index, 'error': error})
+        else:
+            rows.append((index, input))
+
+    # the places are taken after the reads below, so take the write lock first
+    begin_write(db.session)
+    participant_ids = {input['participant_id'] for index, input in rows}
+    race_ids = {input['race_id'] for index, input in rows}
+    # check participants and races exist with one query each, and get what's needed to assign the age groups
+    dates_of_birth = dict(db.session.query(Participant.id, Participant.date_of_birth).filter(Participant.id.in_(participant_ids)))
+    race_dates = dict(db.session.query(Race.id, Race.date).filter(Race.id.in_(race_ids)))
+    # find existing registrations and bib numbers of these races
+    registered = set(db.session.query(Registration.participant_id, Registration.race_id)
+                     .filter(Registration.race_id.in_(race_ids), Registration.participant_id.in_(participant_ids)))
+    taken = set(db.session.query(Registration.bib_number, Registration.race_id).filter(Registration.race_id.in_(race_ids)))
+    # bib numbers passed in this batch are not allocated to other rows
+    requested = {(input['bib_number'], input['race_id']) for index, input in rows if 'bib_number' in input}
+    numbers = next_bib_numbers(race_ids, prefix, taken | requested)
+
+    values = []
+    indexes = []
+    for index, input in rows:
+        participant_id, race_id = input['participant_id'], input['race_id']
+        if participant_id not in dates_of_birth:
+            errors.append({'row': index, 'error': 'Participant not found'})
+            continue
+        if race_id not in race_dates:
+            errors.append({'row': index, 'error': 'Race not found'})
+            continue
+        if (participant_id, race_id) in registered:
+            errors.append({'row': index, 'error': 'Participant already registered this race'})
+            continue
+        if 'bib_number' in input:
+            if (input['bib_number'], race_id) in taken:
+                errors.append({'row': index, 'error': 'Bib number already exists under this race'})
+                continue
+        else:
+            numbers[race_id] += 1
+            input['bib_number'] = f'{prefix}{numbers[race_id]}'
+        # automatically assign age group based on participant's age on the race date
+        age_group_id = age_group_cache.resolve(age_group_cache.age_on(dates_of_birth[participant_id], race_dates[race_id]))
+        if age_group_id is None:
+            errors.append({'row': index, 'error': 'No age group found for the participant'})
+            continue
+        values.append({
+            'participant_id': participant_id,
+            'race_id': race_id,
+            'age_group_id': age_group_id,
+            'registration_date': datetime.strptime(input['registration_date'], '%Y-%m-%d').date(),
+            'bib_number': input['bib_number']
+        })
+        indexes.append(index)
+        # the same participant and bib number can only appear once in a race
+        registered.add((participant_id, race_id))
+        taken.add((input['bib_number'], race_id))
+
+    # take the places of each race at once, the rows after the last place granted are rejected
+    counts = {}
+    for value in values:
+        counts[value['race_id']] = counts.get(value['race_id'], 0) + 1
+    granted = {race_id: capacity.reserve_up_to(race_id, count) for race_id, count in counts.items()}
+    accepted = []
+    for index, value in zip(indexes, values):
+        if granted[value['race_id']] > 0:
+            granted[value['race_id']] -= 1
+            accepted.append(value)
+        else:
+            errors.append({'row': index, 'error': 'The race is full'})
+    values = accepted
+
+    # insert all valid rows with a single statement in one transaction
+    if values:
+        try:
+            db.session.execute(insert(Registration).values(values))
+            db.session.commit()
+        # if IntegrityError, means another request has added the same registration or bib number meanwhile
+        except exc.IntegrityError:
+            db.session.rollback()
+            return abort(400, description='Participant or bib number already registered under this race')
+        response_cache.bump('registrations')
+
+    errors.sort(key=lambda error: error['row'])
+    return jsonify(msg = f'Added {len(values)} registrations', added = len(values), errors = errors)
+
+
 # a route to update existing registration
 @registrations.route('/<int:id>', methods=['PUT'])
 @is_admin
 @validate_input(registration_schema)
 def update_registration(id):
+    # a move to another race takes a place in it after the reads below, so take the write lock first
+    begin_write(db.session)
     registration = Registration.query.get(id)
-    input = registration_schema.load(request.json)
+    input = validated_input()
+    previous_race_id = registration.race_id if registration else None
     # update fields
     if registration:
         for key, value in input.items():
@@ -90,17 +242,37 @@ def update_registration(id):
     if not race:
         return abort(404, description='Race not found')
 
+    # the age group depends on the participant and the race date, so assign it again if either has changed
+    if 'participant_id' in input or 'race_id' in input:
+        registration.age_group_id = age_group_cache.resolve(age_group_cache.age_on(participant.date_of_birth, race.date))
+        if registration.age_group_id is None:
+            return abort(400, description='No age group found for the participant')
+
+    # moving to another race takes a place in it and gives back the place in the previous one
+    if int(registration.race_id) != previous_race_id:
+        if not capacity.reserve(registration.race_id):
+            return abort(400, description='The race is full')
+        capacity.release(previous_race_id)
+
     try:
+        db.session.flush()
+        # the splits were timed in the previous race
+        if 'race_id' in input:
+            db.session.execute(delete(Split).where(Split.registration_id == registration.id, Split.race_id != registration.race_id))
+        # the race or age group may have changed, so refresh the result in the leaderboard
+        leaderboard.sync_registrations([registration.id])
         db.session.commit()
     # if IntegrityError, means duplicate registration or bib_number
     except exc.IntegrityError as e:
         # parse the error field, there are two scenarios: duplicated bib_number or participant
+        from parse import parse
         err_field = parse('duplicate key value violates unique constraint "{constraint}"\nDETAIL:  Key ({field})=({input}) already exists.\n', str(e.orig))["field"]
         if err_field == 'bib_number, race_id':
             err_msg = 'Bib number already exists under this race'
         else:
             err_msg = 'Participant already registered this race'
         return abort(400, description = err_msg)
+    response_cache.bump('registrations')
     
     return jsonify(msg = 'Updated successfully', registration = registration_schema.dump(registration))
 
@@ -109,12 +281,15 @@ def update_registration(id):
 @registrations.route('/<int:id>', methods = ['DELETE'])
 @is_admin
 def delete_registration(id):
+    begin_write(db.session)
     registration = Registration.query.get(id)
     registration_serialized = registration_schema.dump(registration)
     if registration:
         try:
+            capacity.release(registration.race_id)
             db.session.delete(registration)
-            db.session.commit()    
+            db.session.commit()
+            response_cache.bump('registrations')
             return jsonify(msg = 'Registration deleted successfully', result = registration_serialized)
         except exc.IntegrityError:
             return abort(400, description='Please delete the result linked with this registration before deleting this registration')
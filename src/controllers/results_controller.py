@@ -1,20 +1,83 @@
-from flask import Blueprint, jsonify, request, abort
+from flask import Blueprint, jsonify, request, abort, current_app, Response, stream_with_context, g
 from main import db
-from sqlalchemy import text, exc
+from sqlalchemy import text, exc, insert
 from models.results import Result
 from models.registrations import Registration
 from models.races import Race
 from models.age_groups import Age_group
-from models.results import Result
 from schemas.result_schema import result_schema
-from validator import is_admin, validate_input
-from datetime import datetime, timedelta
+import leaderboard
+import response_cache
+from routing import read_only
+import streaming
+import pubsub
+import ingestion
+import results_sheet
+import export
+import metrics
+from timing import time_to_ms, seconds_to_time
+from validator import is_admin, validate_input, read_bulk_rows, validate_row, validated_input
+from queue import Empty
+from bisect import bisect_right
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+import json
 
 results = Blueprint('results', __name__, url_prefix='/results')
 
 
+# encode the position of the last returned row, so the next page can continue right after it
+def encode_cursor(pace, result_id, place):
+    return urlsafe_b64encode(json.dumps([pace, result_id, place]).encode()).decode()
+
+
+# decode the cursor passed by the user, returns (pace, result_id, place)
+def decode_cursor(token):
+    try:
+        pace, result_id, place = json.loads(urlsafe_b64decode(token.encode()))
+        return int(pace), int(result_id), int(place)
+    except (ValueError, TypeError):
+        return abort(400, description='Invalid next token')
+
+
+# build the leaderboard query with only the filters actually passed, so the planner can use the indexes
+# the leaderboard table is already keyed by race, age group and gender, so a page is an ordered range read
+# order by pace in milliseconds and result id, so the (pace_ms, id) of the last row can be used to seek the next page
+def build_results_query(race_id=None, age_group_id=None, gender=None, after_pace=None, after_id=None, limit=None):
+    conditions = []
+    params = {}
+    if race_id is not None:
+        conditions.append('lb.race_id = :race_id')
+        params['race_id'] = race_id
+    if age_group_id is not None:
+        conditions.append('lb.age_group_id = :age_group_id')
+        params['age_group_id'] = age_group_id
+    if gender is not None:
+        conditions.append('lb.gender = :gender')
+        params['gender'] = gender
+    if after_id is not None:
+        conditions.append('(lb.pace_ms, lb.result_id) > (:after_pace, :after_id)')
+        params['after_pace'] = after_pace
+        params['after_id'] = after_id
+    sql = 'SELECT first_name, last_name, res.* \
+           FROM leaderboard AS lb \
+           INNER JOIN results AS res ON res.id = lb.result_id \
+           INNER JOIN registrations AS reg ON res.registration_id = reg.id \
+           INNER JOIN participants AS par ON par.id = reg.participant_id'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY lb.pace_ms ASC, lb.result_id ASC'
+    # fetch one more row than the page size, to know if there is a next page
+    if limit is not None:
+        sql += ' LIMIT :limit'
+        params['limit'] = limit + 1
+    return sql, params
+
+
 # a route to view all results for a given race, age group and gender group
+# results are ordered by pace and can be paged with limit and the next token of the previous page
 @results.route('/', methods=['GET'])
+@read_only
+@response_cache.cached('results', 'registrations', 'participants', 'races', 'age_groups')
 def get_race_results():
     args = request.args
     # find the race
@@ -28,40 +91,15 @@ def get_race_results():
     if age_group_id and not age_group:
         return abort(404, 'Age group not found')
     gender = (args.get('gender', False) or None)
+    # page size, if not passed, all results are returned
+    limit = args.get('limit', None, type=int)
+    if limit is not None and limit <= 0:
+        return abort(400, description='Please enter a valid number for limit')
+    # continue from the last row of the previous page
+    after_pace, after_id, place = decode_cursor(args['next']) if args.get('next') else (None, None, 0)
+
     # query the database to check existing registrations with same race, age group and gender
-    sql = text('SELECT first_name, last_name, res.*, \
-                ROW_NUMBER () OVER (ORDER BY res.pace ASC) AS row_num \
-                FROM results AS res \
-                INNER JOIN registrations AS reg ON res.registration_id = reg.id \
-                INNER JOIN participants AS par ON par.id = reg.participant_id \
-                WHERE reg.race_id = COALESCE(:race_id, reg.race_id) \
-                AND reg.age_group_id = COALESCE(:age_group_id, reg.age_group_id) \
-                AND par.gender = COALESCE(:gender, par.gender)'
-               )
-    # execute the query
-    sql_results = db.session.execute(
-        sql, {
-            # if some values are not passed, consider to query all registrations under that category
-            'race_id': race_id,
-            'age_group_id': age_group_id,
-            'gender': gender
-        })
-    # extract the result into a list
-    results_list = []
-    for row in sql_results:
-        result = {
-            'place': row.row_num,
-            'first_name': row.first_name,
-            'last_name': row.last_name,
-            'finished': row.finished,
-            'start_at': str(row.start_at),
-            'finish_at': str(row.finish_at),
-            'finish_time': str(row.finish_time),
-            'pace': str(row.pace)
-        }
-        results_list.append(result)
-    # Close the result set explicitly
-    sql_results.close()
+    sql, params = build_results_query(race_id, age_group_id, gender, after_pace, after_id, limit)
 
     # add race, age group and gender into the result
     output = {
@@ -73,30 +111,230 @@ def get_race_results():
             'min_age': age_group.min_age if hasattr(age_group, 'min_age') else 'All',
             'max_age': age_group.max_age if hasattr(age_group, 'max_age') else 'All'
         },
-        'gender': gender or 'All',
-        'results': results_list
+        'gender': gender or 'All'
     }
-    return jsonify(output)
 
+    # stream the rows as they come out of the cursor, so memory stays flat regardless of the field size
+    def generate():
+        chunk_size = current_app.config['STREAMING_CHUNK_SIZE']
+        # execute the query with a server side cursor
+        sql_results = db.session.execute(text(sql), params, execution_options={'stream_results': True})
+        next_token = None
+        chunk = []
+        separator = b''
+        try:
+            yield streaming.dumps(output)[:-1] + b',"results":['
+            for count, row in enumerate(sql_results):
+                # the extra row means there is a next page
+                if limit is not None and count == limit:
+                    next_token = encode_cursor(last.pace_ms, last.id, place + count)
+                    break
+                chunk.append(leaderboard.entry(row, place + count + 1))
+                last = row
+                metrics.count_rows(1)
+                # serialize and write out the rows in chunks
+                if len(chunk) == chunk_size:
+                    yield separator + streaming.dump_items(chunk)
+                    separator = b','
+                    chunk = []
+        finally:
+            # Close the result set explicitly
+            sql_results.close()
+        if chunk:
+            yield separator + streaming.dump_items(chunk)
+        yield b'],"next":' + streaming.dumps(next_token) + b'}'
 
-# def a function to make sure the inputs are meaningful
-def validate_results_schema(input):
-    registration = Registration.query.get(input['registration_id'])
-    if not registration:
-        return abort(404, description='Registration not found')
-    # finish time should be larger than start time
-    if datetime.strptime(input['finish_at'], '%H:%M:%S') <= datetime.strptime(input['start_at'], '%H:%M:%S'):
-        return abort(400, 'Finish time cannot be earlier than start time')
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
-    # calculate finish time automatically
-    delta = (datetime.strptime(
-        input['finish_at'], '%H:%M:%S') - datetime.strptime(input['start_at'], '%H:%M:%S'))
-    input['finish_time'] = str(delta)
-    # calculate pace: time used per kilometer
-    race = Race.query.get(registration.race_id)
-    input['pace'] = (datetime(2000, 1, 1) + timedelta(seconds=delta.total_seconds() /
-                     float(race.distance))).time().strftime('%H:%M:%S')
-    return input
+
+# a route to print the results sheet of a race, with the overall, gender and category (age group and gender) places
+# the sheet is computed once per race and kept in memory until the results change, pages are slices of it
+@results.route('/sheet', methods=['GET'])
+@read_only
+@response_cache.cached(*results_sheet.TABLES, 'races')
+def get_results_sheet():
+    args = request.args
+    race_id = args.get('race_id', type=int)
+    if not race_id:
+        return abort(400, description='Please provide a race_id')
+    race = Race.query.get(race_id)
+    if not race:
+        return abort(404, description='Race not found')
+    limit = args.get('limit', 100, type=int)
+    if limit <= 0:
+        return abort(400, description='Please enter a valid number for limit')
+
+    keys, rows = results_sheet.get(race_id)
+    # continue right after the last row of the previous page, even if rows have been added before it meanwhile
+    start = 0
+    if args.get('next'):
+        after_pace, after_id, place = decode_cursor(args['next'])
+        start = bisect_right(keys, (after_pace, after_id))
+    end = start + limit
+    next_token = encode_cursor(*keys[end - 1], end) if end < len(rows) else None
+    return jsonify(race={'name': race.name, 'distance': race.distance}, results=rows[start:end], next=next_token)
+
+
+# a route to download all results of a race as csv, parquet or arrow, e.g. for federations and media
+# the results are read in batches and each batch is written out as soon as it's encoded, so memory stays flat
+@results.route('/export', methods=['GET'])
+@read_only
+def export_results():
+    args = request.args
+    race_id = args.get('race_id', type=int)
+    if not race_id:
+        return abort(400, description='Please provide a race_id')
+    format = args.get('format', 'csv')
+    if format not in export.FORMATS:
+        return abort(400, description='Format must be one of ' + ', '.join(export.FORMATS))
+    if not Race.query.get(race_id):
+        return abort(404, description='Race not found')
+    mimetype, extension = export.FORMATS[format]
+    return Response(stream_with_context(export.chunks(race_id, format)), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=results-{race_id}.{extension}'})
+
+
+# a route to follow the leaderboard of a race live, with server-sent events
+# the client gets a snapshot event with the whole leaderboard, then a place event whenever a result is added or
+# changes place, and a remove event when a result leaves the race. Entries below a new place move down by one.
+@results.route('/stream', methods=['GET'])
+def stream_race_results():
+    race_id = request.args.get('race_id', type=int)
+    if not race_id:
+        return abort(400, description='Please provide a race_id')
+    race = Race.query.get(race_id)
+    if not race:
+        return abort(404, description='Race not found')
+
+    # subscribe before taking the snapshot, so no change is missed in between
+    channel = ('results', race_id)
+    subscription = pubsub.subscribe(channel, current_app.config['LIVE_QUEUE_SIZE'])
+    heartbeat = current_app.config['LIVE_HEARTBEAT_SECONDS']
+    try:
+        sql, params = build_results_query(race_id)
+        rows = db.session.execute(text(sql), params).all()
+        snapshot = streaming.event_frame('snapshot', {
+            'race': {'name': race.name, 'distance': race.distance},
+            'results': [{'result_id': row.id, **leaderboard.entry(row, place)} for place, row in enumerate(rows, 1)]
+        })
+        metrics.count_rows(len(rows))
+        reset = streaming.event_frame('reset', {'race_id': race_id})
+        # the stream can stay open for hours, don't hold a database connection for it
+        db.session.close()
+    except Exception:
+        pubsub.unsubscribe(channel, subscription)
+        raise
+
+    def generate():
+        try:
+            yield snapshot
+            while not (subscription.dropped and subscription.empty()):
+                try:
+                    yield subscription.get(timeout=heartbeat)
+                except Empty:
+                    # a comment line keeps proxies from closing the idle connection
+                    yield b': heartbeat\n\n'
+            # events have been lost, the client should reconnect to get a new snapshot
+            yield reset
+        finally:
+            pubsub.unsubscribe(channel, subscription)
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# calculate finish time and pace (time used per kilometer) from the start and finish timestamps
+# returns the values of the timing columns of a result: the milliseconds, and the times rounded down to the second
+def calculate_timing(start_at, finish_at, distance):
+    finish_ms = time_to_ms(finish_at) - time_to_ms(start_at)
+    pace_ms = round(finish_ms / float(distance))
+    return {
+        'finish_time': seconds_to_time(finish_ms // 1000),
+        'pace': seconds_to_time(pace_ms // 1000),
+        'finish_ms': finish_ms,
+        'pace_ms': pace_ms
+    }
+
+
+# insert validated results with a single statement, and add them into the leaderboard
+# rows are (key, input) pairs, returns {key: error message} for the rows which were rejected
+# it does not commit, an IntegrityError means another request has added a result for one of these registrations meanwhile
+def insert_results(rows):
+    errors = {}
+    registration_ids = {input['registration_id'] for key, input in rows}
+    # resolve all registrations and their race distance in one query
+    distances = dict(db.session.query(Registration.id, Race.distance)
+                     .join(Race, Registration.race_id == Race.id)
+                     .filter(Registration.id.in_(registration_ids)))
+    # find the registrations which already have a result in one query
+    existing = {registration_id for (registration_id,) in db.session.query(Result.registration_id)
+                .filter(Result.registration_id.in_(registration_ids))}
+
+    values = []
+    for key, input in rows:
+        registration_id = input['registration_id']
+        if registration_id not in distances:
+            errors[key] = 'Registration not found'
+            continue
+        if registration_id in existing:
+            errors[key] = 'Result with same registration id already exists'
+            continue
+        # finish time should be larger than start time
+        if time_to_ms(input['finish_at']) <= time_to_ms(input['start_at']):
+            errors[key] = 'Finish time cannot be earlier than start time'
+            continue
+        # calculate finish time and pace automatically
+        values.append({
+            'registration_id': registration_id,
+            'finished': input['finished'],
+            'start_at': seconds_to_time(time_to_ms(input['start_at']) // 1000),
+            'finish_at': seconds_to_time(time_to_ms(input['finish_at']) // 1000),
+            **calculate_timing(input['start_at'], input['finish_at'], distances[registration_id])
+        })
+        # a registration can only appear once in the same batch
+        existing.add(registration_id)
+
+    if values:
+        db.session.execute(insert(Result).values(values))
+        # add the new results into the leaderboard
+        leaderboard.sync_registrations([value['registration_id'] for value in values])
+    return errors
+
+
+# a route to add results in bulk, e.g. the dump from a timing system
+# accepts csv or newline delimited json, and reports errors per row instead of aborting the whole batch
+@results.route('/bulk', methods=['POST'])
+@is_admin
+def add_results_bulk():
+    errors = []
+    rows = []
+    for index, (row, error) in enumerate(read_bulk_rows(), start=1):
+        if not error:
+            input, error = validate_row(result_schema, row, ['registration_id', 'finished', 'start_at', 'finish_at'])
+        if not error:
+            try:
+                input['registration_id'] = int(input['registration_id'])
+            except ValueError:
+                error = 'Please enter a valid number for registration_id'
+        if error:
+            errors.append({'row': index, 'error': error})
+        else:
+            rows.append((index, input))
+
+    # insert all valid rows with a single statement in one transaction
+    try:
+        rejected = insert_results(rows)
+        db.session.commit()
+    # if IntegrityError, means another request has added a result for one of these registrations meanwhile
+    except exc.IntegrityError:
+        db.session.rollback()
+        return abort(400, description='Result with same registration id already exists')
+    added = len(rows) - len(rejected)
+    if added:
+        response_cache.bump('results')
+
+    errors.extend({'row': index, 'error': error} for index, error in rejected.items())
+    errors.sort(key=lambda error: error['row'])
+    return jsonify(description=f'Added {added} results', added=added, errors=errors)
 
 
 # a route to add new result
@@ -106,42 +344,64 @@ def validate_results_schema(input):
 @validate_input(result_schema, ['registration_id', 'finished', 'start_at', 'finish_at'])
 def add_result():
     # get input
-    input = result_schema.load(request.json)
+    input = validated_input()
+    # queue the result and return straight away, it's written by the ingestion worker with other results
+    # not inside POST /batch, the result must be written in the transaction of the batch
+    if current_app.config['RESULT_INGESTION'] == 'queue' and g.get('batch') is None:
+        input['registration_id'] = int(input['registration_id'])
+        if time_to_ms(input['finish_at']) <= time_to_ms(input['start_at']):
+            return abort(400, 'Finish time cannot be earlier than start time')
+        ticket = ingestion.enqueue(input)
+        return jsonify(description='Queued', ticket=ticket), 202, {'Location': f'/results/tickets/{ticket}'}
     registration = Registration.query.get(input['registration_id'])
     if not registration:
         return abort(404, description='Registration not found')
     # finish time should be larger than start time
-    if datetime.strptime(input['finish_at'], '%H:%M:%S') <= datetime.strptime(input['start_at'], '%H:%M:%S'):
+    if time_to_ms(input['finish_at']) <= time_to_ms(input['start_at']):
         return abort(400, 'Finish time cannot be earlier than start time')
+    input['start_at'] = seconds_to_time(time_to_ms(input['start_at']) // 1000)
+    input['finish_at'] = seconds_to_time(time_to_ms(input['finish_at']) // 1000)
 
-    # calculate finish time automatically
-    delta = (datetime.strptime(
-        input['finish_at'], '%H:%M:%S') - datetime.strptime(input['start_at'], '%H:%M:%S'))
-    input['finish_time'] = str(delta)
-    # calculate pace: time used per kilometer
+    # calculate finish time and pace automatically
     race = Race.query.get(registration.race_id)
-    input['pace'] = (datetime(2000, 1, 1) + timedelta(seconds=delta.total_seconds() /
-                     float(race.distance))).time().strftime('%H:%M:%S')
+    input.update(calculate_timing(input['start_at'], input['finish_at'], race.distance))
 
     # add to database
     result = Result(**input)
     db.session.add(result)
     try:
+        # flush to get the id of the result, then add it into the leaderboard
+        db.session.flush()
+        leaderboard.sync_results([result.id])
         db.session.commit()
     # if integrity err, means duplicated registration ids found
     except exc.IntegrityError:
         return abort(400, description='Result with same registration id already exists')
+    response_cache.bump('results')
 
     return jsonify(description='Added successfully', result=result_schema.dump(result))
 
 
+# a route to check if a queued result has been written
+@results.route('/tickets/<ticket>', methods=['GET'])
+@is_admin
+def get_ticket(ticket):
+    ticket_status = ingestion.status(ticket)
+    if not ticket_status:
+        return abort(404, description='Ticket not found')
+    return jsonify(ticket=ticket, status=ticket_status['status'], error=ticket_status['error'])
+
+
 # a route to update existing result
 @results.route('/<int:result_id>', methods=['PUT'])
 @is_admin
 @validate_input(result_schema)
 def update_result(result_id):
-    input = result_schema.load(request.json)
+    input = validated_input()
     result = Result.query.get(result_id)
+    for field in ['start_at', 'finish_at']:
+        if field in input:
+            input[field] = seconds_to_time(time_to_ms(input[field]) // 1000)
 
     # update fields
     if result:
@@ -157,24 +417,24 @@ def update_result(result_id):
         return abort(404, description='Registration not found')
 
     # finish time should be larger than start time
-    if datetime.strptime(result.finish_at, '%H:%M:%S') <= datetime.strptime(result.start_at, '%H:%M:%S'):
+    if time_to_ms(result.finish_at) <= time_to_ms(result.start_at):
         return abort(400, 'Finish time cannot be earlier than start time')
 
-    # calculate finish time automatically
-    delta = (datetime.strptime(result.finish_at, '%H:%M:%S') -
-             datetime.strptime(result.start_at, '%H:%M:%S'))
-    result.finish_time = str(delta)
-    # calculate pace: time used per kilometer
+    # calculate finish time and pace automatically
     race = Race.query.get(registration.race_id)
-    result.pace = (datetime(2000, 1, 1) + timedelta(seconds=delta.total_seconds() /
-                   float(race.distance))).time().strftime('%H:%M:%S')
+    for key, value in calculate_timing(result.start_at, result.finish_at, race.distance).items():
+        setattr(result, key, value)
 
     # update database
     try:
+        db.session.flush()
+        # the pace or the registration may have changed, so refresh the leaderboard entry
+        leaderboard.sync_results([result.id])
         db.session.commit()
     # if IntegrityError, means duplicated registrations
     except exc.IntegrityError:
         return abort(400, description='Result with same registration id already exists')
+    response_cache.bump('results')
     return jsonify(msg='Updated successfully', result=result_schema.dump(result))
 
 
@@ -185,8 +445,10 @@ def delete_result(result_id):
     result = Result.query.get(result_id)
     result_serialized = result_schema.dump(result)
     if result:
+        leaderboard.remove_results([result.id])
         db.session.delete(result)
         db.session.commit()
+        response_cache.bump('results')
         return jsonify(msg='Result deleted successfully', result=result_serialized)
     # if result not exists
     return abort(404, description='Result not found')
@@ -0,0 +1,170 @@
+from flask import Blueprint, jsonify, request, abort
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from main import db
+from models.splits import Split
+from models.registrations import Registration
+from models.participants import Participant
+from models.races import Race
+from schemas.split_schema import split_schema
+from controllers.results_controller import encode_cursor, decode_cursor
+from timing import time_to_ms, format_ms
+from validator import is_admin, read_bulk_rows, validate_row
+import response_cache
+import metrics
+from routing import read_only
+
+splits = Blueprint('splits', __name__, url_prefix='/splits')
+
+# the finish time is projected from the latest split with Riegel's formula: t2 = t1 * (d2 / d1) ^ 1.06
+RIEGEL_EXPONENT = 1.06
+# max number of splits written by one statement
+INSERT_CHUNK_SIZE = 5000
+
+
+# insert the splits, a split already recorded at the same checkpoint is updated instead
+# so a mat sending the same batch again does no harm
+def upsert_splits(values):
+    dialect_insert = postgresql.insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite.insert
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        statement = dialect_insert(Split).values(values[i:i + INSERT_CHUNK_SIZE])
+        statement = statement.on_conflict_do_update(
+            index_elements=[Split.registration_id, Split.distance_m],
+            set_={'elapsed_ms': statement.excluded.elapsed_ms, 'pace_ms': statement.excluded.pace_ms})
+        db.session.execute(statement)
+
+
+# a route to record the splits of a race in bulk, as sent by the timing mats
+# accepts csv or newline delimited json with bib_number, distance (km) and elapsed (H:M:S since the start)
+# all bib numbers are resolved with one query and the splits are written with one statement per 5000 rows
+@splits.route('/bulk', methods=['POST'])
+@is_admin
+def add_splits_bulk():
+    race_id = request.args.get('race_id', type=int)
+    if not race_id:
+        return abort(400, description='Please provide a race_id')
+    race = Race.query.get(race_id)
+    if not race:
+        return abort(404, description='Race not found')
+    race_distance_m = round(float(race.distance) * 1000)
+
+    errors = []
+    rows = []
+    for index, (row, error) in enumerate(read_bulk_rows(), start=1):
+        if not error:
+            input, error = validate_row(split_schema, row, ['bib_number', 'distance', 'elapsed'])
+        if error:
+            errors.append({'row': index, 'error': error})
+        else:
+            rows.append((index, input))
+
+    # resolve the bib numbers of the batch in one query
+    bib_numbers = {input['bib_number'] for index, input in rows}
+    registration_ids = dict(db.session.query(Registration.bib_number, Registration.id)
+                            .filter(Registration.race_id == race_id, Registration.bib_number.in_(bib_numbers)))
+
+    # one split per participant and checkpoint, the last one in the batch wins
+    values = {}
+    for index, input in rows:
+        registration_id = registration_ids.get(input['bib_number'])
+        if registration_id is None:
+            errors.append({'row': index, 'error': 'Bib number not found under this race'})
+            continue
+        distance_m = round(float(input['distance']) * 1000)
+        if not 0 < distance_m <= race_distance_m:
+            errors.append({'row': index, 'error': 'Distance must be between 0 and the race distance'})
+            continue
+        elapsed_ms = time_to_ms(input['elapsed'])
+        if elapsed_ms <= 0:
+            errors.append({'row': index, 'error': 'Elapsed time must be larger than 0'})
+            continue
+        values[(registration_id, distance_m)] = {
+            'registration_id': registration_id,
+            'race_id': race_id,
+            'distance_m': distance_m,
+            'elapsed_ms': elapsed_ms,
+            'pace_ms': round(elapsed_ms * 1000 / distance_m)
+        }
+
+    if values:
+        upsert_splits(list(values.values()))
+        db.session.commit()
+        response_cache.bump('splits')
+
+    errors.sort(key=lambda error: error['row'])
+    return jsonify(description=f'Recorded {len(values)} splits', recorded=len(values), errors=errors)
+
+
+# a route to view the ranking of a race at a checkpoint, ordered by elapsed time
+# can be paged with limit and the next token of the previous page
+@splits.route('/', methods=['GET'])
+@read_only
+@response_cache.cached('splits', 'registrations', 'participants')
+def get_split_ranking():
+    args = request.args
+    race_id = args.get('race_id', type=int)
+    distance = args.get('distance', type=float)
+    if not race_id or not distance:
+        return abort(400, description='Please provide race_id and distance')
+    limit = args.get('limit', 100, type=int)
+    if limit <= 0:
+        return abort(400, description='Please enter a valid number for limit')
+    # continue from the last row of the previous page
+    after_elapsed, after_id, place = decode_cursor(args['next']) if args.get('next') else (None, None, 0)
+
+    query = db.session.query(Split.registration_id, Split.elapsed_ms, Split.pace_ms, Registration.bib_number,
+                             Participant.first_name, Participant.last_name) \
+        .join(Registration, Split.registration_id == Registration.id) \
+        .join(Participant, Participant.id == Registration.participant_id) \
+        .filter(Split.race_id == race_id, Split.distance_m == round(distance * 1000))
+    if after_id is not None:
+        query = query.filter(tuple_(Split.elapsed_ms, Split.registration_id) > tuple_(after_elapsed, after_id))
+    # fetch one more row than the page size, to know if there is a next page
+    rows = query.order_by(Split.elapsed_ms, Split.registration_id).limit(limit + 1).all()
+    metrics.count_rows(len(rows))
+    next_token = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_token = encode_cursor(rows[-1].elapsed_ms, rows[-1].registration_id, place + limit)
+
+    return jsonify(
+        race_id=race_id,
+        distance=distance,
+        splits=[{
+            'place': place + count,
+            'bib_number': row.bib_number,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'elapsed': format_ms(row.elapsed_ms),
+            'pace': format_ms(row.pace_ms)
+        } for count, row in enumerate(rows, start=1)],
+        next=next_token
+    )
+
+
+# a route to view the splits of a registration, and the finish time projected from the latest one
+@splits.route('/registrations/<int:registration_id>', methods=['GET'])
+@read_only
+@response_cache.cached('splits', 'registrations', 'races')
+def get_registration_splits(registration_id):
+    registration = Registration.query.get(registration_id)
+    if not registration:
+        return abort(404, description='Registration not found')
+    race = Race.query.get(registration.race_id)
+    race_distance_m = round(float(race.distance) * 1000)
+    registration_splits = Split.query.filter_by(registration_id=registration_id).order_by(Split.distance_m).all()
+
+    projected_ms = None
+    if registration_splits:
+        latest = registration_splits[-1]
+        projected_ms = round(latest.elapsed_ms * (race_distance_m / latest.distance_m) ** RIEGEL_EXPONENT)
+
+    return jsonify(
+        bib_number=registration.bib_number,
+        splits=[{
+            'distance': split.distance_m / 1000,
+            'elapsed': format_ms(split.elapsed_ms),
+            'pace': format_ms(split.pace_ms)
+        } for split in registration_splits],
+        projected_finish=format_ms(projected_ms) if projected_ms is not None else None
+    )
@@ -0,0 +1,160 @@
+from flask import current_app, abort
+from main import db
+from sqlalchemy import select
+from models.leaderboard import Leaderboard
+from models.results import Result
+from models.registrations import Registration
+from models.participants import Participant
+from models.age_groups import Age_group
+from timing import format_ms
+import metrics
+import csv
+import io
+
+# format -> (mimetype, file extension)
+FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+# the exported columns, in order
+COLUMNS = ['place', 'bib_number', 'first_name', 'last_name', 'gender', 'min_age', 'max_age',
+           'finished', 'start_at', 'finish_at', 'finish_time', 'pace']
+
+
+# select the results of a race in leaderboard order, times come out as time objects and durations as milliseconds
+def export_query(race_id):
+    return select(
+        Registration.bib_number, Participant.first_name, Participant.last_name, Leaderboard.gender,
+        Age_group.min_age, Age_group.max_age, Result.finished, Result.start_at, Result.finish_at,
+        Result.finish_ms, Result.pace_ms) \
+        .join(Result, Result.id == Leaderboard.result_id) \
+        .join(Registration, Result.registration_id == Registration.id) \
+        .join(Participant, Participant.id == Registration.participant_id) \
+        .join(Age_group, Age_group.id == Leaderboard.age_group_id) \
+        .where(Leaderboard.race_id == race_id) \
+        .order_by(Leaderboard.pace_ms, Leaderboard.result_id)
+
+
+# read the results in batches of EXPORT_BATCH_SIZE rows from a server side cursor
+# each batch is turned into columns, so the writers never see more than one batch at a time
+def column_batches(race_id):
+    batch_size = current_app.config['EXPORT_BATCH_SIZE']
+    # executed on the connection, the rows are plain tuples and skip the orm
+    sql_results = db.session.connection().execution_options(stream_results=True, yield_per=batch_size).execute(export_query(race_id))
+    place = 0
+    try:
+        for rows in sql_results.partitions():
+            columns = [list(range(place + 1, place + len(rows) + 1))] + [list(column) for column in zip(*rows)]
+            place += len(rows)
+            metrics.count_rows(len(rows))
+            yield dict(zip(COLUMNS, columns))
+    finally:
+        sql_results.close()
+
+
+# pyarrow is only needed for parquet and arrow, and is heavy to import, so it's imported on the first export
+def load_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        return abort(501, description='Parquet and Arrow exports need pyarrow to be installed on the server')
+    return pyarrow
+
+
+# a file which only keeps what has been written since it was last emptied, pyarrow writers write into it
+# and the bytes are sent out after each batch
+class Chunks:
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+# the arrow schema, times of day are time32 and the finish time and pace are durations, both in milliseconds
+def arrow_schema(pa):
+    return pa.schema([
+        ('place', pa.int32()),
+        ('bib_number', pa.string()),
+        ('first_name', pa.string()),
+        ('last_name', pa.string()),
+        ('gender', pa.dictionary(pa.int8(), pa.string())),
+        ('min_age', pa.int16()),
+        ('max_age', pa.int16()),
+        ('finished', pa.bool_()),
+        ('start_at', pa.time32('ms')),
+        ('finish_at', pa.time32('ms')),
+        ('finish_time', pa.duration('ms')),
+        ('pace', pa.duration('ms')),
+    ])
+
+
+# a csv chunk per batch, durations are written as H:M:S with milliseconds
+def csv_chunks(batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for columns in batches:
+        columns['finish_time'] = map(format_ms, columns['finish_time'])
+        columns['pace'] = map(format_ms, columns['pace'])
+        writer.writerows(zip(*columns.values()))
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # only the header if the race has no result
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+# a row group per batch for parquet, a record batch per batch for arrow
+def arrow_chunks(batches, format, pa):
+    schema = arrow_schema(pa)
+    sink = Chunks()
+    file = pa.PythonFile(sink, mode='w')
+    if format == 'parquet':
+        writer = pa.parquet.ParquetWriter(file, schema, compression='zstd')
+        write = writer.write_table
+        to_batch = pa.Table.from_pydict
+    else:
+        writer = pa.ipc.new_stream(file, schema)
+        write = writer.write_batch
+        to_batch = pa.RecordBatch.from_pydict
+    try:
+        for columns in batches:
+            write(to_batch(columns, schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+# the chunks of an export of a race in the given format
+def chunks(race_id, format):
+    # fail before the response has started if pyarrow is missing
+    pa = load_pyarrow() if format != 'csv' else None
+    batches = column_batches(race_id)
+    if format == 'csv':
+        return csv_chunks(batches)
+    return arrow_chunks(batches, format, pa)
@@ -0,0 +1,64 @@
+from flask import current_app, abort
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from threading import BoundedSemaphore, Lock
+import bcrypt
+import os
+
+# the process pool is created on first use in each worker process
+_pool = {'pid': None, 'executor': None, 'slots': None}
+_lock = Lock()
+
+
+# run in the pool processes
+def _hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _check_password(password_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+def _get_pool():
+    with _lock:
+        if _pool['pid'] != os.getpid():
+            size = current_app.config['BCRYPT_POOL_SIZE']
+            # spawn instead of fork, the request workers may have other threads running
+            _pool['executor'] = ProcessPoolExecutor(max_workers=size, mp_context=get_context('spawn'))
+            # the hashes being computed plus the ones allowed to wait in the queue
+            _pool['slots'] = BoundedSemaphore(size + current_app.config['BCRYPT_MAX_QUEUE'])
+            _pool['pid'] = os.getpid()
+        return _pool['executor'], _pool['slots']
+
+
+# run bcrypt in the process pool, so it doesn't block the request workers
+# if the queue is full, return 503 and ask the client to retry later
+def _run(func, *args):
+    if not current_app.config['BCRYPT_POOL_SIZE']:
+        return func(*args)
+    executor, slots = _get_pool()
+    if not slots.acquire(blocking=False):
+        return abort(503, description='The server is busy, please try again later', retry_after=current_app.config['BCRYPT_RETRY_AFTER'])
+    try:
+        return executor.submit(func, *args).result()
+    finally:
+        slots.release()
+
+
+# hash a password with the configured work factor
+def generate_password_hash(password):
+    return _run(_hash_password, password, current_app.config['BCRYPT_LOG_ROUNDS'])
+
+
+# check a password against its hash
+def check_password_hash(password_hash, password):
+    return _run(_check_password, password_hash, password)
+
+
+# the hash was created with a different work factor than the configured one, e.g. after it has been changed
+def needs_rehash(password_hash):
+    # bcrypt hashes look like $2b$12$..., where 12 is the work factor
+    try:
+        return int(password_hash.split('$')[2]) != current_app.config['BCRYPT_LOG_ROUNDS']
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,37 @@
+from flask import current_app
+from collections import OrderedDict
+from threading import Lock
+import time
+
+# participant id -> (admin, expires at), the least recently used entries are dropped when it's full
+_entries = OrderedDict()
+_lock = Lock()
+
+
+# get the cached admin flag of a participant, returns None if it's not cached
+def get_admin(id):
+    id = str(id)
+    with _lock:
+        if id in _entries:
+            admin, expires_at = _entries[id]
+            if expires_at > time.monotonic():
+                _entries.move_to_end(id)
+                return admin
+            del _entries[id]
+    return None
+
+
+# cache the admin flag loaded from the database
+def remember(id, admin):
+    with _lock:
+        _entries[str(id)] = (admin, time.monotonic() + current_app.config['IDENTITY_CACHE_TTL'])
+        _entries.move_to_end(str(id))
+        while len(_entries) > current_app.config['IDENTITY_CACHE_SIZE']:
+            _entries.popitem(last=False)
+
+
+# drop the cached admin flag of a participant, e.g. when it's deleted, so this process loads it again at once
+# the other processes load it again once their entry has expired
+def forget(id):
+    with _lock:
+        _entries.pop(str(id), None)
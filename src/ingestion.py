@@ -0,0 +1,204 @@
+from flask import current_app, abort
+from main import db
+from sqlalchemy import exc
+from queue import Queue, Empty, Full
+from threading import Thread, Lock
+import response_cache
+import itertools
+import fcntl
+import json
+import os
+import time
+import uuid
+
+# the queue, journal and worker thread of this process, created on first use
+_state = {'pid': None, 'queue': None, 'path': None, 'journal': None, 'lock_file': None}
+# ticket -> {'status', 'error', 'at'}
+_tickets = {}
+_lock = Lock()
+
+
+# claim a journal no other process is using, by holding an exclusive lock on its lock file
+# the journal left behind by a crashed process is claimed, and replayed, by the next process starting
+def _claim_journal(directory):
+    os.makedirs(directory, exist_ok=True)
+    for slot in itertools.count():
+        lock_file = open(os.path.join(directory, f'results-{slot}.lock'), 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return os.path.join(directory, f'results-{slot}.jsonl'), lock_file
+
+
+# read the records of a journal, the last record of a ticket wins
+def _read_journal(path):
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path) as journal:
+        for line in journal:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the last line may have been cut by a crash
+                continue
+            records.setdefault(record['ticket'], {}).update(record)
+    return records
+
+
+# append records to the journal, a process crash doesn't lose what has been written to the OS
+def _write(records):
+    journal = _state['journal']
+    journal.write(''.join(json.dumps(record) + '\n' for record in records))
+    journal.flush()
+
+
+# rewrite the journal with only the queued results and the recent statuses, so it doesn't grow forever
+# the new journal is written next to the old one and swapped in, so a crash leaves one or the other
+def _compact(path, pending, ttl):
+    now = time.time()
+    for ticket in [ticket for ticket, status in _tickets.items() if status['status'] != 'queued' and status['at'] < now - ttl]:
+        del _tickets[ticket]
+    with open(path + '.tmp', 'w') as journal:
+        for ticket, input in pending:
+            journal.write(json.dumps({'ticket': ticket, 'input': input, 'at': _tickets[ticket]['at']}) + '\n')
+        for ticket, status in _tickets.items():
+            if status['status'] != 'queued':
+                journal.write(json.dumps({'ticket': ticket, **status}) + '\n')
+    os.replace(path + '.tmp', path)
+    if _state['journal'] is not None:
+        _state['journal'].close()
+    _state['journal'] = open(path, 'a')
+
+
+# start the queue and the worker thread of this process, the results left in the journal are queued again
+def start(app):
+    with _lock:
+        if _state['pid'] == os.getpid():
+            return
+        path, lock_file = _claim_journal(app.config['INGESTION_JOURNAL_DIR'])
+        _tickets.clear()
+        pending = []
+        for ticket, record in _read_journal(path).items():
+            if 'status' in record:
+                _tickets[ticket] = {'status': record['status'], 'error': record.get('error'), 'at': record['at']}
+            else:
+                _tickets[ticket] = {'status': 'queued', 'error': None, 'at': record['at']}
+                pending.append((ticket, record['input']))
+        _state['journal'] = None
+        _compact(path, pending, app.config['INGESTION_TICKET_TTL'])
+        queue = Queue(app.config['INGESTION_MAX_QUEUE'])
+        for item in pending:
+            queue.put(item)
+        _state.update(pid=os.getpid(), queue=queue, path=path, lock_file=lock_file)
+        Thread(target=_work, args=(app, queue), name='result-ingestion', daemon=True).start()
+        if pending:
+            app.logger.info('Replaying %d queued results from %s', len(pending), path)
+
+
+# queue a validated result, returns the ticket to follow it
+# if the queue is full, return 503 and ask the client to retry later
+def enqueue(input):
+    start(current_app._get_current_object())
+    ticket = uuid.uuid4().hex
+    now = time.time()
+    with _lock:
+        try:
+            _state['queue'].put_nowait((ticket, input))
+        except Full:
+            return abort(503, description='Too many results waiting to be written, please try again later',
+                         retry_after=current_app.config['INGESTION_RETRY_AFTER'])
+        _write([{'ticket': ticket, 'input': input, 'at': now}])
+        _tickets[ticket] = {'status': 'queued', 'error': None, 'at': now}
+    return ticket
+
+
+# get the status of a ticket: queued, applied or rejected, None if the ticket is unknown
+# tickets queued by other processes are looked up in their journals
+def status(ticket):
+    if ticket in _tickets:
+        return _tickets[ticket]
+    directory = current_app.config['INGESTION_JOURNAL_DIR']
+    if not os.path.isdir(directory):
+        return None
+    for name in os.listdir(directory):
+        if name.endswith('.jsonl'):
+            record = _read_journal(os.path.join(directory, name)).get(ticket)
+            if record:
+                return {'status': record.get('status', 'queued'), 'error': record.get('error'), 'at': record['at']}
+    return None
+
+
+# wait for a batch: up to INGESTION_BATCH_SIZE results, or what has arrived INGESTION_FLUSH_MS after the first one
+def _next_batch(queue, batch_size, flush_seconds):
+    batch = [queue.get()]
+    deadline = time.monotonic() + flush_seconds
+    while len(batch) < batch_size:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(queue.get(timeout=remaining))
+        except Empty:
+            break
+    return batch
+
+
+# write a batch of results in one transaction, returns {ticket: error message} of the rejected ones
+def _apply(batch):
+    from controllers.results_controller import insert_results
+    try:
+        errors = insert_results(batch)
+        db.session.commit()
+    # another request has added a result for one of these registrations meanwhile, write them one by one to find it
+    except exc.IntegrityError:
+        db.session.rollback()
+        errors = {}
+        for item in batch:
+            try:
+                errors.update(insert_results([item]))
+                db.session.commit()
+            except exc.IntegrityError:
+                db.session.rollback()
+                errors[item[0]] = 'Result with same registration id already exists'
+    if len(errors) < len(batch):
+        response_cache.bump('results')
+    return errors
+
+
+# the worker thread, writes the queued results in batches until the process exits
+def _work(app, queue):
+    batch_size = app.config['INGESTION_BATCH_SIZE']
+    flush_seconds = app.config['INGESTION_FLUSH_MS'] / 1000
+    while True:
+        batch = _next_batch(queue, batch_size, flush_seconds)
+        errors = None
+        while errors is None:
+            with app.app_context():
+                try:
+                    errors = _apply(batch)
+                except Exception:
+                    # e.g. the database is down, keep the batch and try again later
+                    app.logger.exception('Failed to write %d queued results, retrying', len(batch))
+                    db.session.rollback()
+                    time.sleep(1)
+                finally:
+                    db.session.remove()
+        now = time.time()
+        with _lock:
+            records = []
+            for ticket, input in batch:
+                _tickets[ticket] = {'status': 'rejected' if ticket in errors else 'applied', 'error': errors.get(ticket), 'at': now}
+                records.append({'ticket': ticket, **_tickets[ticket]})
+            _write(records)
+            # nothing is waiting, a good time to shrink the journal
+            if queue.empty() and os.path.getsize(_state['path']) > app.config['INGESTION_JOURNAL_MAX_BYTES']:
+                _compact(_state['path'], [], app.config['INGESTION_TICKET_TTL'])
+
+
+# start the worker when the app handles its first request, so the results left by a crash are written
+def init_app(app):
+    if app.config['RESULT_INGESTION'] == 'queue':
+        app.before_request(lambda: start(app))
@@ -0,0 +1,151 @@
+from main import db
+from sqlalchemy import select, insert, delete, event, func
+from models.leaderboard import Leaderboard
+from models.results import Result
+from models.registrations import Registration
+from models.participants import Participant
+import pubsub
+import streaming
+
+# the columns copied into the leaderboard
+COLUMNS = ['result_id', 'race_id', 'age_group_id', 'gender', 'pace_ms']
+
+
+# select the leaderboard entries from the live tables
+def live_entries():
+    return select(Result.id, Registration.race_id, Registration.age_group_id, Participant.gender, Result.pace_ms) \
+        .join(Registration, Result.registration_id == Registration.id) \
+        .join(Participant, Participant.id == Registration.participant_id)
+
+
+# refresh the entries of the given results, used when results are added or updated
+# it does not commit, so the entries are written in the same transaction as the results
+def sync_results(result_ids):
+    track_changes(Leaderboard.result_id.in_(result_ids), result_ids=result_ids)
+    db.session.execute(delete(Leaderboard).where(Leaderboard.result_id.in_(result_ids)))
+    db.session.execute(insert(Leaderboard).from_select(COLUMNS, live_entries().where(Result.id.in_(result_ids))))
+
+
+# refresh the entries of the results under the given registrations, e.g. when the age group has changed
+def sync_registrations(registration_ids):
+    result_ids = select(Result.id).where(Result.registration_id.in_(registration_ids))
+    track_changes(Leaderboard.result_id.in_(result_ids), registration_ids=registration_ids)
+    db.session.execute(delete(Leaderboard).where(Leaderboard.result_id.in_(result_ids)))
+    db.session.execute(insert(Leaderboard).from_select(COLUMNS, live_entries().where(Result.registration_id.in_(registration_ids))))
+
+
+# remove the entries of results which are going to be deleted
+def remove_results(result_ids):
+    track_changes(Leaderboard.result_id.in_(result_ids))
+    db.session.execute(delete(Leaderboard).where(Leaderboard.result_id.in_(result_ids)))
+
+
+# recreate the leaderboard of one race, or all races if race id is not passed
+def rebuild(race_id=None):
+    entries = live_entries()
+    clear = delete(Leaderboard)
+    if race_id is not None:
+        entries = entries.where(Registration.race_id == race_id)
+        clear = clear.where(Leaderboard.race_id == race_id)
+    db.session.execute(clear)
+    db.session.execute(insert(Leaderboard).from_select(COLUMNS, entries))
+
+
+# compare the leaderboard with the live tables, returns the entries which are missing or stale
+def check(race_id=None):
+    entries = live_entries()
+    stored = select(*[getattr(Leaderboard, column) for column in COLUMNS])
+    if race_id is not None:
+        entries = entries.where(Registration.race_id == race_id)
+        stored = stored.where(Leaderboard.race_id == race_id)
+    live = set(tuple(row) for row in db.session.execute(entries))
+    stored = set(tuple(row) for row in db.session.execute(stored))
+    return {
+        'missing': sorted(live - stored),
+        'stale': sorted(stored - live)
+    }
+
+
+# a leaderboard row as returned by the api
+def entry(row, place):
+    return {
+        'place': place,
+        'first_name': row.first_name,
+        'last_name': row.last_name,
+        'finished': row.finished,
+        'start_at': str(row.start_at),
+        'finish_at': str(row.finish_at),
+        'finish_time': str(row.finish_time),
+        'pace': str(row.pace)
+    }
+
+
+# select the entries of the given results with their place in the race
+def ranked_entries(result_ids):
+    ranked = select(Leaderboard.result_id, Leaderboard.race_id, func.row_number().over(
+        partition_by=Leaderboard.race_id, order_by=(Leaderboard.pace_ms, Leaderboard.result_id)).label('place')) \
+        .where(Leaderboard.race_id.in_(select(Leaderboard.race_id).where(Leaderboard.result_id.in_(result_ids)))) \
+        .subquery()
+    return select(ranked.c.result_id, ranked.c.race_id, ranked.c.place, Participant.first_name, Participant.last_name,
+                  Result.finished, Result.start_at, Result.finish_at, Result.finish_time, Result.pace) \
+        .join(Result, Result.id == ranked.c.result_id) \
+        .join(Registration, Result.registration_id == Registration.id) \
+        .join(Participant, Participant.id == Registration.participant_id) \
+        .where(ranked.c.result_id.in_(result_ids))
+
+
+# remember which entries are changed in the transaction, and the race they were in before,
+# so the live leaderboards can be sent the changes once it's committed
+# nothing is tracked if no client is listening
+def track_changes(condition, result_ids=(), registration_ids=()):
+    if not pubsub.has_subscribers():
+        return
+    changes = db.session.info.setdefault('leaderboard_changes', {'results': set(), 'registrations': set(), 'previous': {}})
+    changes['results'].update(result_ids)
+    changes['registrations'].update(registration_ids)
+    for result_id, race_id in db.session.execute(select(Leaderboard.result_id, Leaderboard.race_id).where(condition)):
+        changes['previous'].setdefault(result_id, race_id)
+
+
+# before the commit, turn the changes into events with the new place of each entry, in one query
+# an entry which has left a race is removed from it
+@event.listens_for(db.session, 'before_commit')
+def prepare_events(session):
+    # a savepoint released inside POST /batch, the changes are sent when the batch is committed
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop('leaderboard_changes', None)
+    if not changes:
+        return
+    result_ids = set(changes['results'])
+    if changes['registrations']:
+        result_ids.update(session.execute(select(Result.id).where(Result.registration_id.in_(changes['registrations']))).scalars())
+    events = []
+    current = {}
+    for row in session.execute(ranked_entries(result_ids)):
+        current[row.result_id] = row.race_id
+        events.append((row.race_id, streaming.event_frame('place', {'result_id': row.result_id, **entry(row, row.place)})))
+    for result_id, race_id in changes['previous'].items():
+        if current.get(result_id) != race_id:
+            events.append((race_id, streaming.event_frame('remove', {'result_id': result_id})))
+    session.info.setdefault('leaderboard_events', []).extend(events)
+
+
+# send the events once the changes are visible to everyone
+@event.listens_for(db.session, 'after_commit')
+def publish_events(session):
+    if session.in_nested_transaction():
+        return
+    for race_id, frame in session.info.pop('leaderboard_events', []):
+        pubsub.publish(('results', race_id), frame)
+
+
+# nothing happened if the transaction is rolled back
+# an operation rolled back inside POST /batch keeps the changes of the others, the events are built from
+# what is in the leaderboard at commit, so its entries are sent as they were before it
+@event.listens_for(db.session, 'after_rollback')
+def discard_events(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('leaderboard_changes', None)
+    session.info.pop('leaderboard_events', None)
@@ -3,8 +3,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
 from flask_marshmallow import Marshmallow
 from flask_jwt_extended import JWTManager
+from routing import RoutingSession
 
-db = SQLAlchemy(session_options={"autoflush": False})
+db = SQLAlchemy(session_options={"autoflush": False, "class_": RoutingSession})
 bcrypt = Bcrypt()
 ma = Marshmallow()
 jwt = JWTManager()
@@ -19,6 +20,10 @@ def create_app():
     # creating database object, This allows us to use ORM
     db.init_app(app)
 
+    # send the queries of read only routes to the read replica, if there is one
+    import routing
+    routing.init_app(app)
+
     #creating the jwt and bcrypt objects, this allows us to use authentication
     bcrypt.init_app(app)
 
@@ -28,6 +33,14 @@ def create_app():
     # creating JWT object, which allows us to use authentication
     jwt.init_app(app)
 
+    # count queries and time spent in each request, the histograms are exposed on /metrics
+    import metrics
+    metrics.init_app(app)
+
+    # write the queued results in the background, when RESULT_INGESTION is "queue"
+    import ingestion
+    ingestion.init_app(app)
+
     # import controllers and activate blueprints
     from controllers import registrable_controllers
     for controller in registrable_controllers:
@@ -37,5 +50,14 @@ def create_app():
     from commands import db_commands
     app.register_blueprint(db_commands)
 
+    # import benchmark commands and activate blueprint
+    from benchmarks import bench_commands
+    app.register_blueprint(bench_commands)
+
+    # load the libraries and caches the first requests would load, if WARM_UP is set
+    if app.config['WARM_UP']:
+        import warmup
+        warmup.warm_up(app)
+
     return app
 
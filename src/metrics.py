@@ -0,0 +1,135 @@
+from flask import Blueprint, Response, g, request, current_app, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Mapper
+from validator import is_admin
+from threading import Lock
+import time
+
+metrics = Blueprint('metrics', __name__)
+
+# upper bounds of the histogram buckets
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+QUERY_BUCKETS = [0, 1, 2, 5, 10, 25, 50, 100, 250, 1000]
+ROW_BUCKETS = [0, 1, 10, 100, 1000, 10000, 100000]
+
+# name, help text and buckets of each histogram
+HISTOGRAMS = {
+    'http_request_duration_seconds': ('Time spent handling the request', LATENCY_BUCKETS),
+    'http_request_db_duration_seconds': ('Time spent waiting for the database', LATENCY_BUCKETS),
+    'http_request_queries': ('Number of queries sent to the database', QUERY_BUCKETS),
+    'http_request_rows': ('Number of rows loaded from the database', ROW_BUCKETS),
+}
+
+# (histogram name, blueprint) -> [bucket counts, sum, count]
+_histograms = {}
+_lock = Lock()
+
+
+# add a value to the histogram of a blueprint
+def observe(name, blueprint, value):
+    buckets = HISTOGRAMS[name][1]
+    with _lock:
+        histogram = _histograms.setdefault((name, blueprint), [[0] * len(buckets), 0, 0])
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+# time each query sent to the database while handling a request
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and conn.info.get('query_start'):
+        g.db_time = g.get('db_time', 0) + time.perf_counter() - conn.info['query_start'].pop()
+        g.query_count = g.get('query_count', 0) + 1
+
+
+# count the rows loaded while handling a request
+# the cursor doesn't know how many rows a select returns until they are fetched (rowcount is -1 on SQLite and for
+# server side cursors), so the rows are counted as they are loaded: each object by the orm, and the rows of the
+# lists read as plain rows by the routes themselves
+def count_rows(count):
+    if has_request_context():
+        g.row_count = g.get('row_count', 0) + count
+
+
+@event.listens_for(Mapper, 'load')
+def object_loaded(target, context):
+    count_rows(1)
+
+
+# reset the counters, g is shared when requests run inside an existing app context (e.g. in cli commands)
+def start_timer():
+    g.request_start = time.perf_counter()
+    g.db_time = 0
+    g.query_count = 0
+    g.row_count = 0
+
+
+# add the time spent so far to the response, streamed responses keep querying after the headers are sent
+def add_server_timing(response):
+    if 'request_start' in g:
+        total = (time.perf_counter() - g.request_start) * 1000
+        response.headers['Server-Timing'] = f'db;dur={g.get("db_time", 0) * 1000:.1f};desc="{g.get("query_count", 0)} queries", app;dur={total:.1f}'
+        g.status_code = response.status_code
+    return response
+
+
+# record the request once it's completely finished, including the body of streamed responses
+def record_request(exception=None):
+    # the operations of POST /batch are recorded as part of the batch
+    if 'request_start' not in g or g.get('batch') is not None:
+        return
+    duration = time.perf_counter() - g.request_start
+    blueprint = request.blueprint or 'none'
+    observe('http_request_duration_seconds', blueprint, duration)
+    observe('http_request_db_duration_seconds', blueprint, g.get('db_time', 0))
+    observe('http_request_queries', blueprint, g.get('query_count', 0))
+    observe('http_request_rows', blueprint, g.get('row_count', 0))
+    if duration * 1000 > current_app.config['SLOW_REQUEST_MS']:
+        current_app.logger.warning('Slow request: %s %s %s took %.0fms, %d queries, %.0fms in the database',
+                                   request.method, request.full_path, g.get('status_code', 500), duration * 1000,
+                                   g.get('query_count', 0), g.get('db_time', 0) * 1000)
+
+
+# a route to expose the histograms in the Prometheus text format
+# admin only, unless METRICS_PUBLIC is set, e.g. when the route is only reachable by the scraper on an internal network
+@metrics.route('/metrics', methods=['GET'])
+def get_metrics():
+    if current_app.config['METRICS_PUBLIC']:
+        return metrics_response()
+    return is_admin(metrics_response)()
+
+
+def metrics_response():
+    lines = []
+    with _lock:
+        histograms = sorted(_histograms.items())
+        for name, (description, buckets) in HISTOGRAMS.items():
+            lines.append(f'# HELP {name} {description}')
+            lines.append(f'# TYPE {name} histogram')
+            for (histogram_name, blueprint), (counts, total, count) in histograms:
+                if histogram_name != name:
+                    continue
+                for bound, bucket_count in zip(buckets, counts):
+                    lines.append(f'{name}_bucket{{blueprint="{blueprint}",le="{bound}"}} {bucket_count}')
+                lines.append(f'{name}_bucket{{blueprint="{blueprint}",le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{blueprint="{blueprint}"}} {total}')
+                lines.append(f'{name}_count{{blueprint="{blueprint}"}} {count}')
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+# register the hooks and the metrics route on the app
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(add_server_timing)
+    app.teardown_request(record_request)
+    app.register_blueprint(metrics)
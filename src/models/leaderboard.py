@@ -0,0 +1,15 @@
+from main import db
+
+class Leaderboard(db.Model):
+    # define table name
+    __tablename__ = 'leaderboard'
+    # one entry for each result, so result id is the primary key
+    result_id = db.Column(db.Integer(), db.ForeignKey('results.id', ondelete='CASCADE'), primary_key=True)
+    # copies of the categories of the result, so the leaderboard can be read without sorting all results
+    race_id = db.Column(db.Integer(), nullable=False)
+    age_group_id = db.Column(db.Integer(), nullable=False)
+    gender = db.Column(db.String(), nullable=False)
+    pace_ms = db.Column(db.Integer(), nullable=False)
+    # the leaderboard of a race, and of a race under an age group and gender, are ordered range reads on these indexes
+    index = db.Index('ix_leaderboard_race_id_pace', race_id, pace_ms, result_id)
+    category_index = db.Index('ix_leaderboard_category_pace', race_id, age_group_id, gender, pace_ms, result_id)
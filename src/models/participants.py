@@ -16,3 +16,5 @@ class Participant(db.Model):
     gender = db.Column(db.String(), nullable=False)
     admin = db.Column(db.Boolean(), nullable=False, default=False)
     registrations = db.relationship('Registration', backref = 'participant')
+    # index used when filtering results by gender
+    index = db.Index('ix_participants_gender', gender)
@@ -0,0 +1,9 @@
+from main import db
+
+class RaceCapacity(db.Model):
+    # define table name
+    __tablename__ = 'race_capacities'
+    # one counter for each race
+    race_id = db.Column(db.Integer(), db.ForeignKey('races.id', ondelete='CASCADE'), primary_key=True)
+    # number of places taken by registrations, never more than the field limit of the race
+    taken = db.Column(db.Integer(), nullable=False, default=0)
@@ -16,6 +16,8 @@ class Registration(db.Model):
     # add a constraint: the combination of participant id and race id should be unique
     constraint = db.UniqueConstraint(participant_id, race_id)
     constraint = db.UniqueConstraint(bib_number, race_id)
+    # index used when filtering results by race and age group
+    index = db.Index('ix_registrations_race_id_age_group_id', race_id, age_group_id)
     result = db.relationship(
         'Result',
         backref = 'registration',
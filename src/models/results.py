@@ -16,3 +16,10 @@ class Result(db.Model):
     finish_time = db.Column(db.Time(), nullable=False)
     # average pace per km
     pace = db.Column(db.Time(), nullable=False)
+    # the same in milliseconds, integers sort and compare cheaply, don't wrap at 24 hours and keep sub-second precision
+    finish_ms = db.Column(db.BigInteger(), nullable=False)
+    pace_ms = db.Column(db.Integer(), nullable=False)
+    # results are ranked by pace, id is added so the index also serves the next page of the leaderboard
+    index = db.Index('ix_results_pace_ms_id', pace_ms, id)
+    # there is no index on finish_ms: nothing filters or sorts on it, a race is ranked by pace (the same order, as every
+    # runner covers the same distance) and finish_ms is only read along with its row, so an index would only slow the writes
@@ -0,0 +1,20 @@
+from main import db
+
+class Split(db.Model):
+    # define table name
+    __tablename__ = 'splits'
+    # add primary key
+    id = db.Column(db.Integer(), primary_key=True)
+    # add foreign key, the splits go away with the registration
+    registration_id = db.Column(db.Integer(), db.ForeignKey('registrations.id', ondelete='CASCADE'), nullable=False)
+    # copy of the race of the registration, so the ranking of a checkpoint is read from one index without a join
+    race_id = db.Column(db.Integer(), nullable=False)
+    # distance of the checkpoint from the start, in meters
+    distance_m = db.Column(db.Integer(), nullable=False)
+    # time since the participant crossed the start line, and average pace per km, in milliseconds
+    elapsed_ms = db.Column(db.BigInteger(), nullable=False)
+    pace_ms = db.Column(db.Integer(), nullable=False)
+    # a participant is timed once at each checkpoint, a mat sending the same split again updates it
+    constraint = db.UniqueConstraint(registration_id, distance_m)
+    # the ranking of a checkpoint is an ordered range read on this index
+    index = db.Index('ix_splits_race_id_distance_m_elapsed_ms', race_id, distance_m, elapsed_ms, registration_id)
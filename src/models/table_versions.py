@@ -0,0 +1,9 @@
+from main import db
+
+class TableVersion(db.Model):
+    # define table name
+    __tablename__ = 'table_versions'
+    # name of a table the cached responses are built from
+    name = db.Column(db.String(), primary_key=True)
+    # incremented each time the api writes to the table, shared by all the processes serving the api
+    version = db.Column(db.Integer(), nullable=False, default=0)
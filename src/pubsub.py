@@ -0,0 +1,48 @@
+from queue import Queue, Full
+from threading import Lock
+
+# channel -> subscriptions, in this process only
+_subscribers = {}
+_lock = Lock()
+
+
+# the messages waiting to be sent to one client
+class Subscription(Queue):
+    # set when the client was too slow and messages have been lost
+    dropped = False
+
+
+# start receiving the messages of a channel, at most maxsize messages can be waiting
+def subscribe(channel, maxsize):
+    subscription = Subscription(maxsize)
+    with _lock:
+        _subscribers.setdefault(channel, set()).add(subscription)
+    return subscription
+
+
+# stop receiving the messages of a channel
+def unsubscribe(channel, subscription):
+    with _lock:
+        subscriptions = _subscribers.get(channel)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del _subscribers[channel]
+
+
+# true if any client is listening, so publishers can skip preparing messages nobody will receive
+def has_subscribers():
+    return bool(_subscribers)
+
+
+# send a message to every subscription of a channel, it never blocks the publisher
+def publish(channel, message):
+    with _lock:
+        subscriptions = list(_subscribers.get(channel, ()))
+    for subscription in subscriptions:
+        try:
+            subscription.put_nowait(message)
+        except Full:
+            # a slow client would make the queue grow forever, drop it so it can reconnect and start again
+            subscription.dropped = True
+            unsubscribe(channel, subscription)
@@ -0,0 +1,119 @@
+from flask import request, current_app, make_response, Response, g, has_app_context
+from functools import wraps
+from collections import OrderedDict
+from threading import Lock
+from hashlib import md5
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+from main import db
+from models.table_versions import TableVersion
+import time
+
+# cached responses: key -> (body, mimetype, expires at), the least recently used are dropped when it's full
+_responses = OrderedDict()
+_lock = Lock()
+
+
+# mark the tables as changed, the cached responses built from them will no longer be used
+# the versions are kept in the database, so a write handled by one worker is seen by the caches of all the others
+def bump(*tables):
+    # inside POST /batch the changes are only visible once the batch is committed, the batch bumps the tables then
+    if has_app_context() and g.get('batch') is not None:
+        g.batch['tables'].update(tables)
+        return
+    if not tables:
+        return
+    dialect_insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    # the rows are always locked in the same order, so concurrent bumps can't deadlock
+    statement = dialect_insert(TableVersion).values([{'name': table, 'version': 1} for table in sorted(set(tables))])
+    statement = statement.on_conflict_do_update(index_elements=['name'], set_={'version': TableVersion.version + 1})
+    # in its own transaction, it's called once the changes of the route are committed
+    with db.engine.begin() as connection:
+        connection.execute(statement)
+
+
+# get the current versions of the tables, other caches can use them to know when their data is out of date
+def versions(*tables):
+    stored = dict(db.session.execute(select(TableVersion.name, TableVersion.version).where(TableVersion.name.in_(tables))).all())
+    return tuple(stored.get(table, 0) for table in tables)
+
+
+# get a cached response body, returns None if it's not cached or has expired
+def _get(key):
+    with _lock:
+        entry = _responses.get(key)
+        if entry is None:
+            return None
+        if entry[2] < time.monotonic():
+            del _responses[key]
+            return None
+        _responses.move_to_end(key)
+        return entry
+
+
+# cache a response body
+def _put(key, body, mimetype, ttl, size):
+    with _lock:
+        _responses[key] = (body, mimetype, time.monotonic() + ttl)
+        _responses.move_to_end(key)
+        while len(_responses) > size:
+            _responses.popitem(last=False)
+
+
+# define a decorator to cache the response of a read route, which depends on the given tables
+# the etag is computed from the versions of the tables, so If-None-Match is answered with a single lookup of them
+def cached(*tables):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # the operations of a batch see its uncommitted changes, their responses must not be cached
+            if g.get('batch') is not None:
+                return func(*args, **kwargs)
+            config = current_app.config
+            key = (request.full_path, versions(*tables))
+            etag = md5(repr(key).encode()).hexdigest()
+            # the client already has the latest version
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            entry = _get(key)
+            if entry is not None:
+                response = Response(entry[0], mimetype=entry[1])
+                response.set_etag(etag)
+                return response
+
+            response = make_response(func(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            response.set_etag(etag)
+            ttl, size, max_body = config['RESPONSE_CACHE_TTL'], config['RESPONSE_CACHE_SIZE'], config['RESPONSE_CACHE_MAX_BODY']
+            if response.is_streamed:
+                # keep streaming, the body is cached once it has been sent completely
+                response.response = _capture(response.response, key, response.mimetype, ttl, size, max_body)
+            elif response.content_length is None or response.content_length <= max_body:
+                _put(key, response.get_data(), response.mimetype, ttl, size)
+            return response
+        return wrapper
+    return decorator
+
+
+# pass the chunks of a streamed response through, and cache the body at the end if it's small enough
+def _capture(iterable, key, mimetype, ttl, size, max_body):
+    chunks = []
+    length = 0
+    try:
+        for chunk in iterable:
+            yield chunk
+            if chunks is not None:
+                chunk = chunk.encode() if isinstance(chunk, str) else chunk
+                length += len(chunk)
+                if length <= max_body:
+                    chunks.append(chunk)
+                else:
+                    chunks = None
+        if chunks is not None:
+            _put(key, b''.join(chunks), mimetype, ttl, size)
+    finally:
+        if hasattr(iterable, 'close'):
+            iterable.close()
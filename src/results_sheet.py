@@ -0,0 +1,82 @@
+from flask import current_app, g
+from main import db
+from sqlalchemy import select, func
+from collections import OrderedDict
+from threading import Lock
+from models.leaderboard import Leaderboard
+from models.results import Result
+from models.registrations import Registration
+from models.participants import Participant
+from models.age_groups import Age_group
+import response_cache
+import metrics
+import time
+
+# the tables the sheet is built from, it's built again when any of them has changed
+TABLES = ('results', 'registrations', 'participants', 'age_groups')
+
+# race id -> (versions of the tables, keys, rows, expires at), the least recently used races are dropped when it's full
+_sheets = OrderedDict()
+_lock = Lock()
+
+
+# select the results of a race with their overall, gender and category (age group and gender) places
+# the three places are window functions over the same ordered scan of the leaderboard, so it's a single query
+def sheet_query(race_id):
+    order = (Leaderboard.pace_ms, Leaderboard.result_id)
+    return select(
+        Leaderboard.result_id, Leaderboard.pace_ms, Leaderboard.gender,
+        func.row_number().over(order_by=order).label('overall_place'),
+        func.row_number().over(partition_by=Leaderboard.gender, order_by=order).label('gender_place'),
+        func.row_number().over(partition_by=(Leaderboard.age_group_id, Leaderboard.gender), order_by=order).label('category_place'),
+        Registration.bib_number, Participant.first_name, Participant.last_name, Age_group.min_age, Age_group.max_age,
+        Result.finish_time, Result.pace) \
+        .join(Result, Result.id == Leaderboard.result_id) \
+        .join(Registration, Result.registration_id == Registration.id) \
+        .join(Participant, Participant.id == Registration.participant_id) \
+        .join(Age_group, Age_group.id == Leaderboard.age_group_id) \
+        .where(Leaderboard.race_id == race_id) \
+        .order_by(*order)
+
+
+# build the sheet of a race: the (pace_ms, result_id) key of each row, used to find where a page starts, and the rows
+def build(race_id):
+    keys = []
+    rows = []
+    for row in db.session.execute(sheet_query(race_id)):
+        keys.append((row.pace_ms, row.result_id))
+        rows.append({
+            'overall_place': row.overall_place,
+            'gender_place': row.gender_place,
+            'category_place': row.category_place,
+            'bib_number': row.bib_number,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'gender': row.gender,
+            'age_group': {'min_age': row.min_age, 'max_age': row.max_age},
+            'finish_time': str(row.finish_time),
+            'pace': str(row.pace)
+        })
+    metrics.count_rows(len(rows))
+    return keys, rows
+
+
+# get the sheet of a race, from the cache if none of its tables has changed since it was built
+# the versions only know the changes made through the api, so the sheet also expires after RESPONSE_CACHE_TTL
+def get(race_id):
+    # the operations of a batch see its uncommitted changes, so the sheet is built for them and not cached
+    if g.get('batch') is not None:
+        return build(race_id)
+    versions = response_cache.versions(*TABLES)
+    with _lock:
+        entry = _sheets.get(race_id)
+        if entry is not None and entry[0] == versions and entry[3] > time.monotonic():
+            _sheets.move_to_end(race_id)
+            return entry[1], entry[2]
+    keys, rows = build(race_id)
+    with _lock:
+        _sheets[race_id] = (versions, keys, rows, time.monotonic() + current_app.config['RESPONSE_CACHE_TTL'])
+        _sheets.move_to_end(race_id)
+        while len(_sheets) > current_app.config['RESULTS_SHEET_CACHE_SIZE']:
+            _sheets.popitem(last=False)
+    return keys, rows
@@ -0,0 +1,83 @@
+from flask import g, has_app_context, current_app, abort
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from functools import wraps
+
+
+# session sending the queries of read only routes to the read replica, when DATABASE_READ_URL is set
+# writes, and everything outside of read only routes, go to the primary database
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        # the operations of a batch read their own writes, so they all stay on the primary
+        if bind is None and not self._flushing and has_app_context() and g.get('read_only') and 'batch_savepoint' not in self.info:
+            engine = self._db.engines.get('read')
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    # inside POST /batch, every operation runs in a savepoint of the transaction of the batch
+    # a commit of the routes only flushes, the batch commits everything at the end
+    def commit(self):
+        if 'batch_savepoint' not in self.info:
+            return super().commit()
+        self.flush()
+
+    # and a rollback only undoes the current operation, which continues in a new savepoint
+    def rollback(self):
+        if 'batch_savepoint' not in self.info:
+            return super().rollback()
+        self.info['batch_savepoint'].rollback()
+        self.info['batch_savepoint'] = self.begin_nested()
+
+
+# decorator for routes which only read the database, their queries can be sent to the read replica
+def read_only(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        return func(*args, **kwargs)
+    return wrapper
+
+
+# g is shared when requests run inside an existing app context (e.g. in cli commands), so reset the flag
+def reset_read_only():
+    g.read_only = False
+
+
+# pysqlite starts transactions itself and doesn't support savepoints inside them, which POST /batch relies on
+# so let SQLAlchemy begin the transactions, as recommended by its documentation
+def enable_sqlite_savepoints(engine):
+    @event.listens_for(engine, 'connect')
+    def connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    # begin_write passes 'BEGIN IMMEDIATE' to take the write lock straight away
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        connection.exec_driver_sql(connection.get_execution_options().get('sqlite_begin', 'BEGIN'))
+
+
+# end the reads of a route and start its write transaction, with the write lock taken straight away
+# SQLite can't turn a read transaction into a write one while another connection is writing, it fails at once with
+# "database is locked" instead of waiting, so the write lock is taken first and concurrent writers wait for each other
+# if the lock isn't free within the busy timeout, the client is asked to retry later
+# PostgreSQL locks rows rather than the database, so nothing is needed there
+def begin_write(session):
+    # inside POST /batch, the routes can't end the transaction of the batch
+    if 'batch_savepoint' in session.info or session.get_bind().dialect.name != 'sqlite':
+        return
+    # end the reads done so far, e.g. by the admin check
+    session.commit()
+    try:
+        session.connection(execution_options={'sqlite_begin': 'BEGIN IMMEDIATE'})
+    except exc.OperationalError:
+        session.rollback()
+        return abort(503, description='The server is busy, please try again later', retry_after=current_app.config['WRITE_RETRY_AFTER'])
+
+
+def init_app(app):
+    app.before_request(reset_read_only)
+    with app.app_context():
+        for engine in app.extensions['sqlalchemy'].engines.values():
+            if engine.dialect.name == 'sqlite':
+                enable_sqlite_savepoints(engine)
@@ -0,0 +1,35 @@
+from marshmallow import fields
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload, selectinload
+
+# loader options of each (schema, model), derived once
+_options = {}
+
+
+# derive the loader options from the nested fields a schema will dump
+# so the related rows are loaded together with the list, instead of one lazy load per row
+def eager_load_options(schema, model):
+    if (schema, model) not in _options:
+        _options[(schema, model)] = _derive_options(schema, model, None)
+    return _options[(schema, model)]
+
+
+def _derive_options(schema, model, parent):
+    options = []
+    relationships = inspect(model).relationships
+    for name, field in schema.dump_fields.items():
+        attribute = field.attribute or name
+        # Pluck is a Nested field as well
+        if not isinstance(field, fields.Nested) or attribute not in relationships:
+            continue
+        relationship = relationships[attribute]
+        # many-to-one can be joined, collections are loaded with a second query
+        loader = 'selectinload' if relationship.uselist else 'joinedload'
+        if parent is None:
+            option = (selectinload if relationship.uselist else joinedload)(getattr(model, attribute))
+        else:
+            option = getattr(parent, loader)(getattr(model, attribute))
+        # load the nested fields of the nested schema as well
+        nested_options = _derive_options(field.schema, relationship.mapper.class_, option)
+        options += nested_options or [option]
+    return options
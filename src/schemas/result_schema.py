@@ -5,9 +5,11 @@ from marshmallow import fields
 class ResultSchema(ma.Schema):
     class Meta:
         # fields to output
-        fields = ('registration','id','registration_id','finished','start_at','finish_at','finish_time','pace')
+        fields = ('registration','id','registration_id','finished','start_at','finish_at','finish_time','pace','finish_ms','pace_ms')
         # make sure output is ordered as the order in the fields
         ordered = True
+        # calculated from the start and finish timestamps, they can't be passed in
+        dump_only = ['finish_ms', 'pace_ms']
 
     # only extract the participant's name
     registration = fields.Pluck('RegistrationSchema', 'participant', data_key='participant')
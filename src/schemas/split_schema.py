@@ -0,0 +1,12 @@
+from main import ma
+
+
+class SplitSchema(ma.Schema):
+    class Meta:
+        # fields of a split sent by a timing mat, the distance is in km and elapsed is the time since the start
+        fields = ('bib_number', 'distance', 'elapsed')
+        # make sure output is ordered as the order in the fields
+        ordered = True
+
+# single split schema, which allows to validate the splits of a bulk upload
+split_schema = SplitSchema()
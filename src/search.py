@@ -0,0 +1,268 @@
+from main import db
+from flask import current_app
+from sqlalchemy import select, event, func, or_, collate, text, inspect
+from sqlalchemy.orm import object_session
+from models.participants import Participant
+from models.registrations import Registration
+from bisect import bisect_left, bisect_right
+from array import array
+from threading import Lock, Thread
+import sys
+import time
+
+# the indexes used by the search on PostgreSQL, created by "flask db init" and "flask db create-search-indexes"
+# trigrams find a part of the name anywhere, the prefix indexes serve queries too short to have a trigram
+# the bib index uses the C collation, so a prefix is a range of the index in the order it's returned
+POSTGRES_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    "CREATE INDEX IF NOT EXISTS ix_participants_name_trgm ON participants USING gin (lower(first_name || ' ' || last_name) gin_trgm_ops)",
+    'CREATE INDEX IF NOT EXISTS ix_participants_first_name_prefix ON participants (lower(first_name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_participants_last_name_prefix ON participants (lower(last_name) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_registrations_bib_number_prefix ON registrations (bib_number COLLATE "C", race_id)',
+]
+
+# sorts after any character a name or a bib will contain, so [prefix, prefix + LAST_CHARACTER) holds every match
+LAST_CHARACTER = '\uffff'
+
+# the in-process prefix index used on other databases: every first and last name in lowercase, sorted,
+# with the id of the participant at the same position
+# the changes committed while it's being loaded are kept in 'changes', to be applied to the loaded index as well
+_index = {'tokens': None, 'ids': None, 'loaded_at': 0, 'changes': None}
+# held by the searches and the changes while they use the index, only for a bisect or an insert
+_lock = Lock()
+# only one thread loads the index at a time
+_load_lock = Lock()
+
+
+# create the search indexes, it does nothing on databases other than PostgreSQL
+def create_indexes():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    with db.engine.begin() as connection:
+        for statement in POSTGRES_INDEXES:
+            connection.execute(text(statement))
+    return True
+
+
+def is_postgresql():
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+# the words of a query, in lowercase
+def words(q):
+    return q.lower().split()
+
+
+# the words of the first and last name of a participant
+def name_tokens(first_name, last_name):
+    return set(words(first_name or '') + words(last_name or ''))
+
+
+# add and remove the entries of a participant whose name has changed
+# it does nothing for an entry which is already there or already gone, so a change can be applied twice
+def apply_change(tokens, ids, id, old_tokens, new_tokens):
+    for token in old_tokens - new_tokens:
+        start = bisect_left(tokens, token)
+        end = bisect_right(tokens, token, start)
+        position = bisect_left(ids, id, start, end)
+        if position < end and ids[position] == id:
+            del tokens[position]
+            del ids[position]
+    for token in new_tokens - old_tokens:
+        start = bisect_left(tokens, token)
+        end = bisect_right(tokens, token, start)
+        position = bisect_left(ids, id, start, end)
+        if position == end or ids[position] != id:
+            tokens.insert(position, sys.intern(token))
+            ids.insert(position, id)
+
+
+# load the names of all participants into the prefix index, returns the tokens and ids loaded
+# the tokens are interned, so a first name shared by thousands of participants is stored once
+def load():
+    with _lock:
+        _index['changes'] = []
+    try:
+        entries = []
+        for id, first_name, last_name in db.session.execute(select(Participant.id, Participant.first_name, Participant.last_name)):
+            for token in name_tokens(first_name, last_name):
+                entries.append((sys.intern(token), id))
+        entries.sort()
+        tokens = [token for token, id in entries]
+        ids = array('q', [id for token, id in entries])
+        with _lock:
+            # the changes committed during the load may be missing from the names which have been read
+            for id, old_tokens, new_tokens in _index['changes']:
+                apply_change(tokens, ids, id, old_tokens or set(), new_tokens)
+            _index.update(tokens=tokens, ids=ids, loaded_at=time.monotonic())
+    finally:
+        with _lock:
+            _index['changes'] = None
+    return tokens, ids
+
+
+# load the index again in the background, the searches keep using the current one meanwhile
+def reload(app):
+    try:
+        with app.app_context():
+            try:
+                load()
+            finally:
+                db.session.remove()
+    except Exception:
+        app.logger.exception('The search index could not be loaded')
+    finally:
+        _load_lock.release()
+
+
+# the tokens and ids of the index, loaded by the first search while the other searches wait for it
+def loaded_index():
+    with _lock:
+        tokens, ids, loaded_at = _index['tokens'], _index['ids'], _index['loaded_at']
+    if tokens is None:
+        with _load_lock:
+            if _index['tokens'] is None:
+                return load()
+            return _index['tokens'], _index['ids']
+    # reload the index after the ttl, in case participants have been changed by another process
+    if time.monotonic() - loaded_at > current_app.config['SEARCH_INDEX_TTL'] and _load_lock.acquire(blocking=False):
+        Thread(target=reload, args=(current_app._get_current_object(),), name='search-index', daemon=True).start()
+    return tokens, ids
+
+
+# apply the changes of a committed transaction to the index
+def update_index(changes):
+    with _lock:
+        if _index['changes'] is not None:
+            _index['changes'].extend(changes)
+        if _index['tokens'] is None:
+            return
+        for id, old_tokens, new_tokens in changes:
+            # the previous name wasn't loaded, so its entries can't be found, the index is loaded again soon
+            if old_tokens is None:
+                _index['loaded_at'] = 0
+            apply_change(_index['tokens'], _index['ids'], id, old_tokens or set(), new_tokens)
+
+
+# the name of a participant before the changes being flushed, None if it wasn't loaded
+def previous_name_tokens(participant):
+    names = []
+    for attribute in [inspect(participant).attrs.first_name, inspect(participant).attrs.last_name]:
+        history = attribute.history
+        if history.deleted:
+            names.append(history.deleted[0])
+        elif history.added:
+            return None
+        else:
+            names.append(attribute.value)
+    return name_tokens(*names)
+
+
+# remember the participants added, renamed or deleted in the transaction, the index is changed once it's committed
+def track_change(participant, old_tokens, new_tokens):
+    if old_tokens != new_tokens:
+        object_session(participant).info.setdefault('search_changes', []).append((participant.id, old_tokens, new_tokens))
+
+
+@event.listens_for(Participant, 'after_insert')
+def participant_added(mapper, connection, participant):
+    track_change(participant, set(), name_tokens(participant.first_name, participant.last_name))
+
+
+# most updates don't touch the name, e.g. a new mobile or the password rehashed on login
+@event.listens_for(Participant, 'after_update')
+def participant_updated(mapper, connection, participant):
+    state = inspect(participant)
+    if state.attrs.first_name.history.has_changes() or state.attrs.last_name.history.has_changes():
+        track_change(participant, previous_name_tokens(participant), name_tokens(participant.first_name, participant.last_name))
+
+
+@event.listens_for(Participant, 'after_delete')
+def participant_deleted(mapper, connection, participant):
+    track_change(participant, previous_name_tokens(participant), set())
+
+
+# where the changes of each savepoint start, e.g. of an operation of POST /batch
+@event.listens_for(db.session, 'after_transaction_create')
+def mark_savepoint(session, transaction):
+    if transaction.nested:
+        session.info.setdefault('search_savepoints', {})[transaction] = len(session.info.get('search_changes', []))
+
+
+# the changes of a rolled back savepoint or transaction are dropped
+@event.listens_for(db.session, 'after_soft_rollback')
+def discard_changes(session, previous_transaction):
+    if previous_transaction.nested:
+        start = session.info.get('search_savepoints', {}).pop(previous_transaction, None)
+        if start is not None:
+            del session.info.get('search_changes', [])[start:]
+    elif previous_transaction.parent is None:
+        session.info.pop('search_changes', None)
+        session.info.pop('search_savepoints', None)
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_changes(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop('search_savepoints', None)
+    changes = session.info.pop('search_changes', None)
+    if changes:
+        update_index(changes)
+
+
+# the ids of the participants with a name starting with the prefix, in the order of the names
+def prefix_ids(prefix):
+    tokens, ids = loaded_index()
+    with _lock:
+        start = bisect_left(tokens, prefix)
+        end = bisect_left(tokens, prefix + LAST_CHARACTER, start)
+        return ids[start:end]
+
+
+# find participants with the prefix index, every word of the query must start one of their names
+# an exact name sorts before the longer names starting with it, so exact matches come first
+def search_prefix_index(q, limit):
+    query_words = sorted(words(q), key=len, reverse=True)
+    # the longest word has the fewest matches, the other words only filter them
+    others = [set(prefix_ids(word)) for word in query_words[1:]]
+    found = []
+    for id in prefix_ids(query_words[0]):
+        if id not in found and all(id in matches for matches in others):
+            found.append(id)
+            if len(found) == limit:
+                break
+    participants = {participant.id: participant for participant in Participant.query.filter(Participant.id.in_(found))}
+    return [participants[id] for id in found if id in participants]
+
+
+# find participants on PostgreSQL, ranked by the names starting with the query first, then by similarity
+def search_postgresql(q, limit):
+    q = q.lower()
+    name = func.lower(Participant.first_name + ' ' + Participant.last_name)
+    first_name = func.lower(Participant.first_name)
+    last_name = func.lower(Participant.last_name)
+    prefix = or_(first_name.startswith(q, autoescape=True), last_name.startswith(q, autoescape=True))
+    query = Participant.query
+    # a trigram is three characters, shorter queries can only be matched as the start of a name
+    if len(q) < 3:
+        return query.filter(prefix).order_by(last_name, first_name, Participant.id).limit(limit).all()
+    return query.filter(or_(name.contains(q, autoescape=True), name.op('%')(q))) \
+        .order_by(prefix.desc(), func.similarity(name, q).desc(), Participant.id).limit(limit).all()
+
+
+# find participants by a part of their name, the best matches first
+def search_participants(q, limit):
+    if is_postgresql():
+        return search_postgresql(q, limit)
+    return search_prefix_index(q, limit)
+
+
+# find registrations by the start of their bib number, optionally in one race, in the order of the bib numbers
+# the bib number is exactly the query first, as it sorts before the longer bib numbers starting with it
+def search_bib_numbers(bib, race_id, limit):
+    bib_number = collate(Registration.bib_number, 'C') if is_postgresql() else Registration.bib_number
+    query = Registration.query.filter(bib_number >= bib, bib_number < bib + LAST_CHARACTER)
+    if race_id is not None:
+        query = query.filter(Registration.race_id == race_id)
+    return query.order_by(bib_number, Registration.race_id).limit(limit)
@@ -0,0 +1,50 @@
+from flask import current_app, jsonify, Response, stream_with_context
+from itertools import islice
+import json
+
+# orjson is much faster than the json module, but it's optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# encode an object into json bytes with the fastest encoder available
+def dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, default=current_app.json.default)
+    return json.dumps(obj, separators=(',', ':'), default=current_app.json.default).encode()
+
+
+# encode rows into the items of a json array, without the brackets
+def dump_items(rows):
+    return dumps(rows)[1:-1]
+
+
+# return the rows of a query as a json list
+# small lists are returned in one piece, lists above STREAMING_THRESHOLD rows are read from a server side cursor
+# and serialized and written out in chunks, so the whole list is never held in memory
+def list_response(query, schema):
+    threshold = current_app.config['STREAMING_THRESHOLD']
+    chunk_size = current_app.config['STREAMING_CHUNK_SIZE']
+    rows = iter(query.yield_per(chunk_size))
+    first_rows = list(islice(rows, threshold + 1))
+    if len(first_rows) <= threshold:
+        return jsonify(schema.dump(first_rows))
+
+    def generate():
+        yield b'['
+        chunk = first_rows
+        separator = b''
+        while chunk:
+            yield separator + dump_items(schema.dump(chunk))
+            separator = b','
+            chunk = list(islice(rows, chunk_size))
+        yield b']'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+
+# encode a server-sent event, the data is encoded once and the same bytes are sent to every client
+def event_frame(event, data):
+    return b'event: ' + event.encode() + b'\ndata: ' + dumps(data) + b'\n\n'
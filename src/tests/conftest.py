@@ -0,0 +1,69 @@
+import os
+import sys
+import tempfile
+from datetime import date, time
+import pytest
+
+# the tests run against a SQLite database in a temporary directory, with the modules of src importable
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'marathon_race.db')
+os.environ.setdefault('SECRET_KEY', 'testing-secret-key-of-at-least-32-bytes')
+os.environ['FLASK_ENV'] = 'testing'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import create_app, db
+from flask_jwt_extended import create_access_token
+from models.participants import Participant
+from models.age_groups import Age_group
+from models.races import Race
+from models.registrations import Registration
+import response_cache
+import search
+
+AGE_GROUPS = [[0, 17], [18, 19], [20, 39], [40, 44], [45, 49], [50, 54], [55, 59], [60, 64], [65, 69], [70, 74], [75, None]]
+
+
+@pytest.fixture(scope='session')
+def app():
+    return create_app()
+
+
+# an empty database with the age groups, an admin, a race and three registrations to it
+@pytest.fixture
+def database(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        for min_age, max_age in AGE_GROUPS:
+            db.session.add(Age_group(min_age=min_age, max_age=max_age))
+        db.session.add(Participant(first_name='Eliud', last_name='Kipchoge', email='admin@example.com', mobile='0412345678',
+                                   password='x', date_of_birth=date(1984, 11, 5), gender='male', admin=True))
+        race = Race(name='Berlin Marathon', distance=42.195, date=date(2022, 9, 25), start_time=time(7), cut_off_time=time(14),
+                    field_limit=100, start_line='Start line', finish_line='Finish line', fee=100)
+        db.session.add(race)
+        db.session.flush()
+        for i in range(3):
+            participant = Participant(first_name='Runner', last_name=f'Number{i}', email=f'runner{i}@example.com', mobile=f'041234560{i}',
+                                      password='x', date_of_birth=date(1990, 1, 1), gender='female', admin=False)
+            db.session.add(participant)
+            db.session.flush()
+            db.session.add(Registration(participant_id=participant.id, race_id=race.id, age_group_id=3,
+                                        registration_date=date(2022, 1, 1), bib_number=f'A{i}'))
+        db.session.commit()
+    # the versions of the tables start again from 0, so the responses cached by the previous tests would match them
+    response_cache._responses.clear()
+    # the search index of the previous database is loaded again by the first search
+    search._index.update(tokens=None, ids=None, loaded_at=0)
+    # each request and each test block opens its own app context, and so its own session
+    return db
+
+
+@pytest.fixture
+def client(app, database):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_headers(app, database):
+    with app.app_context():
+        admin = Participant.query.filter_by(admin=True).one()
+        return {'Authorization': 'Bearer ' + create_access_token(identity=str(admin.id), additional_claims={'admin': True})}
@@ -0,0 +1,95 @@
+from threading import Thread
+from main import db
+from models.results import Result
+from models.age_groups import Age_group
+
+
+def result(registration_id, finish_at='10:00:00'):
+    return {'method': 'POST', 'path': '/results/',
+            'body': {'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': finish_at}}
+
+
+def registration_ids_with_result(app):
+    with app.app_context():
+        return sorted(registration_id for (registration_id,) in db.session.query(Result.registration_id))
+
+
+def test_atomic_batch_is_committed(app, client, admin_headers):
+    response = client.post('/batch/', json={'operations': [result(1), result(2)]}, headers=admin_headers)
+    assert response.status_code == 200
+    assert response.get_json()['committed'] is True
+    assert [operation['status'] for operation in response.get_json()['results']] == [200, 200]
+    assert registration_ids_with_result(app) == [1, 2]
+
+
+def test_atomic_batch_is_rolled_back_when_an_operation_fails(app, client, admin_headers):
+    operations = [result(1), result(2, finish_at='06:00:00'), result(3)]
+    response = client.post('/batch/', json={'operations': operations}, headers=admin_headers)
+    assert response.status_code == 400
+    body = response.get_json()
+    assert body['committed'] is False
+    assert [operation['status'] for operation in body['results']] == [200, 400, None]
+    assert registration_ids_with_result(app) == []
+
+
+def test_best_effort_batch_keeps_the_successful_operations(app, client, admin_headers):
+    operations = [result(1), result(2, finish_at='06:00:00'), result(3)]
+    response = client.post('/batch/', json={'mode': 'best_effort', 'operations': operations}, headers=admin_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['committed'] is True
+    assert body['failed'] == 1
+    assert registration_ids_with_result(app) == [1, 3]
+
+
+# the second result violates the unique registration id, only its savepoint is rolled back
+def test_integrity_error_only_rolls_back_its_operation(app, client, admin_headers):
+    operations = [result(1), result(1), result(2)]
+    response = client.post('/batch/', json={'mode': 'best_effort', 'operations': operations}, headers=admin_headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert [operation['status'] for operation in body['results']] == [200, 400, 200]
+    assert body['results'][1]['error'] == 'Result with same registration id already exists'
+    assert registration_ids_with_result(app) == [1, 2]
+
+
+def test_validation_error_is_returned_as_json(app, client, admin_headers):
+    operation = result(1)
+    operation['body']['unknown'] = 1
+    response = client.post('/batch/', json={'operations': [operation]}, headers=admin_headers)
+    assert response.status_code == 400
+    assert response.get_json()['results'][0] == {'status': 400, 'error': {'unknown': ['Unknown field.']}}
+
+
+# the live leaderboard never ends and closes the session, it must be rejected before it runs
+def test_streamed_routes_are_rejected(app, client, admin_headers):
+    for path in ['/results/stream?race_id=1', '/results/export?race_id=1', '/results/?race_id=1']:
+        responses = []
+        operations = [result(1), {'method': 'GET', 'path': path}]
+        thread = Thread(target=lambda: responses.append(client.post('/batch/', json={'operations': operations}, headers=admin_headers)), daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+        assert not thread.is_alive(), f'{path} has blocked the batch'
+        body = responses[0].get_json()
+        assert body['committed'] is False
+        assert body['results'][1]['status'] == 400
+        assert registration_ids_with_result(app) == []
+
+
+# a rollback by a route inside a batch only undoes the changes of its own operation
+def test_rollback_inside_a_batch_only_undoes_the_current_operation(app, database):
+    with app.app_context():
+        db.session.info['batch_savepoint'] = db.session.begin_nested()
+        db.session.add(Age_group(min_age=100, max_age=101))
+        db.session.commit()
+        db.session.info['batch_savepoint'].commit()
+
+        db.session.info['batch_savepoint'] = db.session.begin_nested()
+        db.session.add(Age_group(min_age=102, max_age=103))
+        db.session.flush()
+        db.session.rollback()
+        assert db.session().in_nested_transaction()
+        db.session.info.pop('batch_savepoint').commit()
+
+        db.session.commit()
+        assert sorted(group.min_age for group in Age_group.query.filter(Age_group.min_age >= 100)) == [100]
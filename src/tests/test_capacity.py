@@ -0,0 +1,91 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, time
+from threading import Barrier
+from main import db
+from models.participants import Participant
+from models.races import Race
+from models.registrations import Registration
+from models.race_capacities import RaceCapacity
+
+
+def add_race(app, field_limit):
+    with app.app_context():
+        race = Race(name=f'Race of {field_limit}', distance=42.195, date=date(2022, 10, 9), start_time=time(7), cut_off_time=time(14),
+                    field_limit=field_limit, start_line='Start line', finish_line='Finish line', fee=100)
+        db.session.add(race)
+        db.session.commit()
+        return race.id
+
+
+def add_participants(app, count):
+    with app.app_context():
+        participants = [Participant(first_name='Surge', last_name=f'Runner{i}', email=f'surge{i}@example.com', mobile=f'04888888{i:02d}',
+                                    password='x', date_of_birth=date(1990, 1, 1), gender='female', admin=False) for i in range(count)]
+        db.session.add_all(participants)
+        db.session.commit()
+        return [participant.id for participant in participants]
+
+
+def register(client, admin_headers, participant_id, race_id, bib_number):
+    return client.post('/registrations/', headers=admin_headers, json={
+        'participant_id': participant_id, 'race_id': race_id, 'registration_date': '2022-06-01', 'bib_number': bib_number})
+
+
+def registration_of(app, participant_id):
+    with app.app_context():
+        return db.session.query(Registration.id).filter(Registration.participant_id == participant_id).scalar()
+
+
+def places(app, race_id):
+    with app.app_context():
+        stored = db.session.query(Registration).filter(Registration.race_id == race_id).count()
+        return stored, db.session.get(RaceCapacity, race_id).taken
+
+
+# all registrations are sent at the same moment, the race is filled exactly and the others are told it's full
+def test_concurrent_registrations_do_not_overbook_the_race(app, admin_headers):
+    race_id = add_race(app, 5)
+    participant_ids = add_participants(app, 20)
+    barrier = Barrier(len(participant_ids))
+
+    def register_at_once(i):
+        barrier.wait()
+        response = register(app.test_client(), admin_headers, participant_ids[i], race_id, f'S{i}')
+        return response.status_code, response.get_data(as_text=True)
+
+    with ThreadPoolExecutor(max_workers=len(participant_ids)) as executor:
+        responses = list(executor.map(register_at_once, range(len(participant_ids))))
+    statuses = sorted(status for status, body in responses)
+    assert statuses == [200] * 5 + [400] * 15
+    assert all('The race is full' in body for status, body in responses if status == 400)
+    assert places(app, race_id) == (5, 5)
+
+
+def test_deleted_registration_gives_its_place_back(app, client, admin_headers):
+    race_id = add_race(app, 1)
+    first, second = add_participants(app, 2)
+    registration_id = register(client, admin_headers, first, race_id, 'S1').get_json()['registration']['id']
+    assert 'The race is full' in register(client, admin_headers, second, race_id, 'S2').get_data(as_text=True)
+    assert client.delete(f'/registrations/{registration_id}', headers=admin_headers).status_code == 200
+    assert places(app, race_id) == (0, 0)
+    assert register(client, admin_headers, second, race_id, 'S2').status_code == 200
+    assert places(app, race_id) == (1, 1)
+
+
+def test_moved_registration_takes_a_place_and_gives_the_previous_one_back(app, client, admin_headers):
+    race_id = add_race(app, 1)
+    full_race_id = add_race(app, 2)
+    first, second = add_participants(app, 2)
+    for participant_id, bib_number in [(first, 'F1'), (second, 'F2')]:
+        assert register(client, admin_headers, participant_id, full_race_id, bib_number).status_code == 200
+
+    assert client.put(f'/registrations/{registration_of(app, first)}', json={'race_id': race_id}, headers=admin_headers).status_code == 200
+    assert places(app, race_id) == (1, 1)
+    assert places(app, full_race_id) == (1, 1)
+
+    # the race is full now, the registration stays where it is
+    response = client.put(f'/registrations/{registration_of(app, second)}', json={'race_id': race_id}, headers=admin_headers)
+    assert response.status_code == 400
+    assert 'The race is full' in response.get_data(as_text=True)
+    assert places(app, race_id) == (1, 1)
+    assert places(app, full_race_id) == (1, 1)
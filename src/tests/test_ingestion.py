@@ -0,0 +1,129 @@
+import fcntl
+import json
+import os
+import time
+import pytest
+from sqlalchemy import exc, insert
+from main import db
+from models.results import Result
+from timing import time_to_ms, seconds_to_time
+import controllers.results_controller
+import ingestion
+
+
+def result(registration_id, finish_at='10:00:00'):
+    return {'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': finish_at}
+
+
+# queue the results in a journal directory of the test, as a freshly started process would
+# the worker threads of the previous tests stay blocked on their own queues
+@pytest.fixture
+def journal_dir(app, database, tmp_path):
+    config = {key: app.config[key] for key in ['RESULT_INGESTION', 'INGESTION_JOURNAL_DIR', 'INGESTION_FLUSH_MS']}
+    app.config.update(RESULT_INGESTION='queue', INGESTION_JOURNAL_DIR=str(tmp_path), INGESTION_FLUSH_MS=10)
+    ingestion._state['pid'] = None
+    yield tmp_path
+    for name in ['journal', 'lock_file']:
+        if ingestion._state[name] is not None:
+            ingestion._state[name].close()
+    ingestion._state.update(pid=None, queue=None, path=None, journal=None, lock_file=None)
+    app.config.update(config)
+
+
+def wait_for(client, admin_headers, ticket):
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        body = client.get(f'/results/tickets/{ticket}', headers=admin_headers).get_json()
+        if body['status'] != 'queued':
+            return body
+        time.sleep(0.02)
+    raise AssertionError(f'{ticket} is still queued')
+
+
+def time_of(value):
+    return seconds_to_time(time_to_ms(value) // 1000)
+
+
+def registration_ids_with_result(app):
+    with app.app_context():
+        return sorted(registration_id for (registration_id,) in db.session.query(Result.registration_id))
+
+
+def test_queued_results_are_applied_or_rejected(app, client, admin_headers, journal_dir):
+    tickets = []
+    for registration_id in [1, 1, 99]:
+        response = client.post('/results/', json=result(registration_id), headers=admin_headers)
+        assert response.status_code == 202
+        assert response.headers['Location'] == f'/results/tickets/{response.get_json()["ticket"]}'
+        tickets.append(response.get_json()['ticket'])
+    statuses = [wait_for(client, admin_headers, ticket) for ticket in tickets]
+    assert [(body['status'], body['error']) for body in statuses] == [
+        ('applied', None),
+        ('rejected', 'Result with same registration id already exists'),
+        ('rejected', 'Registration not found')
+    ]
+    assert registration_ids_with_result(app) == [1]
+    assert client.get('/results/tickets/unknown', headers=admin_headers).status_code == 404
+
+
+# the results queued by a process which crashed before writing them are written by the next process
+def test_journal_of_a_crashed_process_is_replayed(app, client, admin_headers, journal_dir):
+    records = [
+        {'ticket': 'applied-before-the-crash', 'input': result(1), 'at': time.time()},
+        {'ticket': 'applied-before-the-crash', 'status': 'applied', 'error': None, 'at': time.time()},
+        {'ticket': 'queued-before-the-crash', 'input': result(2), 'at': time.time()},
+    ]
+    with open(journal_dir / 'results-0.jsonl', 'w') as journal:
+        journal.write(''.join(json.dumps(record) + '\n' for record in records))
+        # the crash cut the last line
+        journal.write('{"ticket": "cut-by-the-cr')
+
+    ingestion.start(app)
+    assert wait_for(client, admin_headers, 'queued-before-the-crash')['status'] == 'applied'
+    assert client.get('/results/tickets/applied-before-the-crash', headers=admin_headers).get_json()['status'] == 'applied'
+    assert registration_ids_with_result(app) == [2]
+
+
+# each process holds the lock of its own journal, the journal of a live process is never claimed by another one
+def test_journal_of_a_live_process_is_not_claimed(journal_dir):
+    with open(journal_dir / 'results-0.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        path, claimed = ingestion._claim_journal(str(journal_dir))
+        assert os.path.basename(path) == 'results-1.jsonl'
+        claimed.close()
+    # the process has exited, its journal can be claimed and replayed
+    path, claimed = ingestion._claim_journal(str(journal_dir))
+    assert os.path.basename(path) == 'results-0.jsonl'
+    claimed.close()
+
+
+# the tickets of another process are found in its journal
+def test_tickets_of_other_processes_are_found_in_their_journal(client, admin_headers, journal_dir):
+    with open(journal_dir / 'results-3.jsonl', 'w') as journal:
+        journal.write(json.dumps({'ticket': 'other-process', 'status': 'rejected', 'error': 'Registration not found', 'at': time.time()}) + '\n')
+    body = client.get('/results/tickets/other-process', headers=admin_headers).get_json()
+    assert (body['status'], body['error']) == ('rejected', 'Registration not found')
+
+
+# another request adds a result for one of the registrations of the batch just before it's written,
+# so the batch fails as a whole and its results are written one by one to reject only that one
+def test_batch_is_written_one_by_one_after_an_integrity_error(app, database, monkeypatch):
+    insert_results = controllers.results_controller.insert_results
+    calls = []
+
+    def insert_results_meanwhile(rows):
+        calls.append([key for key, input in rows])
+        if len(calls) == 1:
+            with db.engine.begin() as connection:
+                connection.execute(insert(Result).values(registration_id=2, finished=True, start_at=time_of('07:00:00'), finish_at=time_of('09:00:00'),
+                                                         **controllers.results_controller.calculate_timing('07:00:00', '09:00:00', 42.195)))
+            raise exc.IntegrityError('INSERT INTO results', {}, Exception('duplicate key value violates unique constraint'))
+        return insert_results(rows)
+
+    monkeypatch.setattr(controllers.results_controller, 'insert_results', insert_results_meanwhile)
+    batch = [(f'ticket-{registration_id}', result(registration_id)) for registration_id in [1, 2, 3]]
+    with app.app_context():
+        errors = ingestion._apply(batch)
+    assert calls == [['ticket-1', 'ticket-2', 'ticket-3'], ['ticket-1'], ['ticket-2'], ['ticket-3']]
+    assert errors == {'ticket-2': 'Result with same registration id already exists'}
+    assert registration_ids_with_result(app) == [1, 2, 3]
@@ -0,0 +1,94 @@
+from datetime import date
+from main import db
+from models.leaderboard import Leaderboard
+from models.participants import Participant
+from models.results import Result
+import leaderboard
+
+
+def result(registration_id, finish_at='10:00:00'):
+    return {'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': finish_at}
+
+
+def assert_in_sync(app):
+    with app.app_context():
+        assert leaderboard.check() == {'missing': [], 'stale': []}
+
+
+def leaderboard_rows(app):
+    with app.app_context():
+        return sorted(tuple(row) for row in db.session.execute(db.select(Leaderboard.result_id, Leaderboard.age_group_id, Leaderboard.gender)))
+
+
+def add_results(client, admin_headers, *registration_ids):
+    for registration_id in registration_ids:
+        assert client.post('/results/', json=result(registration_id), headers=admin_headers).status_code == 200
+
+
+def test_added_results_are_in_the_leaderboard(app, client, admin_headers):
+    add_results(client, admin_headers, 1)
+    rows = '\n'.join(['registration_id,finished,start_at,finish_at', '2,true,07:00:00,11:00:00', '3,true,07:00:00,12:00:00'])
+    response = client.post('/results/bulk', data=rows, headers={**admin_headers, 'Content-Type': 'text/csv'})
+    assert response.get_json()['added'] == 2
+    assert len(leaderboard_rows(app)) == 3
+    assert_in_sync(app)
+
+
+def test_updated_result_is_refreshed(app, client, admin_headers):
+    add_results(client, admin_headers, 1, 2)
+    with app.app_context():
+        result_id, pace_ms = db.session.execute(db.select(Result.id, Result.pace_ms).where(Result.registration_id == 1)).one()
+    assert client.put(f'/results/{result_id}', json={'finish_at': '09:00:00'}, headers=admin_headers).status_code == 200
+    with app.app_context():
+        assert db.session.get(Leaderboard, result_id).pace_ms < pace_ms
+    assert_in_sync(app)
+
+
+def test_deleted_result_is_removed(app, client, admin_headers):
+    add_results(client, admin_headers, 1, 2)
+    with app.app_context():
+        result_id = db.session.execute(db.select(Result.id).where(Result.registration_id == 1)).scalar()
+    assert client.delete(f'/results/{result_id}', headers=admin_headers).status_code == 200
+    assert result_id not in [row[0] for row in leaderboard_rows(app)]
+    assert len(leaderboard_rows(app)) == 1
+    assert_in_sync(app)
+
+
+def test_changed_gender_is_refreshed(app, client, admin_headers):
+    add_results(client, admin_headers, 1, 2)
+    with app.app_context():
+        participant_id = db.session.execute(db.select(Participant.id).where(Participant.email == 'runner0@example.com')).scalar()
+    assert client.put(f'/participants/{participant_id}', json={'gender': 'male'}, headers=admin_headers).status_code == 200
+    assert sorted(gender for result_id, age_group_id, gender in leaderboard_rows(app)) == ['female', 'male']
+    assert_in_sync(app)
+
+
+# another participant, in another age group, takes over the registration
+def test_changed_participant_and_age_group_are_refreshed(app, client, admin_headers):
+    add_results(client, admin_headers, 1)
+    with app.app_context():
+        veteran = Participant(first_name='Veteran', last_name='Runner', email='veteran@example.com', mobile='0412345699',
+                              password='x', date_of_birth=date(1960, 1, 1), gender='male', admin=False)
+        db.session.add(veteran)
+        db.session.commit()
+        veteran_id = veteran.id
+    assert client.put('/registrations/1', json={'participant_id': veteran_id}, headers=admin_headers).status_code == 200
+    [(result_id, age_group_id, gender)] = leaderboard_rows(app)
+    assert (age_group_id, gender) == (8, 'male')
+    assert_in_sync(app)
+
+
+def test_check_finds_drift_and_rebuild_repairs_it(app, client, admin_headers):
+    add_results(client, admin_headers, 1, 2, 3)
+    with app.app_context():
+        entries = db.session.execute(db.select(Leaderboard).order_by(Leaderboard.result_id)).scalars().all()
+        removed, changed = entries[0].result_id, entries[1].result_id
+        db.session.delete(entries[0])
+        entries[1].pace_ms += 1
+        db.session.commit()
+        drift = leaderboard.check()
+        assert [entry[0] for entry in drift['missing']] == [removed, changed]
+        assert [entry[0] for entry in drift['stale']] == [changed]
+        leaderboard.rebuild()
+        db.session.commit()
+    assert_in_sync(app)
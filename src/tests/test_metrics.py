@@ -0,0 +1,32 @@
+import metrics
+
+
+def rows_counted(blueprint):
+    return metrics._histograms.get(('http_request_rows', blueprint), [None, 0, 0])[1]
+
+
+def test_metrics_are_admin_only(app, client, admin_headers):
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers=admin_headers).status_code == 200
+
+
+def test_metrics_can_be_public(app, client):
+    app.config['METRICS_PUBLIC'] = True
+    try:
+        assert client.get('/metrics').status_code == 200
+    finally:
+        app.config['METRICS_PUBLIC'] = False
+
+
+# SQLite doesn't know how many rows a select returns, the rows are counted as they are loaded
+def test_rows_loaded_are_counted(client, admin_headers):
+    before = rows_counted('registrations')
+    assert len(client.get('/registrations/', headers=admin_headers).get_json()) == 3
+    assert rows_counted('registrations') - before >= 3
+
+    for registration_id in [1, 2]:
+        client.post('/results/', json={'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': '10:00:00'},
+                    headers=admin_headers)
+    before = rows_counted('results')
+    client.get('/results/?race_id=1').get_data()
+    assert rows_counted('results') - before >= 2
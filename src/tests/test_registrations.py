@@ -0,0 +1,57 @@
+from datetime import date
+from main import db
+from models.participants import Participant
+from models.registrations import Registration
+
+
+def add_participants(app, count):
+    with app.app_context():
+        participants = [Participant(first_name='New', last_name=f'Runner{i}', email=f'new{i}@example.com', mobile=f'04999999{i:02d}',
+                                    password='x', date_of_birth=date(1970, 1, 1), gender='male', admin=False) for i in range(count)]
+        db.session.add_all(participants)
+        db.session.commit()
+        return [participant.id for participant in participants]
+
+
+def add_in_bulk(client, admin_headers, query, *rows):
+    body = '\n'.join(['participant_id,race_id,registration_date,bib_number', *rows])
+    response = client.post(f'/registrations/bulk{query}', data=body, headers={**admin_headers, 'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def bib_numbers(app):
+    with app.app_context():
+        return dict(db.session.query(Registration.participant_id, Registration.bib_number))
+
+
+# the bibs are allocated after the highest one of the race, including the ones passed in the same batch
+def test_bibs_are_allocated_after_the_highest_one(app, client, admin_headers):
+    first, second, third = add_participants(app, 3)
+    body = add_in_bulk(client, admin_headers, '?assign_bibs=true&bib_prefix=A',
+                       f'{first},1,2022-01-01,', f'{second},1,2022-01-01,A7', f'{third},1,2022-01-01,')
+    assert body['added'] == 3
+    assert body['errors'] == []
+    bibs = bib_numbers(app)
+    assert [bibs[first], bibs[second], bibs[third]] == ['A8', 'A7', 'A9']
+
+
+def test_rejected_rows_are_reported_and_the_others_added(app, client, admin_headers):
+    first, second = add_participants(app, 2)
+    with app.app_context():
+        registered = db.session.query(Registration.participant_id).filter(Registration.bib_number == 'A0').scalar()
+    body = add_in_bulk(client, admin_headers, '',
+                       f'{first},1,2022-01-01,B1', f'{registered},1,2022-01-01,B2', f'{second},1,2022-01-01,A1',
+                       f'{second},99,2022-01-01,B3', '999,1,2022-01-01,B4', f'{second},1,2022-01-01,')
+    assert body['added'] == 1
+    assert body['errors'] == [
+        {'row': 2, 'error': 'Participant already registered this race'},
+        {'row': 3, 'error': 'Bib number already exists under this race'},
+        {'row': 4, 'error': 'Race not found'},
+        {'row': 5, 'error': 'Participant not found'},
+        {'row': 6, 'error': 'Please provide bib_number'}
+    ]
+    assert bib_numbers(app)[first] == 'B1'
+    # the age group is assigned from the age on the race date
+    with app.app_context():
+        assert db.session.query(Registration.age_group_id).filter(Registration.participant_id == first).scalar() == 6
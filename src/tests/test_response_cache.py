@@ -0,0 +1,31 @@
+from main import db
+from models.races import Race
+import response_cache
+
+
+def rename_race(app, name):
+    with app.app_context():
+        db.session.get(Race, 1).name = name
+        db.session.commit()
+
+
+# another worker has its own cached responses, but the etags are built from the versions stored in the database
+def test_etag_is_the_same_in_every_worker(client):
+    etag = client.get('/races/').headers['ETag']
+    response_cache._responses.clear()
+    response = client.get('/races/', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+
+
+# a write handled by another worker bumps the shared versions, so this worker doesn't serve its cached response
+def test_write_in_another_worker_refreshes_the_cache(app, client):
+    first = client.get('/races/')
+    rename_race(app, 'Tokyo Marathon')
+    # the response cached before the change is still served until the tables are bumped
+    assert client.get('/races/').get_json()[0]['name'] == 'Berlin Marathon'
+    with app.app_context():
+        response_cache.bump('races')
+    response = client.get('/races/', headers={'If-None-Match': first.headers['ETag']})
+    assert response.status_code == 200
+    assert response.get_json()[0]['name'] == 'Tokyo Marathon'
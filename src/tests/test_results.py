@@ -0,0 +1,16 @@
+def result(registration_id, finish_at='10:00:00'):
+    return {'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': finish_at}
+
+
+def test_timing_is_calculated_and_cannot_be_passed_in(client, admin_headers):
+    response = client.post('/results/', json={**result(1), 'pace_ms': 1}, headers=admin_headers)
+    assert response.status_code == 400
+    response = client.post('/results/', json={**result(1), 'finish_ms': 1}, headers=admin_headers)
+    assert response.status_code == 400
+
+    response = client.post('/results/', json=result(1), headers=admin_headers)
+    assert response.status_code == 200
+    added = response.get_json()['result']
+    assert added['finish_ms'] == 3 * 60 * 60 * 1000
+    distance = float(client.get('/races/1').get_json()['distance'])
+    assert added['pace_ms'] == round(3 * 60 * 60 * 1000 / distance)
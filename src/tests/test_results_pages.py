@@ -0,0 +1,68 @@
+from datetime import date
+from main import db
+from models.participants import Participant
+from models.registrations import Registration
+
+# the finish times of the results, some of them tied on pace
+FINISH_TIMES = ['10:00:00', '09:00:00', '10:00:00', '11:00:00', '09:30:00', '10:00:00', '12:00:00']
+
+
+def add_runners(app, count):
+    with app.app_context():
+        for i in range(3, count):
+            participant = Participant(first_name='Runner', last_name=f'Number{i}', email=f'runner{i}@example.com', mobile=f'04123456{i:02d}',
+                                      password='x', date_of_birth=date(1990, 1, 1), gender='female', admin=False)
+            db.session.add(participant)
+            db.session.flush()
+            db.session.add(Registration(participant_id=participant.id, race_id=1, age_group_id=3,
+                                        registration_date=date(2022, 1, 1), bib_number=f'A{i}'))
+        db.session.commit()
+
+
+def add_results(client, admin_headers, finish_times, first_registration_id=1):
+    for registration_id, finish_at in enumerate(finish_times, start=first_registration_id):
+        response = client.post('/results/', json={'registration_id': registration_id, 'finished': True, 'start_at': '07:00:00', 'finish_at': finish_at},
+                               headers=admin_headers)
+        assert response.status_code == 200
+
+
+def read_pages(client, limit):
+    pages = []
+    next_token = None
+    while True:
+        query = f'/results/?race_id=1&limit={limit}' + (f'&next={next_token}' if next_token else '')
+        body = client.get(query).get_json()
+        pages.append(body['results'])
+        next_token = body['next']
+        if next_token is None:
+            return pages
+
+
+def test_pages_continue_where_the_previous_page_ended(app, client, admin_headers):
+    add_runners(app, len(FINISH_TIMES))
+    add_results(client, admin_headers, FINISH_TIMES)
+    everything = client.get('/results/?race_id=1').get_json()['results']
+    # SQLite returns the times with microseconds
+    assert [entry['finish_at'][:8] for entry in everything] == sorted(FINISH_TIMES)
+
+    pages = read_pages(client, 2)
+    assert [len(page) for page in pages] == [2, 2, 2, 1]
+    assert [entry for page in pages for entry in page] == everything
+    assert [entry['place'] for page in pages for entry in page] == list(range(1, len(FINISH_TIMES) + 1))
+
+
+# a result added ahead of the cursor doesn't repeat the rows already returned
+def test_rows_added_between_pages_are_not_repeated(app, client, admin_headers):
+    add_runners(app, 4)
+    add_results(client, admin_headers, FINISH_TIMES[:3])
+    first = client.get('/results/?race_id=1&limit=2').get_json()
+    add_results(client, admin_headers, ['08:00:00'], first_registration_id=4)
+    second = client.get(f'/results/?race_id=1&limit=2&next={first["next"]}').get_json()
+    returned = [entry['finish_at'][:8] for entry in first['results'] + second['results']]
+    assert returned == ['09:00:00', '10:00:00', '10:00:00']
+    assert second['next'] is None
+
+
+def test_invalid_next_token_is_rejected(client):
+    response = client.get('/results/?race_id=1&limit=2&next=not-a-token')
+    assert response.status_code == 400
@@ -0,0 +1,71 @@
+from datetime import date
+from main import db
+from models.participants import Participant
+
+
+def add_participant(app, first_name, last_name):
+    with app.app_context():
+        participant = Participant(first_name=first_name, last_name=last_name, email=f'{first_name}.{last_name}@example.com'.lower(),
+                                  mobile=f'04{abs(hash(first_name + last_name)) % 10 ** 8:08d}', password='x',
+                                  date_of_birth=date(1990, 1, 1), gender='female', admin=False)
+        db.session.add(participant)
+        db.session.commit()
+        return participant.id
+
+
+def names(client, admin_headers, q, limit=''):
+    response = client.get(f'/participants/search?q={q}{limit}', headers=admin_headers)
+    assert response.status_code == 200
+    return [f'{participant["first_name"]} {participant["last_name"]}' for participant in response.get_json()]
+
+
+def bib_numbers(client, admin_headers, query):
+    response = client.get(f'/registrations/search?{query}', headers=admin_headers)
+    assert response.status_code == 200
+    return [registration['bib_number'] for registration in response.get_json()]
+
+
+# every word of the query starts one of the names, an exact name comes before the longer names starting with it
+def test_participants_are_found_by_the_start_of_their_names(app, client, admin_headers):
+    add_participant(app, 'Anna', 'Smithers')
+    add_participant(app, 'Ann', 'Smith')
+    assert names(client, admin_headers, 'ANN') == ['Ann Smith', 'Anna Smithers']
+    assert names(client, admin_headers, 'smithers an') == ['Anna Smithers']
+    assert names(client, admin_headers, 'run num', '&limit=2') == ['Runner Number0', 'Runner Number1']
+    assert names(client, admin_headers, 'nobody') == []
+    assert client.get('/participants/search?q=%20', headers=admin_headers).status_code == 400
+    assert client.get('/participants/search?q=ann&limit=0', headers=admin_headers).status_code == 400
+
+
+# the index already loaded is changed once the transaction is committed, and not by a rolled back one
+def test_index_follows_the_committed_changes(app, client, admin_headers):
+    assert names(client, admin_headers, 'kipchoge') == ['Eliud Kipchoge']
+    participant_id = add_participant(app, 'Brigid', 'Kosgei')
+    assert names(client, admin_headers, 'kosgei') == ['Brigid Kosgei']
+
+    with app.app_context():
+        db.session.get(Participant, participant_id).last_name = 'Jepchirchir'
+        db.session.commit()
+    assert names(client, admin_headers, 'kosgei') == []
+    assert names(client, admin_headers, 'brigid jep') == ['Brigid Jepchirchir']
+
+    with app.app_context():
+        db.session.get(Participant, participant_id).first_name = 'Peres'
+        db.session.flush()
+        db.session.rollback()
+    assert names(client, admin_headers, 'peres') == []
+    assert names(client, admin_headers, 'brigid') == ['Brigid Jepchirchir']
+
+    with app.app_context():
+        db.session.delete(db.session.get(Participant, participant_id))
+        db.session.commit()
+    assert names(client, admin_headers, 'brigid') == []
+
+
+def test_registrations_are_found_by_the_start_of_their_bib_number(app, client, admin_headers):
+    assert bib_numbers(client, admin_headers, 'bib=A') == ['A0', 'A1', 'A2']
+    assert bib_numbers(client, admin_headers, 'bib=A1') == ['A1']
+    assert bib_numbers(client, admin_headers, 'bib=A&limit=2') == ['A0', 'A1']
+    assert bib_numbers(client, admin_headers, 'bib=A&race_id=99') == []
+    assert bib_numbers(client, admin_headers, 'bib=B') == []
+    assert client.get('/registrations/search?bib=', headers=admin_headers).status_code == 400
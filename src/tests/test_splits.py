@@ -0,0 +1,44 @@
+from timing import format_ms
+
+
+def record_splits(client, admin_headers, *rows):
+    body = '\n'.join(['bib_number,distance,elapsed', *rows])
+    response = client.post('/splits/bulk?race_id=1', data=body, headers={**admin_headers, 'Content-Type': 'text/csv'})
+    assert response.status_code == 200
+    return response.get_json()
+
+
+def ranking(client, query):
+    body = client.get(f'/splits/?race_id=1&distance=10{query}').get_json()
+    return [(split['place'], split['bib_number'], split['elapsed']) for split in body['splits']], body['next']
+
+
+def test_rows_with_errors_are_reported_and_the_others_recorded(client, admin_headers):
+    body = record_splits(client, admin_headers, 'A0,10,00:50:00', 'B9,10,00:50:00', 'A1,50,02:00:00', 'A2,10,00:00:00')
+    assert body['recorded'] == 1
+    assert body['errors'] == [
+        {'row': 2, 'error': 'Bib number not found under this race'},
+        {'row': 3, 'error': 'Distance must be between 0 and the race distance'},
+        {'row': 4, 'error': 'Elapsed time must be larger than 0'}
+    ]
+
+
+# ties on elapsed time are ranked by registration, and a split sent again replaces the first one
+def test_checkpoint_ranking_is_paged_in_elapsed_order(client, admin_headers):
+    record_splits(client, admin_headers, 'A2,10,00:50:00', 'A1,10,00:45:00', 'A0,10,00:50:00', 'A0,5,00:20:00')
+    record_splits(client, admin_headers, 'A1,10,00:52:00')
+    first, next_token = ranking(client, '&limit=2')
+    assert [(place, bib) for place, bib, elapsed in first] == [(1, 'A0'), (2, 'A2')]
+    second, next_token = ranking(client, f'&limit=2&next={next_token}')
+    assert [(place, bib) for place, bib, elapsed in second] == [(3, 'A1')]
+    assert next_token is None
+    assert second[0][2] == '00:52:00.000'
+
+
+def test_finish_is_projected_from_the_latest_split(client, admin_headers):
+    record_splits(client, admin_headers, 'A0,5,00:20:00', 'A0,10,00:50:00')
+    body = client.get('/splits/registrations/1').get_json()
+    assert [split['distance'] for split in body['splits']] == [5, 10]
+    distance_m = round(float(client.get('/races/1').get_json()['distance']) * 1000)
+    projected_ms = round(50 * 60 * 1000 * (distance_m / 10000) ** 1.06)
+    assert body['projected_finish'] == format_ms(projected_ms)
@@ -0,0 +1,11 @@
+import os
+from statistics import median
+from benchmarks import time_startup, STARTUP_BUDGET_MS
+
+
+# a new worker or cli command imports the app and creates it within the budget, without the libraries loaded on first use
+def test_startup_is_within_the_budget():
+    env = {key: value for key, value in os.environ.items() if key != 'WARM_UP'}
+    times, loaded = time_startup(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 3, env)
+    assert loaded == []
+    assert median(times) <= STARTUP_BUDGET_MS, f'Startup took {median(times):.0f}ms'
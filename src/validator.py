@@ -1,12 +1,39 @@
-from flask import abort, request
+from flask import abort, request, g
+from werkzeug.exceptions import HTTPException
 from marshmallow.exceptions import ValidationError
-from email_validator import validate_email, EmailNotValidError
-from phonenumbers import parse, is_valid_number
-from password_strength import PasswordPolicy
 from datetime import datetime
 from functools import wraps
-from flask_jwt_extended import jwt_required, get_jwt_identity
+import csv
+import io
+import json
+import math
+from flask_jwt_extended import jwt_required, get_jwt_identity, get_jwt
 from models.participants import Participant
+import identity_cache
+
+# email_validator, phonenumbers and password_strength are slow to import, and only needed by the routes taking
+# an email, mobile or password, so they are imported on first use instead of when the app starts
+# the password policy is built once and shared by all requests
+_password_policy = {}
+
+
+def password_policy():
+    if 'policy' not in _password_policy:
+        from password_strength import PasswordPolicy
+        _password_policy['policy'] = PasswordPolicy.from_names(
+            length=8,  # minimum length 8
+            uppercase=1,  # minimum 1 uppercase letter
+        )
+    return _password_policy['policy']
+
+
+# import the validation libraries and build the password policy, used to warm up a worker before it gets traffic
+def preload():
+    import email_validator
+    import phonenumbers
+    password_policy()
+    # phonenumbers loads the metadata of a region the first time it parses a number of that region
+    phonenumbers.parse('0412345678', 'AU')
 
 class Validator():
 
@@ -16,9 +43,11 @@ class Validator():
     # def a function to validate number
     def validate_number(self, field, min, max=None):
         try:
-            if (min is not None and float(self.data[field]) < min) or (max is not None and float(self.data[field]) > max):
+            number = float(self.data[field])
+            # nan and infinity pass every comparison below, so they are rejected first
+            if not math.isfinite(number) or (min is not None and number < min) or (max is not None and number > max):
                 return abort(400, description=f'Please enter a valid number for {field} between [{min}, {max}]')
-        except ValueError:
+        except (ValueError, TypeError):
             return abort(400, description=f'Please enter a valid number for {field} between [{min}, {max}]')
 
     # def a function to validate date or time input
@@ -42,6 +71,7 @@ class Validator():
 
     # validate email
     def validate_emails(self):
+        from email_validator import validate_email, EmailNotValidError
         try:
             email = validate_email(self.data['email'])
         except EmailNotValidError:
@@ -49,6 +79,7 @@ class Validator():
 
     # validate mobile number
     def validate_mobile(self):
+        from phonenumbers import parse, is_valid_number
         mobile = self.data['mobile']
         err_msg = 'Please enter a valid Australia mobile number starting with 04'
         if mobile[0:2] != '04':
@@ -62,11 +93,7 @@ class Validator():
 
     # validate password
     def validate_password(self):
-        password_policy = PasswordPolicy.from_names(
-            length=8,  # minimum length 8
-            uppercase=1,  # minimum 1 uppercase letter
-        )
-        if password_policy.test(self.data['password']):
+        if password_policy().test(self.data['password']):
             return abort(400, description='The password must be at least 8 letters long and have at least 1 uppercase letter')
 
     # validate gender format
@@ -74,15 +101,63 @@ class Validator():
         if self.data['gender'].lower() not in ['male', 'female']:
             return abort(400, description='Please select male or female for gender')
 
+    # validate a duration in the format of H:M:S, seconds can have decimals and hours can go past 24
+    def validate_duration(self, field):
+        try:
+            hours, minutes, seconds = str(self.data[field]).split(':')
+            if int(hours) < 0 or not 0 <= int(minutes) < 60 or not 0 <= float(seconds) < 60:
+                raise ValueError
+        except ValueError:
+            return abort(400, description=f'Please enter a valid duration for {field} in the format of %H:%M:%S')
+
     # validate boolean format (should be either True or False)
     def validate_boolean(self, field):
         if not isinstance(self.data[field], bool):
             return abort(400, description=f'Please select True or False for {field}')
         
 
+# the format check of each field
+FIELD_CHECKS = {}
+for field in ['name', 'start_line', 'finish_line', 'bib_number']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_string(field)
+for field in ['first_name', 'last_name']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_name(field)
+FIELD_CHECKS['email'] = lambda validator, field: validator.validate_emails()
+FIELD_CHECKS['mobile'] = lambda validator, field: validator.validate_mobile()
+FIELD_CHECKS['password'] = lambda validator, field: validator.validate_password()
+for field in ['date_of_birth', 'date', 'registration_date']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_datetime(field, '%Y-%m-%d')
+FIELD_CHECKS['gender'] = lambda validator, field: validator.validate_gender()
+for field in ['admin', 'finished']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_boolean(field)
+for field in ['distance', 'fee', 'field_limit', 'participant_id', 'race_id', 'registration_id']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_number(field, 0)
+for field in ['start_time', 'end_time', 'start_at', 'finish_at']:
+    FIELD_CHECKS[field] = lambda validator, field: validator.validate_datetime(field, '%H:%M:%S')
+FIELD_CHECKS['elapsed'] = lambda validator, field: validator.validate_duration(field)
+
+# the validation plan of each schema, compiled once when the routes are defined
+_plans = {}
+
+# compile the validation plan of a schema: the format check of each field the schema accepts
+def compile_plan(schema):
+    if schema not in _plans:
+        _plans[schema] = {field: FIELD_CHECKS[field] for field in schema.fields if field in FIELD_CHECKS}
+    return _plans[schema]
+
+# run the format checks on every field the user has input
+def validate_fields(input_fields, plan=FIELD_CHECKS):
+    validator = Validator(input_fields)
+    for field in input_fields:
+        check = plan.get(field)
+        if check:
+            check(validator, field)
+
+
 # define a decorator to validate format of user details, such as name and email format
 # also to valid if the user has input enough information
 def validate_input(schema, required_fields=[]):
+    plan = compile_plan(schema)
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
@@ -100,42 +175,102 @@ def validate_input(schema, required_fields=[]):
             if missing_fields:
                 return abort(400, description=f'Please provide {", ".join(field for field in missing_fields)}')
 
-            validator = Validator(input_fields)
-            for field in input_fields:
-                match field:
-                    case 'name'|'start_line'|'finish_line'|'bib_number':
-                        validator.validate_string(field)
-                    case 'first_name'|'last_name':
-                        validator.validate_name(field)
-                    case 'email':
-                        validator.validate_emails()
-                    case 'mobile':
-                        validator.validate_mobile()
-                    case 'password':
-                        validator.validate_password()
-                    case 'date_of_birth'|'date'|'registration_date':
-                        validator.validate_datetime(field, '%Y-%m-%d')
-                    case 'gender':
-                        validator.validate_gender()
-                    case 'admin'|'finished':
-                        validator.validate_boolean(field)
-                    case 'distance'|'fee'|'field_limit'|'participant_id'|'race_id'|'registration_id':
-                        validator.validate_number(field, 0)
-                    case 'start_time'|'end_time'|'start_at'|'finish_at':
-                        validator.validate_datetime(field, '%H:%M:%S')
+            validate_fields(input_fields, plan)
 
+            # hand the validated input to the view, so the request is only parsed once
+            g.validated_input = input_fields
             return func(*args, **kwargs)
         return wrapper
     return decorator
 
+# get the input validated by validate_input
+def validated_input():
+    return g.validated_input
+
+# check if the current user is admin, must be called after the jwt is verified
+def current_user_is_admin():
+    # a token issued to a participant who wasn't admin is never admin, so no query is needed
+    if get_jwt().get('admin') is False:
+        return False
+    # the admin claim is checked against the database, and the flag cached for IDENTITY_CACHE_TTL seconds
+    # so an admin who has been demoted or deleted loses access in every process within that time
+    id = get_jwt_identity()
+    admin = identity_cache.get_admin(id)
+    if admin is None:
+        participant = Participant.query.get(id)
+        admin = bool(participant and participant.admin)
+        identity_cache.remember(id, admin)
+    return admin
+
 # define a decorator to check if the user is admin
 def is_admin(func):
-    @wraps(func)
     @jwt_required()
-    def wrapper(*args, **kwargs):
-        id = get_jwt_identity()
-        participant = Participant.query.get(id)
-        if not participant or not participant.admin:
+    def checked(*args, **kwargs):
+        if not current_user_is_admin():
             return abort(401, description='Invalid User')
         return func(*args, **kwargs)
-    return wrapper
\ No newline at end of file
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        # the operations of POST /batch have already been checked once for the whole batch
+        if g.get('batch') is not None:
+            return func(*args, **kwargs)
+        return checked(*args, **kwargs)
+    return wrapper
+
+
+# fields which arrive as text in a csv upload but are stored as boolean or integer
+BOOLEAN_FIELDS = ('admin', 'finished')
+INTEGER_FIELDS = ('participant_id', 'race_id', 'registration_id', 'field_limit')
+
+# read the rows of a bulk upload, the body can be either csv (with a header line) or newline delimited json
+# returns a list of (row, error) pairs, so one bad line won't abort the whole upload
+def read_bulk_rows():
+    body = request.get_data(as_text=True)
+    rows = []
+    if request.mimetype == 'text/csv':
+        for row in csv.DictReader(io.StringIO(body)):
+            fields = {}
+            for key, value in row.items():
+                # skip empty cells, so they are treated as missing fields
+                if key is None or value is None or value.strip() == '':
+                    continue
+                value = value.strip()
+                if key in BOOLEAN_FIELDS and value.lower() in ['true', 'false']:
+                    value = value.lower() == 'true'
+                elif key in INTEGER_FIELDS and value.isdigit():
+                    value = int(value)
+                fields[key] = value
+            rows.append((fields, None))
+    elif request.mimetype in ['application/x-ndjson', 'application/jsonl']:
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                rows.append((None, 'Invalid JSON'))
+                continue
+            if not isinstance(row, dict):
+                rows.append((None, 'Invalid JSON'))
+                continue
+            rows.append((row, None))
+    else:
+        return abort(415, description='Please upload the data as text/csv or application/x-ndjson')
+    return rows
+
+# validate one row of a bulk upload, returns (input_fields, error message)
+def validate_row(schema, row, required_fields=[]):
+    try:
+        input_fields = schema.load(row)
+    except ValidationError as e:
+        return None, str(e)
+    missing_fields = [field for field in required_fields if field not in input_fields]
+    if missing_fields:
+        return None, f'Please provide {", ".join(missing_fields)}'
+    # the format checks abort the request on error, catch it so we can report the error of this row only
+    try:
+        validate_fields(input_fields, compile_plan(schema))
+    except HTTPException as e:
+        return None, e.description
+    return input_fields, None
@@ -0,0 +1,34 @@
+from sqlalchemy import exc
+from werkzeug.exceptions import HTTPException
+import validator
+import age_group_cache
+import search
+import time
+
+# the libraries imported on first use, to check they are not imported when the app starts
+LAZY_MODULES = ['email_validator', 'phonenumbers', 'password_strength', 'dateutil.relativedelta', 'parse', 'pyarrow']
+
+
+# import the libraries loaded on first use and fill the caches, so the first requests of a worker don't pay for them
+# it runs in create_app when WARM_UP is set, i.e. before the worker accepts traffic
+def warm_up(app):
+    start = time.perf_counter()
+    validator.preload()
+    import dateutil.relativedelta
+    import parse
+    # pyarrow is optional, and only used by the parquet and arrow exports
+    import export
+    try:
+        export.load_pyarrow()
+    except HTTPException:
+        pass
+    with app.app_context():
+        try:
+            age_group_cache.load()
+            # the name index used by the search when the database isn't PostgreSQL
+            if not search.is_postgresql():
+                search.load()
+        # e.g. the tables don't exist yet, the cache and the index are loaded on first use instead
+        except exc.SQLAlchemyError:
+            app.logger.warning('Age groups or search index not loaded during warm up')
+    app.logger.info('Warmed up in %.0fms', (time.perf_counter() - start) * 1000)